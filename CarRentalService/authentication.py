@@ -0,0 +1,276 @@
+"""
+JWT authentication without a User query per request.
+
+Tokens issued by /api/token/ (users.serializers.ClaimsTokenObtainPairSerializer)
+carry the claims the permission checks and filters need: user_id, is_staff,
+is_superuser and tenant, the schema of the host the token was issued on.
+ClaimsJWTAuthentication verifies the signature and builds request.user from
+those claims as a ClaimsUser, which loads the User row (through the object
+cache) only when something else about the user is read.
+
+Since the row is not read, revocations are checked separately: the jtis of
+RevokedToken rows are mirrored into a bloom filter in every worker, so an
+unrevoked token is accepted without a query, and a filter hit is confirmed
+against the table (false positives are rare). Revocations of all of a
+user's tokens are few and kept exactly. New rows are picked up every
+JWT_REVOCATION_RELOAD_INTERVAL seconds, and immediately by the worker that
+revoked the token. Refreshes don't wait for that: a refresh token is checked
+against the table, and the access token it issues gets its claims from the
+User row, so no worker can mint a token with claims revoked before it.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import partial
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django_tenants.utils import get_public_schema_name, remove_www
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from users.models import Domain, RevokedToken, User
+from . import cache
+from .tenant_cache import MISSING, tenant_cache
+
+# User fields whose change revokes the user's tokens (they are claims, or decide who may hold one)
+REVOKING_FIELDS = ('is_staff', 'is_superuser', 'is_active', 'password')
+# the bloom filter is sized for at least this many revocations, with this false positive rate
+MIN_CAPACITY = 10_000
+ERROR_RATE = 0.001
+
+
+def host_schema(request):
+    """Schema of the tenant the request's host belongs to; the public schema for any other host."""
+    hostname = remove_www(request.get_host().split(':')[0])
+    tenant = tenant_cache.get(hostname)
+    if tenant is MISSING:
+        domain = Domain.objects.select_related('tenant').filter(domain=hostname).first()
+        tenant = domain.tenant if domain else None
+        tenant_cache.set(hostname, tenant)
+    return tenant.schema_name if tenant else get_public_schema_name()
+
+
+def add_claims(token, user, schema_name):
+    token['is_staff'] = user.is_staff
+    token['is_superuser'] = user.is_superuser
+    token['tenant'] = schema_name
+    return token
+
+
+def token_user_id(token):
+    """The user id claim as the User primary key type (simplejwt stores it as a string)."""
+    return User._meta.pk.to_python(token.get(api_settings.USER_ID_CLAIM))
+
+
+class ClaimsUser:
+    """
+    request.user of a token with claims. pk, is_staff and is_superuser come from the
+    token; reading anything else loads the User on first use. Pass request.user.pk
+    (not request.user) to queries and model fields.
+    """
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, token):
+        self.token = token
+        self.pk = self.id = token_user_id(token)
+        self.is_staff = bool(token.get('is_staff'))
+        self.is_superuser = bool(token.get('is_superuser'))
+        self._user = None
+
+    def get_user(self):
+        """The User row."""
+        if self._user is None:
+            try:
+                user = cache.get_object(User, self.pk)
+            except User.DoesNotExist:
+                raise AuthenticationFailed('User not found', code='user_not_found')
+            if not user.is_active:
+                raise AuthenticationFailed('User is inactive', code='user_inactive')
+            self._user = user
+        return self._user
+
+    def __getattr__(self, name):
+        # only called for what the claims don't answer
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get_user(), name)
+
+    def __eq__(self, other):
+        return isinstance(other, (ClaimsUser, User)) and other.pk == self.pk
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __str__(self):
+        return str(self.get_user())
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication with a ClaimsUser instead of a User query, and revocation checks."""
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if is_revoked(token):
+            raise InvalidToken({'detail': 'Token has been revoked', 'code': 'token_revoked'})
+        # a token issued on a tenant's host only works there (and on the shared paths)
+        tenant, public = token.get('tenant'), get_public_schema_name()
+        if tenant not in (None, public) and connection.schema_name not in (tenant, public):
+            raise AuthenticationFailed('Token was issued for another tenant', code='wrong_tenant')
+        return token
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken('Token contained no recognizable user identification')
+        # tokens issued before the claims were added
+        if 'is_staff' not in validated_token:
+            return super().get_user(validated_token)
+        return ClaimsUser(validated_token)
+
+
+class BloomFilter:
+    """A set of strings in a bit array: no false negatives, about `error_rate` false positives up to `capacity` items."""
+
+    def __init__(self, capacity, error_rate=ERROR_RATE):
+        self.capacity = capacity
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        # double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class Revocations:
+    """
+    The RevokedToken rows seen so far: revoked jtis in a bloom filter, and for
+    users whose tokens were all revoked, the latest such revocation (exact, as there are few).
+    """
+
+    def __init__(self):
+        self.filter = None
+        self.users = {}  # user id -> revoked_at
+        self.last_id = 0
+        self.checked_at = 0
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Add the rows revoked since the last refresh; rebuild (dropping expired rows) when the filter is full."""
+        with self._lock:
+            rows = RevokedToken.objects.filter(expires_at__gt=timezone.now()).order_by('id').values_list('id', 'jti', 'user_id', 'revoked_at')
+            if self.filter is not None:
+                new = list(rows.filter(id__gt=self.last_id))
+            if self.filter is None or self.filter.count + len(new) > self.filter.capacity:
+                new = list(rows)
+                self.filter, self.users = BloomFilter(max(MIN_CAPACITY, 2 * len(new))), {}
+            for row in new:
+                self._add(*row)
+            self.checked_at = time.monotonic()
+
+    def _add(self, row_id, jti, user_id, revoked_at):
+        if jti:
+            self.filter.add(jti)
+        else:
+            self.users[user_id] = max(revoked_at, self.users.get(user_id, revoked_at))
+        self.last_id = max(self.last_id, row_id or 0)
+
+    def add(self, row):
+        with self._lock:
+            if self.filter is not None:
+                self._add(None, row.jti, row.user_id, row.revoked_at)
+
+    def may_contain(self, jti):
+        return jti in self.filter
+
+    def user_revoked_at(self, user_id):
+        return self.users.get(user_id)
+
+
+_revocations = Revocations()
+
+
+def get_revocations():
+    """The revocations, with the rows other workers added since the last check."""
+    if _revocations.filter is None or time.monotonic() - _revocations.checked_at > settings.JWT_REVOCATION_RELOAD_INTERVAL:
+        _revocations.refresh()
+    return _revocations
+
+
+def is_revoked(token, exact=False):
+    """
+    Whether the token, or every token of its user up to when it was issued, has been revoked.
+    exact checks the table instead of this worker's revocations, which may not have the latest
+    rows yet: for tokens that issue others (refresh), whose new tokens would outlive the check.
+    """
+    # iat has whole seconds, so tokens issued in the second of a revocation count as revoked
+    issued_at = datetime.fromtimestamp(token.get('iat', 0), tz=dt_timezone.utc)
+    user_id, jti = token_user_id(token), token.get(api_settings.JTI_CLAIM)
+    if exact:
+        return RevokedToken.objects.filter(
+            Q(jti=jti) | Q(jti__isnull=True, user_id=user_id, revoked_at__gte=issued_at),
+            expires_at__gt=timezone.now(),
+        ).exists()
+    revocations = get_revocations()
+    revoked_at = revocations.user_revoked_at(user_id)
+    if revoked_at is not None and issued_at <= revoked_at:
+        return True
+    # a bloom filter hit may be a false positive: confirm it with the table
+    return revocations.may_contain(jti) and RevokedToken.objects.filter(jti=jti).exists()
+
+
+def _revoked(row):
+    _revocations.add(row)
+
+
+def _revoke(row):
+    # expired rows are never checked again
+    RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+    try:
+        with transaction.atomic():
+            row.save()
+    except IntegrityError:
+        # the token was revoked already
+        return None
+    transaction.on_commit(partial(_revoked, row))
+    return row
+
+
+def revoke_token(token):
+    """Revoke one token (e.g. at logout) until it expires."""
+    return _revoke(RevokedToken(
+        jti=token[api_settings.JTI_CLAIM],
+        user_id=token_user_id(token),
+        expires_at=datetime.fromtimestamp(token['exp'], tz=dt_timezone.utc),
+    ))
+
+
+def revoke_user(user_id):
+    """Revoke every token of the user issued so far."""
+    lifetime = max(api_settings.ACCESS_TOKEN_LIFETIME, api_settings.REFRESH_TOKEN_LIFETIME, timedelta(0))
+    return _revoke(RevokedToken(user_id=user_id, expires_at=timezone.now() + lifetime))
+
+
+def reset():
+    """Forget the loaded revocations (they will be reloaded lazily)."""
+    global _revocations
+    _revocations = Revocations()
@@ -0,0 +1,128 @@
+"""
+Cache layer over settings.CACHES: model instances by primary key, and view responses.
+
+Instances of tenant models are kept in the 'default' cache, whose keys
+django_tenants prefixes with the current schema; instances of models of the
+shared apps (e.g. User) are kept in 'global'. Signals drop an instance once a
+change to it commits (users/signals.py); writes that send no signals call
+objects_changed() themselves. With CACHE_BACKEND=locmem the other workers
+keep their copy for up to OBJECT_CACHE_TTL seconds, so what money is computed
+from (a vehicle's rate) is read from the database instead: vehicles are not
+cached as objects, and GET /vehicles/{id}/ goes through cached_response().
+
+cached_response() caches the data of a view's 200 responses under a key that
+includes a generation counter of every table the response is built from.
+conditional.bump(), which every write to those tables goes through, moves
+the counters on once the write commits, retiring all the responses built
+from the old rows at once. With CACHE_BACKEND=locmem only the worker that
+made a change sees it; the others catch up after RESPONSE_CACHE_TTL seconds.
+"""
+import hashlib
+import time
+from functools import partial, wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.http import Http404
+from django_tenants.utils import schema_context
+from rest_framework.response import Response
+
+
+def _shared_app_labels():
+    tenant_apps = {app.rsplit('.', 1)[-1] for app in settings.TENANT_APPS}
+    return {app.rsplit('.', 1)[-1] for app in settings.SHARED_APPS} - tenant_apps
+
+
+def cache_for(model):
+    """The cache for instances of `model`: 'global' for models of the shared apps, else 'default'."""
+    return caches['global' if model._meta.app_label in _shared_app_labels() else 'default']
+
+
+def _object_key(model, pk):
+    return f'object:{model._meta.label_lower}:{pk}'
+
+
+def get_object(model, pk):
+    """The instance of `model` with primary key `pk`, from the cache when possible. Raises model.DoesNotExist."""
+    try:
+        pk = model._meta.pk.to_python(pk)
+    except ValidationError:
+        raise model.DoesNotExist(f'{model._meta.object_name} matching query does not exist.')
+    cache, key = cache_for(model), _object_key(model, pk)
+    instance = cache.get(key)
+    if instance is None:
+        instance = model._default_manager.get(pk=pk)
+        cache.set(key, instance, settings.OBJECT_CACHE_TTL)
+    return instance
+
+
+def get_object_or_404(model, pk):
+    try:
+        return get_object(model, pk)
+    except model.DoesNotExist:
+        raise Http404(f'No {model._meta.object_name} matches the given query.')
+
+
+def _drop_objects(schema_name, model, pks):
+    with schema_context(schema_name):
+        cache_for(model).delete_many([_object_key(model, pk) for pk in pks])
+
+
+def objects_changed(model, pks):
+    """Drop the cached instances of `model` with these primary keys once the current transaction commits."""
+    transaction.on_commit(partial(_drop_objects, connection.schema_name, model, list(pks)))
+
+
+def _generation_key(table):
+    return f'generation:{table}'
+
+
+def generations(models):
+    """The current generation of each model's table (in the current tenant's cache)."""
+    cache = caches['default']
+    keys = [_generation_key(model._meta.db_table) for model in models]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            # start from the clock, so a generation that was evicted never comes back with an old value
+            cache.add(key, time.time_ns(), None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def tables_changed(tables):
+    """Retire the cached responses built from these tables (called by conditional.bump on commit)."""
+    cache = caches['default']
+    for table in tables:
+        try:
+            cache.incr(_generation_key(table))
+        except ValueError:
+            # no generation yet: nothing has been cached under it
+            pass
+
+
+def request_variant(request):
+    """What a response depends on besides the data: the user, the full path and the Accept header."""
+    user = request.user
+    return '|'.join(map(str, [user.pk, user.is_staff, user.is_superuser, request.get_full_path(), request.headers.get('Accept', '')]))
+
+
+def cached_response(*models):
+    """Cache the data of a view method's 200 responses until one of the models' tables changes."""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            parts = [type(view).__qualname__, method.__name__, *generations(models), request_variant(request)]
+            key = 'response:' + hashlib.blake2b('|'.join(map(str, parts)).encode(), digest_size=16).hexdigest()
+            cache = caches['default']
+            data = cache.get(key)
+            if data is not None:
+                return Response(data)
+            response = method(view, request, *args, **kwargs)
+            if isinstance(response, Response) and response.status_code == 200:
+                cache.set(key, response.data, settings.RESPONSE_CACHE_TTL)
+            return response
+        return wrapper
+    return decorator
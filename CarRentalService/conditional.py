@@ -0,0 +1,146 @@
+"""
+Conditional GET for read-only endpoints that clients poll.
+
+Every change to a table bumps that table's counter in TableVersion (per
+tenant schema, on commit; see bump()). A view lists, per action, the models
+its responses are built from, and ConditionalGetMixin derives a weak ETag
+from their counters plus everything else the response depends on (tenant,
+user, path and query string, Accept header). A request whose If-None-Match
+still matches gets a 304 straight after authentication and permission
+checks: one primary-key lookup in TableVersion, no query on the tables
+themselves and no serializer.
+
+The ETag is computed before the response is built, so a write that commits
+in between can only make the response newer than its ETag, never older.
+"""
+import hashlib
+
+from django.db import connection, transaction
+from django.utils.http import parse_etags
+from django_tenants.utils import schema_context
+from rest_framework import status
+from rest_framework.response import Response
+
+from .cache import request_variant, tables_changed
+
+
+def _bump(schema_name, tables):
+    from vehicles.models import TableVersion
+
+    table_name = connection.ops.quote_name(TableVersion._meta.db_table)
+    with schema_context(schema_name), connection.cursor() as cursor:
+        for table in sorted(tables):
+            cursor.execute(
+                f'INSERT INTO {table_name} ("table", version) VALUES (%s, 1) '
+                f'ON CONFLICT ("table") DO UPDATE SET version = {table_name}.version + 1',
+                [table],
+            )
+        # the responses cached from these tables are stale too
+        tables_changed(tables)
+
+
+def bump(*models):
+    """
+    Move the ETags of everything built from these models' tables on, once the current
+    transaction commits (a rolled back write keeps them). Writes that send no signals
+    (QuerySet.update, bulk_create, raw SQL) have to call this themselves.
+
+    A transaction bumps each table once, however many rows it writes: the tables are
+    added to the callback an earlier bump() queued, as long as that one is sure to run
+    if these writes commit.
+    """
+    schema_name = connection.schema_name
+    tables = {model._meta.db_table for model in models}
+    queued = _queued_bump(schema_name)
+    if queued is not None:
+        queued.tables.update(tables)
+        return
+    callback = _Bump(schema_name, tables)
+    transaction.on_commit(callback)
+    if connection.in_atomic_block:
+        if not hasattr(connection, 'queued_bumps'):
+            connection.queued_bumps = {}
+        connection.queued_bumps[schema_name] = (len(connection.run_on_commit) - 1, callback)
+
+
+class _Bump:
+    """The on_commit callback of bump(): the tables of one schema written by the transaction."""
+
+    def __init__(self, schema_name, tables):
+        self.schema_name = schema_name
+        self.tables = tables
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        _bump(self.schema_name, self.tables)
+
+
+def _queued_bump(schema_name):
+    """The _Bump the current transaction queued for this schema, if it runs whenever the current writes commit."""
+    if not connection.in_atomic_block:
+        return None
+    position, callback = getattr(connection, 'queued_bumps', {}).get(schema_name, (0, None))
+    # (done: captureOnCommitCallbacks in tests runs the callbacks before the transaction ends)
+    if callback is None or callback.done or position >= len(connection.run_on_commit):
+        return None
+    # gone if it was queued by an earlier transaction or dropped with a rolled back savepoint
+    # (which rebuilds the list); otherwise the savepoints it was queued in are released or
+    # still enclose the current writes, so it can't be dropped without them
+    if connection.run_on_commit[position][1] is not callback:
+        return None
+    return callback
+
+
+def versions(models):
+    """The current counters of the models' tables, in the order given (0 if never written)."""
+    from vehicles.models import TableVersion
+
+    tables = [model._meta.db_table for model in models]
+    current = dict(TableVersion.objects.filter(table__in=tables).values_list('table', 'version'))
+    return [current.get(table, 0) for table in tables]
+
+
+def compute_etag(request, models):
+    key = '|'.join(map(str, [connection.schema_name, *versions(models), request_variant(request)]))
+    return 'W/"%s"' % hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+def etag_matches(header, etag):
+    """Weak comparison of an If-None-Match header against an ETag."""
+    etags = parse_etags(header)
+    return '*' in etags or etag.removeprefix('W/') in (candidate.removeprefix('W/') for candidate in etags)
+
+
+class ConditionalGetMixin:
+    """
+    ETag / If-None-Match support for a DRF view. Set conditional_actions to
+    {action name: [models whose rows make up that action's responses]}.
+    """
+    conditional_actions = {}
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.etag = None
+        models = self.conditional_actions.get(self.action)
+        if models and request.method in ('GET', 'HEAD'):
+            self.etag = compute_etag(request, models)
+            if etag_matches(request.headers.get('If-None-Match', ''), self.etag):
+                raise NotModified
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'etag', None) and response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = self.etag
+            # clients may keep the response, but have to revalidate it on every use
+            response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+class NotModified(Exception):
+    """Raised by ConditionalGetMixin.initial to skip the handler."""
@@ -0,0 +1 @@
+# Tenant-aware pooled PostgreSQL backend (ENGINE = 'CarRentalService.db_backend')
@@ -0,0 +1,145 @@
+"""
+Tenant-aware PostgreSQL backend with connection pooling.
+
+django_tenants' backend forgets the search_path whenever a tenant is selected,
+so every request issues SET search_path (every cursor, unless
+TENANT_LIMIT_SET_CALLS is on). This backend remembers the search_path in
+effect on each physical connection and only issues the SET when it would
+change it. With psycopg 3 and OPTIONS['pool'], connections come from Django's
+psycopg_pool and are reused across requests; checkout latency and search_path
+counters are kept for pool_stats(). A forked process (migrate_tenants and
+create_tenants workers) doesn't use the pools it inherits, whose sockets are
+the parent's: it opens its own.
+"""
+import os
+import threading
+import time
+import weakref
+
+from django_tenants.postgresql_backend.base import DatabaseWrapper as TenantDatabaseWrapper
+
+# search_path in effect on each physical connection. Pooled connections outlive
+# the DatabaseWrapper that checked them out, so this is keyed by the connection.
+_search_paths = weakref.WeakKeyDictionary()
+_search_paths_lock = threading.Lock()
+
+
+class BackendMetrics:
+    """Per-process counters of connection checkouts and search_path switches."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_seconds = 0.0
+        self.checkout_seconds_max = 0.0
+        self.search_path_sets = 0
+        self.search_path_skips = 0
+
+    def record_checkout(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_seconds += seconds
+            self.checkout_seconds_max = max(self.checkout_seconds_max, seconds)
+
+    def record_search_path(self, skipped):
+        with self._lock:
+            if skipped:
+                self.search_path_skips += 1
+            else:
+                self.search_path_sets += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'checkout_ms_avg': round(self.checkout_seconds / self.checkouts * 1000, 3) if self.checkouts else None,
+                'checkout_ms_max': round(self.checkout_seconds_max * 1000, 3),
+                'search_path_sets': self.search_path_sets,
+                'search_path_skips': self.search_path_skips,
+            }
+
+
+metrics = BackendMetrics()
+
+
+def pool_stats(connection):
+    """Metrics of this process: checkouts and search_path counters, plus psycopg_pool's stats when pooled."""
+    stats = metrics.snapshot()
+    pool = connection.pool
+    if pool is not None:
+        # pool_size, pool_available, requests_waiting, requests_wait_ms, connections_ms, ...
+        stats['pool'] = pool.get_stats()
+    return stats
+
+
+class DatabaseWrapper(TenantDatabaseWrapper):
+
+    def get_new_connection(self, conn_params):
+        # With a pool this is a checkout, otherwise a new physical connection
+        started = time.perf_counter()
+        connection = super().get_new_connection(conn_params)
+        metrics.record_checkout(time.perf_counter() - started)
+        return connection
+
+    def _handle_search_path(self, cursor=None):
+        if self._setting_search_path or not self.schema_name or self.connection is None:
+            return super()._handle_search_path(cursor)
+
+        search_paths = self._get_cursor_search_paths()
+        if _search_paths.get(self.connection) == search_paths:
+            # this physical connection is already on the right schemas
+            self.search_path_set_schemas = search_paths
+            metrics.record_search_path(skipped=True)
+            return
+
+        super()._handle_search_path(cursor)
+        with _search_paths_lock:
+            if self.search_path_set_schemas == search_paths:
+                _search_paths[self.connection] = search_paths
+            else:
+                _search_paths.pop(self.connection, None)
+        metrics.record_search_path(skipped=False)
+
+    def _forget_search_path(self):
+        if self.connection is not None:
+            with _search_paths_lock:
+                _search_paths.pop(self.connection, None)
+
+    def rollback(self):
+        # a SET issued in the rolled back transaction is reverted by PostgreSQL
+        try:
+            super().rollback()
+        finally:
+            self._forget_search_path()
+
+    def savepoint_rollback(self, sid):
+        # Forgotten after the rollback, not before: getting the cursor for it goes through
+        # _handle_search_path(), which would record a SET that ROLLBACK TO SAVEPOINT then discards.
+        try:
+            super().savepoint_rollback(sid)
+        finally:
+            self._forget_search_path()
+
+    def close(self):
+        # A connection returned mid-transaction is rolled back by the pool (or
+        # dropped), which may revert a SET issued in that transaction.
+        if self.connection is not None and not self.autocommit:
+            self._forget_search_path()
+        super().close()
+
+
+# Pools inherited from the parent process, never used again. They stay referenced:
+# collecting a pool signals worker threads that don't exist in the child.
+_inherited_pools = []
+
+
+def _drop_inherited_pools():
+    global _search_paths_lock
+    _inherited_pools.extend(DatabaseWrapper._connection_pools.values())
+    DatabaseWrapper._connection_pools.clear()
+    # another thread of the parent may have held these when it forked
+    _search_paths_lock = threading.Lock()
+    metrics._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_drop_inherited_pools)
@@ -0,0 +1,87 @@
+"""
+JSON encoding and decoding for the API, on orjson when it is installed.
+
+dumps() gives the bytes DRF's JSONRenderer would (compact separators, UTF-8
+rather than \\u escapes): orjson writes str, int, float, bool, None, lists,
+dicts, datetimes, dates and UUIDs itself, in the same formats as DRF's
+JSONEncoder (UTC datetimes end in 'Z'), and hands everything else to that
+encoder's default(), so Decimals, lazy strings, timedeltas and numpy values
+come out exactly as before. Data orjson refuses (integers beyond 64 bits,
+dicts with keys that aren't strings) is encoded by the json module instead.
+Known differences: floats in exponent notation are written without '+'
+(1e16, not 1e+16), NaN and infinities are written as null instead of
+raising ValueError, and loads() reads integers beyond 64 bits as floats.
+loads() rejects NaN and Infinity either way, as DRF's STRICT_JSON parser
+does.
+
+Without orjson, dumps() and loads() are the json module with DRF's encoder,
+and the renderer and parser behave like DRF's own.
+"""
+import json
+
+from django.conf import settings
+from rest_framework import parsers, renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.json import strict_constant
+
+try:
+    import orjson
+except ImportError:  # the json module does the same work, slower
+    orjson = None
+
+_encoder = JSONEncoder()
+
+if orjson is not None:
+    # (OPT_NON_STR_KEYS would slow every dict down; the few dicts with other keys take the fallback)
+    _OPTIONS = orjson.OPT_UTC_Z
+
+
+def dumps(data):
+    """Compact UTF-8 JSON of data (bytes), encoding what DRF's JSONEncoder encodes."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, default=_encoder.default, option=_OPTIONS)
+        except orjson.JSONEncodeError:
+            pass  # the json module encodes it, or raises its usual error
+    return json.dumps(data, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def loads(content):
+    """The value of a UTF-8 JSON document (bytes or str)."""
+    if orjson is not None:
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            pass  # let the json module decide, so errors read the same either way
+    return json.loads(content, parse_constant=strict_constant)
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """DRF's JSONRenderer, rendering through dumps() unless asked for indented or ASCII-only output."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # the browsable API asks for indent=4; json.dumps does that
+        if self.ensure_ascii or not self.compact or not self.strict or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        ret = dumps(data)
+        # as in DRF: escape \u2028 and \u2029 so the output is a strict javascript subset
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
+
+
+class JSONParser(parsers.JSONParser):
+    """DRF's JSONParser, parsing UTF-8 request bodies with loads()."""
+    renderer_class = JSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or not self.strict or encoding.lower().replace('_', '-') not in ('utf-8', 'utf8'):
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return loads(stream.read())
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -5,23 +5,40 @@ from django.db import connection
 from django_tenants.middleware import TenantMiddleware as BaseTenantMiddleware
 from django_tenants.utils import get_public_schema_name
 from django.http import HttpResponseNotFound
+from .tenant_cache import MISSING, tenant_cache
 
 
 class CustomTenantMiddleware(BaseTenantMiddleware):
     """
     Custom TenantMiddleware that allows admin and public paths to work
     in the public schema without requiring a tenant domain.
+    Tenants are resolved through the per-worker tenant_cache, so a warm
+    worker routes requests without any database query.
     """
-    
+
     PUBLIC_PATHS = ['/admin/', '/api/token/', '/api/token/refresh/', '/api/schema/', '/users/']
-    
+    # str.startswith with a tuple checks every prefix in one call
+    PUBLIC_PATH_PREFIXES = tuple(PUBLIC_PATHS)
+
     def process_request(self, request):
         # Check if this is a request to a public path
-        for public_path in self.PUBLIC_PATHS:
-            if request.path.startswith(public_path):
-                # Set to public schema and skip tenant resolution
-                connection.set_schema_to_public()
-                return None
-        
+        if request.path.startswith(self.PUBLIC_PATH_PREFIXES):
+            # Set to public schema and skip tenant resolution
+            connection.set_schema_to_public()
+            return None
+
         # Otherwise, use the default tenant middleware logic
         return super().process_request(request)
+
+    def get_tenant(self, domain_model, hostname):
+        tenant = tenant_cache.get(hostname)
+        if tenant is MISSING:
+            try:
+                tenant = super().get_tenant(domain_model, hostname)
+            except domain_model.DoesNotExist:
+                tenant_cache.set(hostname, None)
+                raise
+            tenant_cache.set(hostname, tenant)
+        elif tenant is None:
+            raise domain_model.DoesNotExist()
+        return tenant
@@ -0,0 +1,177 @@
+"""
+Query budgets: how many SQL queries, and how much database time, each request costs.
+
+QueryBudgetMiddleware counts the queries every request runs on the default
+connection (with an execute wrapper, so DEBUG is not needed) and adds them to
+this worker's per-tenant totals (GET /users/clients/query-stats/). A view
+declares the most queries an action may run in `query_budget`, either a
+number for every action or {action: number} (for APIViews the action is the
+lowercase method), like conditional_actions.
+
+A request over its budget, or one that runs the same SQL template
+QUERY_REPEAT_LIMIT times or more (an N+1 loop: one query per row of an
+earlier query), is logged as a warning, or raised as QueryBudgetExceeded
+when QUERY_BUDGET_RAISE is set, as CarRentalService/testing.py's
+QueryCountAssertions does in tests.
+Templates are the SQL with its parameters left out and IN lists and
+numbers collapsed, so `... WHERE id = %s LIMIT 21` run for 20 rows counts as
+one template run 20 times.
+
+Queries run while a StreamingHttpResponse is being sent (NDJSON exports)
+happen after the middleware has returned and are not counted.
+"""
+import functools
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+_PARAMETER_LIST = re.compile(r'%s(?:, %s)+')
+_NUMBER = re.compile(r'\b\d+\b')
+# sent by django_tenants' database backend before a query in another schema
+SEARCH_PATH = 'SET search_path'
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=1024)
+def sql_template(sql):
+    """The SQL with IN lists of any length and numbers (LIMIT, OFFSET) made alike."""
+    return _NUMBER.sub('N', _PARAMETER_LIST.sub('%s, ...', sql))
+
+
+class QueryStats:
+    """Queries run through a connection while this is installed as its execute wrapper."""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.templates = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.startswith(SEARCH_PATH):
+            # whether the schema has to be set depends on the connection a request gets, not on its view
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - start
+            self.count += 1
+            self.templates[sql_template(sql)] += 1
+
+    def repeated(self, limit):
+        """(template, times) of the templates run at least `limit` times, most frequent first."""
+        return [(template, times) for template, times in self.templates.most_common() if times >= limit]
+
+    def describe(self):
+        return '\n'.join(f'  {times}x {template}' for template, times in self.templates.most_common())
+
+
+class TenantQueryStats:
+    """Per-tenant query totals of the requests this worker has answered."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tenants = {}
+
+    def record(self, schema_name, stats, over_budget, repeated):
+        with self._lock:
+            totals = self._tenants.get(schema_name)
+            if totals is None:
+                totals = self._tenants[schema_name] = {
+                    'requests': 0, 'queries': 0, 'db_time': 0.0, 'max_queries': 0, 'over_budget': 0, 'repeated': 0,
+                }
+            totals['requests'] += 1
+            totals['queries'] += stats.count
+            totals['db_time'] += stats.time
+            totals['max_queries'] = max(totals['max_queries'], stats.count)
+            totals['over_budget'] += over_budget
+            totals['repeated'] += repeated
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'tenants': {
+                    schema_name: {
+                        'requests': totals['requests'],
+                        'queries': totals['queries'],
+                        'queries_per_request': round(totals['queries'] / totals['requests'], 2),
+                        'max_queries': totals['max_queries'],
+                        'db_ms': round(totals['db_time'] * 1000, 1),
+                        'db_ms_per_request': round(totals['db_time'] * 1000 / totals['requests'], 3),
+                        # requests over their view's budget, and requests with an N+1 loop
+                        'over_budget': totals['over_budget'],
+                        'repeated': totals['repeated'],
+                    }
+                    for schema_name, totals in sorted(self._tenants.items())
+                },
+            }
+
+    def reset(self):
+        with self._lock:
+            self._tenants.clear()
+
+
+tenant_query_stats = TenantQueryStats()
+
+
+def view_budget(view_func, method):
+    """The query_budget a view declares for the action answering `method`, or None."""
+    # DRF's as_view() sets cls, and actions ({method: action}) for viewsets
+    budget = getattr(getattr(view_func, 'cls', None), 'query_budget', None)
+    if isinstance(budget, dict):
+        method = method.lower()
+        budget = budget.get((getattr(view_func, 'actions', None) or {}).get(method, method))
+    return budget
+
+
+class QueryBudgetMiddleware:
+    """
+    Counts the queries of each request (request.query_stats) and reports requests over their
+    view's query_budget or with an N+1 loop. Goes after the tenant middleware, so routing
+    queries are not counted and connection.schema_name is the request's tenant.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = request.query_stats = QueryStats()
+        request.query_budget = None
+        with connection.execute_wrapper(stats):
+            response = self.get_response(request)
+
+        budget = request.query_budget
+        over_budget = budget is not None and stats.count > budget
+        repeated = stats.repeated(settings.QUERY_REPEAT_LIMIT)
+        tenant_query_stats.record(connection.schema_name, stats, over_budget, bool(repeated))
+        if settings.DEBUG:
+            response['Server-Timing'] = f'db;dur={stats.time * 1000:.1f};desc="{stats.count} queries"'
+        if over_budget or repeated:
+            self.report(request, stats, budget, repeated)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = view_budget(view_func, request.method)
+
+    def report(self, request, stats, budget, repeated):
+        problems = []
+        if budget is not None and stats.count > budget:
+            problems.append(f'{stats.count} queries, over its budget of {budget}')
+        if repeated:
+            problems.append('repeated queries (N+1): ' + '; '.join(f'{times}x {template}' for template, times in repeated))
+        message = f'{request.method} {request.path} ran {", ".join(problems)} in {stats.time * 1000:.1f}ms'
+        if settings.QUERY_BUDGET_RAISE:
+            raise QueryBudgetExceeded(f'{message}\n{stats.describe()}')
+        logger.warning(message)
@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
-from decouple import config  # To manage environment variables
+from decouple import config, Choices  # To manage environment variables
 import stripe 
 from dj_database_url import parse as db_url
 
@@ -50,6 +50,17 @@ else:
     # Print a warning and allow development to continue.
     print("⚠️ WARNING: STRIPE_SECRET_KEY not found in environment. Stripe endpoints will fail.")
 
+# Point Stripe at another server, e.g. `python manage.py fake_stripe` for tests and load runs
+STRIPE_API_BASE = config('STRIPE_API_BASE', default='')
+if STRIPE_API_BASE:
+    stripe.api_base = STRIPE_API_BASE
+
+# Payment outbox workers (python manage.py process_payments)
+PAYMENT_MAX_ATTEMPTS = config('PAYMENT_MAX_ATTEMPTS', default=5, cast=int)
+PAYMENT_RETRY_DELAY = config('PAYMENT_RETRY_DELAY', default=5, cast=int) # seconds; doubled on every attempt
+PAYMENT_RETRY_MAX_DELAY = config('PAYMENT_RETRY_MAX_DELAY', default=600, cast=int)
+PAYMENT_TASK_LEASE = config('PAYMENT_TASK_LEASE', default=300, cast=int) # seconds before a stuck 'processing' task is claimed again
+
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = config('DEBUG', default=False, cast=bool)
 
@@ -66,6 +77,7 @@ SHARED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'users', 
     'rest_framework',
     'drf_spectacular',
@@ -88,7 +100,7 @@ AUTH_USER_MODEL = 'users.User'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         # Enable JWT Token Authentication by default
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'CarRentalService.authentication.ClaimsJWTAuthentication',
         # Session authentication for the browsable API
         'rest_framework.authentication.SessionAuthentication', 
     ),
@@ -103,7 +115,100 @@ REST_FRAMEWORK = {
         'rest_framework.filters.OrderingFilter',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # DRF's JSON renderer and parser on orjson (stdlib json when it isn't installed)
+    'DEFAULT_RENDERER_CLASSES': (
+        'CarRentalService.fastjson.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'CarRentalService.fastjson.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+    # Only views that set throttle_classes are throttled (POST /rentals/quotes/ for anonymous users)
+    'DEFAULT_THROTTLE_RATES': {
+        'anon': config('ANON_THROTTLE_RATE', default='60/minute'),
+    },
+}
+
+# Caches. Keys of 'default' start with the current tenant schema (django_tenants make_key), so
+# tenant data can't be read from another tenant; 'global' holds data of the shared apps (users)
+# and cross-tenant reports. CACHE_BACKEND=locmem keeps one cache per process; CACHE_BACKEND=file
+# shares one between the gunicorn workers of a host, under CACHE_LOCATION (/dev/shm is in memory).
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem', cast=Choices(['locmem', 'file']))
+CACHE_LOCATION = config('CACHE_LOCATION', default='/dev/shm/carrental-cache')
+CACHE_MAX_ENTRIES = config('CACHE_MAX_ENTRIES', default=10000, cast=int)
+_CACHE_BACKENDS = {
+    'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+    'file': 'django.core.cache.backends.filebased.FileBasedCache',
 }
+CACHES = {
+    'default': {
+        'BACKEND': _CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.path.join(CACHE_LOCATION, 'tenant') if CACHE_BACKEND == 'file' else 'tenant',
+        'KEY_FUNCTION': 'django_tenants.cache.make_key',
+        'REVERSE_KEY_FUNCTION': 'django_tenants.cache.reverse_key',
+        'OPTIONS': {'MAX_ENTRIES': CACHE_MAX_ENTRIES},
+    },
+    'global': {
+        'BACKEND': _CACHE_BACKENDS[CACHE_BACKEND],
+        'LOCATION': os.path.join(CACHE_LOCATION, 'global') if CACHE_BACKEND == 'file' else 'global',
+        'OPTIONS': {'MAX_ENTRIES': CACHE_MAX_ENTRIES},
+    },
+}
+# Lifetimes (seconds) of cached model instances and of cached responses (CarRentalService/cache.py)
+OBJECT_CACHE_TTL = config('OBJECT_CACHE_TTL', default=300, cast=int)
+RESPONSE_CACHE_TTL = config('RESPONSE_CACHE_TTL', default=60, cast=int)
+
+# Per-worker hostname -> tenant cache of CustomTenantMiddleware
+TENANT_CACHE_TTL = config('TENANT_CACHE_TTL', default=300, cast=int)
+TENANT_CACHE_SIZE = config('TENANT_CACHE_SIZE', default=1024, cast=int)
+
+# Cross-tenant analytics (GET /users/clients/analytics/): schemas queried in parallel, report cache lifetime in seconds
+ANALYTICS_WORKERS = config('ANALYTICS_WORKERS', default=8, cast=int)
+ANALYTICS_CACHE_TTL = config('ANALYTICS_CACHE_TTL', default=300, cast=int)
+
+# Email (rental notifications). Use the locmem or filebased backend for tests and load runs.
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
+EMAIL_FILE_PATH = config('EMAIL_FILE_PATH', default=os.path.join(BASE_DIR, 'sent_emails'))
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='no-reply@carrental.local')
+EMAIL_HOST = config('EMAIL_HOST', default='localhost')
+EMAIL_PORT = config('EMAIL_PORT', default=25, cast=int)
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=False, cast=bool)
+
+# Rental notifications are collected for this many seconds and sent as one batch
+NOTIFICATION_BATCH_WINDOW = config('NOTIFICATION_BATCH_WINDOW', default=2.0, cast=float)
+NOTIFICATION_BATCH_SIZE = config('NOTIFICATION_BATCH_SIZE', default=500, cast=int)
+
+# Seconds a worker keeps its in-memory availability index before reloading it
+# (writes made by the same worker are applied immediately through signals)
+AVAILABILITY_INDEX_TTL = config('AVAILABILITY_INDEX_TTL', default=60, cast=int)
+
+# Spatial index behind GET /vehicles/nearby/: reload interval, grid cell size (degrees)
+# and the largest search radius (km) a request may ask for
+GEO_INDEX_TTL = config('GEO_INDEX_TTL', default=60, cast=int)
+GEO_CELL_DEGREES = config('GEO_CELL_DEGREES', default=0.1, cast=float)
+GEO_MAX_RADIUS_KM = config('GEO_MAX_RADIUS_KM', default=500, cast=float)
+
+# Vehicle search (GET /vehicles/search/): most results per query, and how long a worker keeps
+# a tenant's make/model vocabulary used to correct misspellings
+VEHICLE_SEARCH_MAX_RESULTS = config('VEHICLE_SEARCH_MAX_RESULTS', default=50, cast=int)
+VEHICLE_SEARCH_VOCABULARY_TTL = config('VEHICLE_SEARCH_VOCABULARY_TTL', default=300, cast=int)
+
+# Telemetry ingest (POST /vehicles/telemetry/): readings are coalesced per vehicle and written
+# every TELEMETRY_FLUSH_INTERVAL seconds, or sooner once TELEMETRY_MAX_PENDING vehicles wait
+TELEMETRY_FLUSH_INTERVAL = config('TELEMETRY_FLUSH_INTERVAL', default=2.0, cast=float)
+TELEMETRY_MAX_PENDING = config('TELEMETRY_MAX_PENDING', default=5000, cast=int)
+TELEMETRY_MAX_READINGS = config('TELEMETRY_MAX_READINGS', default=10000, cast=int)
+TELEMETRY_WRITE_BATCH_SIZE = config('TELEMETRY_WRITE_BATCH_SIZE', default=5000, cast=int)
+# upper bound on the buckets GET /vehicles/{id}/telemetry/ downsamples a range to
+TELEMETRY_MAX_POINTS = config('TELEMETRY_MAX_POINTS', default=5000, cast=int)
+
+# Fleet occupancy calendar (GET /vehicles/calendar/): cache lifetime and longest window served
+CALENDAR_CACHE_TTL = config('CALENDAR_CACHE_TTL', default=300, cast=int)
+CALENDAR_MAX_DAYS = config('CALENDAR_MAX_DAYS', default=366, cast=int)
 
 # Simple JWT Configuration (Set token lifespan)
 from datetime import timedelta
@@ -111,10 +216,23 @@ from datetime import timedelta
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
+    # tokens carry is_staff, is_superuser and the tenant (CarRentalService/authentication.py)
+    'TOKEN_OBTAIN_SERIALIZER': 'users.serializers.ClaimsTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'users.serializers.ClaimsTokenRefreshSerializer',
 }
 
+# Seconds before a token revoked in another worker is rejected by this one
+JWT_REVOCATION_RELOAD_INTERVAL = config('JWT_REVOCATION_RELOAD_INTERVAL', default=5, cast=int)
+
+# Query budgets (CarRentalService/query_budget.py): a request running one SQL template this many times
+# is reported as an N+1 loop; QUERY_BUDGET_RAISE raises instead of logging reports (tests)
+QUERY_REPEAT_LIMIT = config('QUERY_REPEAT_LIMIT', default=5, cast=int)
+QUERY_BUDGET_RAISE = config('QUERY_BUDGET_RAISE', default=False, cast=bool)
+
 MIDDLEWARE = [
     'CarRentalService.middleware.CustomTenantMiddleware',
+    # counts the queries of each request against its view's query_budget (CarRentalService/query_budget.py)
+    'CarRentalService.query_budget.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -165,12 +283,10 @@ if DATABASE_URL:
             conn_max_age=600,
         )
     }
-    DATABASES['default']['ENGINE'] = 'django_tenants.postgresql_backend'
 else:
     # Local development using docker-compose
     DATABASES = {
         'default': {
-            'ENGINE': 'django_tenants.postgresql_backend',
             'NAME': config('POSTGRES_DB', default='car_rental_db'),
             'USER': config('POSTGRES_USER', default='postgres'),
             'PASSWORD': DB_PASSWORD if DB_PASSWORD else config('POSTGRES_PASSWORD', default='password'),
@@ -179,6 +295,19 @@ else:
         }
     }
 
+# django_tenants' backend, plus a connection pool and search_path reuse (CarRentalService/db_backend)
+DATABASES['default']['ENGINE'] = 'CarRentalService.db_backend'
+
+# Connection pool (needs psycopg 3 with psycopg_pool). Pooling replaces persistent connections.
+DB_POOL = config('DB_POOL', default=True, cast=bool)
+if DB_POOL:
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+        'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+        'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+        'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int), # seconds to wait for a free connection
+    }
+
 DATABASE_ROUTERS = (
     'django_tenants.routers.TenantSyncRouter',
 )
@@ -0,0 +1,65 @@
+"""
+Per-worker hostname -> tenant cache used by CustomTenantMiddleware.
+
+Entries expire after TENANT_CACHE_TTL seconds and the least recently used
+ones are evicted beyond TENANT_CACHE_SIZE. Unknown hostnames are cached too
+(as None) so junk Host headers don't hit the database either. users/signals.py
+clears the cache when a Client or Domain changes in this worker; other workers
+pick the change up when their entries expire.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+# returned by get() when the hostname is not cached (None means "cached as unknown")
+MISSING = object()
+
+
+class TenantCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # hostname -> (expires_at, tenant or None)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, hostname):
+        with self._lock:
+            entry = self._entries.get(hostname)
+            if entry is None or entry[0] < time.monotonic():
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(hostname)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, hostname, tenant):
+        with self._lock:
+            self._entries[hostname] = (time.monotonic() + self.ttl, tenant)
+            self._entries.move_to_end(hostname)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'pid': os.getpid(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+            }
+
+
+tenant_cache = TenantCache(settings.TENANT_CACHE_SIZE, settings.TENANT_CACHE_TTL)
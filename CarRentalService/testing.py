@@ -0,0 +1,74 @@
+"""
+Helpers shared by the apps' tests.py.
+
+TenantAPITestMixin starts every test from this process's empty caches and
+in-memory indexes (availability, geo, search, revocations, tenant routing),
+which would otherwise carry rows of earlier tests, and gives it a user, an
+admin and JWT clients for both. QueryCountAssertions pins the queries of a
+request as CarRentalService/query_budget.py counts them.
+"""
+from django.core.cache import caches
+from django.test.utils import override_settings
+from django_tenants.test.client import TenantClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from users.models import User
+from vehicles import availability, geo, search
+from . import authentication
+from .tenant_cache import tenant_cache
+
+
+def reset_process_state():
+    """Forget what this process has cached or indexed: everything is reloaded from the database."""
+    for name in ('default', 'global'):
+        caches[name].clear()
+    tenant_cache.clear()
+    availability.reset()
+    geo.reset()
+    search.reset()
+    authentication.reset()
+
+
+class TenantAPITestMixin:
+    """
+    TenantTestCase mixin for endpoint tests: self.user and self.admin (is_staff), and
+    self.client and self.admin_client sending their access tokens to the test tenant.
+    Revocations are loaded once: another revocation reaches them only through the
+    on_commit callback of the worker that made it, as JWT_REVOCATION_RELOAD_INTERVAL
+    is set to an hour.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(JWT_REVOCATION_RELOAD_INTERVAL=3600))
+        reset_process_state()
+        authentication.get_revocations()
+        self.user = User.objects.create_user(username='tester', email='tester@example.com', password=None)
+        self.admin = User.objects.create_user(username='tester-admin', email='tester-admin@example.com', password=None, is_staff=True)
+        self.client = self.client_for(self.user)
+        self.admin_client = self.client_for(self.admin)
+
+    def client_for(self, user):
+        token = authentication.add_claims(RefreshToken.for_user(user), user, self.tenant.schema_name).access_token
+        return TenantClient(self.tenant, HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def iso(self, value):
+        """A datetime as the API's date parameters take it."""
+        return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class QueryCountAssertions:
+    """
+    TestCase mixin pinning the number of queries a request runs, as QueryBudgetMiddleware
+    counts them. Requests run with QUERY_BUDGET_RAISE, so one over its view's budget or
+    with an N+1 loop fails the test with QueryBudgetExceeded.
+    """
+
+    def assertRequestQueries(self, number, request, *args, status_code=200, **kwargs):
+        """Make the request (e.g. self.client.get, path, data) and check its status code and query count."""
+        with override_settings(QUERY_BUDGET_RAISE=True):
+            response = request(*args, **kwargs)
+        self.assertEqual(response.status_code, status_code, getattr(response, 'content', b'')[:500])
+        stats = response.wsgi_request.query_stats
+        self.assertEqual(stats.count, number, f'{stats.count} queries run, {number} expected:\n{stats.describe()}')
+        return response
@@ -20,6 +20,7 @@ from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
 )
+from users.views import TokenRevokeView
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
 
@@ -33,6 +34,7 @@ urlpatterns = [
     #JWT urls
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'), # JWT Token obtain endpoint
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'), # JWT Token refresh endpoint
+    path('api/token/revoke/', TokenRevokeView.as_view(), name='token_revoke'), # JWT Token revoke (logout) endpoint
     #API Documentation urls
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'), 
     path('api/schema/swagger-ui/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'), 
@@ -0,0 +1,182 @@
+"""
+Read-only fast path of ModelSerializers for list endpoints.
+
+compile_serializer(SerializerClass) turns the serializer's fields into one
+generated function from a values() row to the output dict, so a list skips
+model instantiation and DRF's per-field get_attribute/to_representation
+walk. Fields whose representation of a column value is the value itself
+(integers, strings, booleans, primary keys of relations) are copied;
+others (decimals, datetimes, choices) still go through the field's own
+to_representation, so the output is what the serializer returns, byte for
+byte once rendered (see the equivalence tests in each app's tests.py).
+
+SerializerMethodFields can't be derived from the model: the serializer
+declares them in `values_method_fields` as {field name: (lookups, function)},
+where the function computes the field from the values of those lookups.
+Serializers with fields that have no values() equivalent (nested
+serializers, hyperlinks) raise ImproperlyConfigured when compiled.
+"""
+import functools
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+# serializer field class -> internal types of the model fields whose values it returns unchanged
+COPIED_FIELDS = {
+    serializers.IntegerField: {
+        'AutoField', 'BigAutoField', 'SmallAutoField', 'IntegerField', 'BigIntegerField',
+        'SmallIntegerField', 'PositiveIntegerField', 'PositiveBigIntegerField', 'PositiveSmallIntegerField',
+    },
+    serializers.CharField: {'CharField', 'TextField', 'SlugField'},
+    serializers.EmailField: {'CharField'},
+    serializers.BooleanField: {'BooleanField'},
+}
+
+
+class ValuesSerializer:
+    """A compiled serializer: values(queryset) selects the columns, serialize(rows) builds the output."""
+
+    def __init__(self, serializer_class, lookups, to_representation, source):
+        self.serializer_class = serializer_class
+        self.lookups = lookups
+        self.to_representation = to_representation
+        self.source = source  # the generated code, for debugging
+
+    def values(self, queryset):
+        return queryset.values(*self.lookups)
+
+    def serialize(self, rows):
+        # DateTimeField asks for the current timezone for every value; ask once per list instead
+        current_timezone = timezone.get_current_timezone() if settings.USE_TZ else None
+        to_representation = self.to_representation
+        return [to_representation(row, current_timezone) for row in rows]
+
+
+def _datetime_converter(field):
+    """DateTimeField.to_representation for ISO 8601 output in the current timezone, given that timezone."""
+    def convert(value, current_timezone):
+        if current_timezone is None or isinstance(value, str) or value.utcoffset() is None:
+            return field.to_representation(value)
+        try:
+            value = value.astimezone(current_timezone).isoformat()
+        except OverflowError:
+            return field.to_representation(value)
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return convert
+
+
+def _decimal_converter(field):
+    """DecimalField.to_representation for strings, taking a shortcut for values that already have the field's precision."""
+    exponent = -field.decimal_places
+    def convert(value):
+        # what a column of the same precision holds: quantize() would return the value unchanged
+        if type(value) is Decimal:
+            sign, digits, value_exponent = value.as_tuple()
+            if value_exponent == exponent and (field.max_digits is None or len(digits) <= field.max_digits):
+                return f'{value:f}'
+        return field.to_representation(value)
+    return convert
+
+
+def _model_field(model, source_attrs):
+    try:
+        return model._meta.get_field(source_attrs[0]) if len(source_attrs) == 1 else None
+    except FieldDoesNotExist:
+        return None
+
+
+@functools.cache
+def compile_serializer(serializer_class):
+    """The ValuesSerializer of a ModelSerializer class (compiled once per process)."""
+    model = serializer_class.Meta.model
+    method_fields = getattr(serializer_class, 'values_method_fields', {})
+    lookups, entries, namespace = [], [], {}
+
+    def lookup(name):
+        if name not in lookups:
+            lookups.append(name)
+        return repr(name)
+
+    for name, field in serializer_class().fields.items():
+        if field.write_only:
+            continue
+        model_field = _model_field(model, field.source_attrs)
+
+        #A. Computed from other columns by the serializer's declared function
+        if isinstance(field, serializers.SerializerMethodField):
+            if name not in method_fields:
+                raise ImproperlyConfigured(f'{serializer_class.__name__}.{name} needs an entry in values_method_fields.')
+            field_lookups, function = method_fields[name]
+            namespace[f'method_{name}'] = function
+            entries.append(f'{name!r}: method_{name}({", ".join(f"row[{lookup(item)}]" for item in field_lookups)})')
+            continue
+
+        #B. A relation's primary key is its _id column
+        if isinstance(field, serializers.PrimaryKeyRelatedField) and model_field is not None and model_field.is_relation:
+            column = f'row[{lookup(model_field.attname)}]'
+            if field.pk_field is None:
+                entries.append(f'{name!r}: {column}')
+            else:
+                namespace[f'convert_{name}'] = field.pk_field.to_representation
+                entries.append(f'{name!r}: None if (value := {column}) is None else convert_{name}(value)')
+            continue
+
+        if isinstance(field, (serializers.RelatedField, serializers.ManyRelatedField, serializers.BaseSerializer)):
+            raise ImproperlyConfigured(f'{serializer_class.__name__}.{name} ({type(field).__name__}) has no values() equivalent.')
+        if model_field is not None and model_field.is_relation:
+            raise ImproperlyConfigured(f'{serializer_class.__name__}.{name} reads a related object.')
+
+        #C. Columns: copied, or converted by the field itself (None stays None, as in Serializer.to_representation)
+        column = f'row[{lookup("__".join(field.source_attrs))}]'
+        if isinstance(field, serializers.ReadOnlyField) or (
+            model_field is not None and model_field.get_internal_type() in COPIED_FIELDS.get(type(field), ())
+        ):
+            entries.append(f'{name!r}: {column}')
+        elif (
+            type(field) is serializers.DateTimeField and not hasattr(field, 'timezone')
+            and getattr(field, 'format', api_settings.DATETIME_FORMAT) == ISO_8601
+        ):
+            namespace[f'convert_{name}'] = _datetime_converter(field)
+            entries.append(f'{name!r}: None if (value := {column}) is None else convert_{name}(value, current_timezone)')
+        elif (
+            type(field) is serializers.DecimalField and field.decimal_places is not None
+            and getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+            and not field.localize and not field.normalize_output
+        ):
+            namespace[f'convert_{name}'] = _decimal_converter(field)
+            entries.append(f'{name!r}: None if (value := {column}) is None else convert_{name}(value)')
+        else:
+            namespace[f'convert_{name}'] = field.to_representation
+            entries.append(f'{name!r}: None if (value := {column}) is None else convert_{name}(value)')
+
+    # every entry assigns `value` and reads it right away, so the entries can share the name
+    source = 'def to_representation(row, current_timezone=None):\n    return {\n' + ''.join(f'        {entry},\n' for entry in entries) + '    }\n'
+    exec(compile(source, f'<{serializer_class.__qualname__} values serializer>', 'exec'), namespace)
+    return ValuesSerializer(serializer_class, lookups, namespace['to_representation'], source)
+
+
+class ValuesListMixin:
+    """List views that serialize values() rows with the compiled serializer instead of model instances."""
+
+    def get_values_serializer(self):
+        return compile_serializer(self.get_serializer_class())
+
+    def values_response(self, queryset, paginator=None):
+        """The (paginated) response listing `queryset`."""
+        serializer = self.get_values_serializer()
+        rows = serializer.values(queryset)
+        paginator = paginator or self.paginator
+        if paginator is None:
+            return Response(serializer.serialize(rows))
+        page = paginator.paginate_queryset(rows, self.request, view=self)
+        if page is None:
+            return Response(serializer.serialize(rows))
+        return paginator.get_paginated_response(serializer.serialize(page))
+
+    def list(self, request, *args, **kwargs):
+        return self.values_response(self.filter_queryset(self.get_queryset()))
@@ -7,6 +7,6 @@ class UserRentalFilter(filters.BaseFilterBackend):
             return queryset
         # Allow authenticated users to see their own rentals
         if request.user.is_authenticated:
-            return queryset.filter(user=request.user)
+            return queryset.filter(user_id=request.user.pk)
         # For anonymous users, return empty queryset
         return queryset.none()
\ No newline at end of file
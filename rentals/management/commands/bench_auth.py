@@ -0,0 +1,102 @@
+"""
+Benchmark GET /rentals/ with simplejwt's JWTAuthentication (one User query
+per request) against ClaimsJWTAuthentication (request.user from the token's
+claims, revocations from the in-memory filter).
+
+A synthetic user with rentals is created inside a transaction that is rolled
+back at the end, unless --keep is passed. Requests go through the whole
+middleware stack in-process, so the host (the tenant's primary domain) must
+be in ALLOWED_HOSTS.
+"""
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client as HttpClient
+from django.utils import timezone
+from django_tenants.utils import get_tenant_domain_model, schema_context
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from CarRentalService import authentication
+from rentals.models import Rental
+from rentals.views import RentalViewSet
+from users.models import User
+from vehicles.models import Vehicle
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure requests/sec on /rentals/ with the User-loading and the claims-based JWT authentication'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schema', required=True, help='Tenant schema to run the benchmark in')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per authentication class')
+        parser.add_argument('--rentals', type=int, default=20, help='Rentals of the benchmark user')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic rows instead of rolling them back')
+
+    def handle(self, *args, **options):
+        domain = get_tenant_domain_model().objects.filter(tenant__schema_name=options['schema'], is_primary=True).first()
+        if domain is None:
+            raise CommandError(f'No primary domain for tenant: {options["schema"]}')
+        with schema_context(options['schema']):
+            try:
+                with transaction.atomic():
+                    self._run(domain.domain, options)
+                    if not options['keep']:
+                        raise Rollback
+            except Rollback:
+                self.stdout.write('Synthetic data rolled back.')
+
+    def _seed(self, options):
+        user = User.objects.create_user(username='bench-auth', email='bench-auth@example.com', password=None)
+        vehicle = Vehicle.objects.create(make='Bench', model='Auth', year=2020, license_plate='BENCH-AUTH', rental_rate_per_day=50)
+        start = timezone.now() + timedelta(days=1)
+        Rental.objects.bulk_create([
+            Rental(user=user, vehicle=vehicle, rental_start=start + timedelta(days=3 * i), rental_end=start + timedelta(days=3 * i + 1), status='active')
+            for i in range(options['rentals'])
+        ])
+        return user
+
+    def _measure(self, client, requests):
+        # warm-up: routing, object and revocation caches
+        for _ in range(10):
+            response = client.get('/rentals/')
+            if response.status_code != 200:
+                raise CommandError(f'GET /rentals/ answered {response.status_code}: {response.content[:200]!r}')
+        # (the query log is reset by every request, so count with a wrapper)
+        queries = []
+        with connection.execute_wrapper(lambda execute, sql, *args: queries.append(sql) or execute(sql, *args)):
+            client.get('/rentals/')
+        start = time.perf_counter()
+        for _ in range(requests):
+            client.get('/rentals/')
+        elapsed = time.perf_counter() - start
+        return requests / elapsed, len(queries)
+
+    def _run(self, host, options):
+        user = self._seed(options)
+        refresh = RefreshToken.for_user(user)
+        claims_refresh = authentication.add_claims(RefreshToken.for_user(user), user, options['schema'])
+
+        results = {}
+        authentication_classes = RentalViewSet.authentication_classes
+        try:
+            for name, auth_class, token in (
+                ('JWTAuthentication', JWTAuthentication, refresh.access_token),
+                ('ClaimsJWTAuthentication', authentication.ClaimsJWTAuthentication, claims_refresh.access_token),
+            ):
+                RentalViewSet.authentication_classes = [auth_class]
+                client = HttpClient(HTTP_HOST=host, HTTP_AUTHORIZATION=f'Bearer {token}')
+                results[name] = self._measure(client, options['requests'])
+        finally:
+            RentalViewSet.authentication_classes = authentication_classes
+
+        for name, (rate, queries) in results.items():
+            self.stdout.write(f'{name:24} {rate:8.0f} requests/s  {queries} queries per request')
+        before, after = results['JWTAuthentication'][0], results['ClaimsJWTAuthentication'][0]
+        self.stdout.write(self.style.SUCCESS(f'speedup: {after / before:.2f}x'))
@@ -0,0 +1,124 @@
+"""
+Benchmark DRF's JSONRenderer and JSONParser (stdlib json) against the
+orjson-backed ones of CarRentalService/fastjson.py on the payloads of
+GET /vehicles/ and GET /rentals/history/{user_id}/, and check that both
+renderers produce the same bytes.
+
+The payloads are the response data of real requests, made in-process through
+the whole middleware stack (so the host, the tenant's primary domain, must be
+in ALLOWED_HOSTS). Synthetic vehicles and rentals are created inside a
+transaction that is rolled back at the end, unless --keep is passed.
+"""
+import io
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client as HttpClient
+from django.utils import timezone
+from django_tenants.utils import get_tenant_domain_model, schema_context
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from CarRentalService import authentication, fastjson
+from rentals.models import Rental
+from rentals.pagination import RentalKeysetPagination
+from users.models import User
+from vehicles.models import Vehicle
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure MB/s of the stdlib and orjson JSON renderers and parsers on /vehicles/ and /rentals/history/ payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schema', required=True, help='Tenant schema to run the benchmark in')
+        parser.add_argument('--vehicles', type=int, default=2000, help='Vehicles listed by /vehicles/')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic rows instead of rolling them back')
+
+    def handle(self, *args, **options):
+        if fastjson.orjson is None:
+            self.stderr.write(self.style.WARNING('orjson is not installed: both sides use the json module'))
+        domain = get_tenant_domain_model().objects.filter(tenant__schema_name=options['schema'], is_primary=True).first()
+        if domain is None:
+            raise CommandError(f'No primary domain for tenant: {options["schema"]}')
+        rng = random.Random(options['seed'])
+        with schema_context(options['schema']):
+            try:
+                with transaction.atomic():
+                    self._run(domain.domain, rng, options)
+                    if not options['keep']:
+                        raise Rollback
+            except Rollback:
+                self.stdout.write('Synthetic data rolled back.')
+
+    def _seed(self, rng, options):
+        user = User.objects.create_user(username='bench-json', email='bench-json@example.com', password=None, is_staff=True)
+        vehicles = Vehicle.objects.bulk_create([
+            Vehicle(
+                make=rng.choice(['Toyota', 'Subaru', 'Mazda', 'Nissan']), model=rng.choice(['Corolla', 'Forester', 'CX-5', 'Note']),
+                year=rng.randint(2005, 2025), license_plate=f'BENCH-JSON-{i}', rental_rate_per_day=Decimal(rng.randint(2000, 30000)) / 100,
+                current_mileage=rng.randint(0, 300_000), fuel_level=Decimal(rng.randint(0, 10000)) / 100,
+                latitude=Decimal(rng.randint(-90_000_000, 90_000_000)) / 1_000_000, longitude=Decimal(rng.randint(-180_000_000, 180_000_000)) / 1_000_000,
+            )
+            for i in range(options['vehicles'])
+        ], batch_size=5000)
+        # a full history page: one rental per vehicle, so none overlap
+        start = timezone.now() + timedelta(days=1)
+        Rental.objects.bulk_create([
+            Rental(
+                user=user, vehicle=vehicle, rental_start=start + timedelta(minutes=rng.randint(0, 10**6)),
+                rental_end=start + timedelta(minutes=10**6 + rng.randint(60, 30 * 24 * 60)),
+                status=rng.choice(['active', 'confirmed', 'completed']), total_cost=Decimal(rng.randint(5000, 500000)) / 100,
+            )
+            for vehicle in vehicles[:RentalKeysetPagination.max_page_size]
+        ])
+        return user
+
+    def _get(self, client, path):
+        response = client.get(path)
+        if response.status_code != 200:
+            raise CommandError(f'GET {path} answered {response.status_code}: {response.content[:200]!r}')
+        return response.data
+
+    def _best_of(self, repeat, func):
+        best, result = None, None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def _run(self, host, rng, options):
+        user = self._seed(rng, options)
+        token = authentication.add_claims(RefreshToken.for_user(user), user, options['schema']).access_token
+        client = HttpClient(HTTP_HOST=host, HTTP_AUTHORIZATION=f'Bearer {token}')
+        payloads = [
+            ('/vehicles/', self._get(client, '/vehicles/')),
+            ('/rentals/history/', self._get(client, f'/rentals/history/{user.pk}/?page_size={RentalKeysetPagination.max_page_size}')),
+        ]
+        repeat = options['repeat']
+        for name, data in payloads:
+            stdlib_time, stdlib_body = self._best_of(repeat, lambda: JSONRenderer().render(data))
+            fast_time, fast_body = self._best_of(repeat, lambda: fastjson.JSONRenderer().render(data))
+            stdlib_parse = self._best_of(repeat, lambda: JSONParser().parse(io.BytesIO(stdlib_body)))[0]
+            fast_parse = self._best_of(repeat, lambda: fastjson.JSONParser().parse(io.BytesIO(stdlib_body)))[0]
+
+            megabytes = len(stdlib_body) / 1e6
+            self.stdout.write(f'{name} ({megabytes:.2f} MB)')
+            self.stdout.write(f'  render  stdlib {megabytes / stdlib_time:8.1f} MB/s   orjson {megabytes / fast_time:8.1f} MB/s   {stdlib_time / fast_time:5.1f}x')
+            self.stdout.write(f'  parse   stdlib {megabytes / stdlib_parse:8.1f} MB/s   orjson {megabytes / fast_parse:8.1f} MB/s   {stdlib_parse / fast_parse:5.1f}x')
+            if stdlib_body == fast_body:
+                self.stdout.write(self.style.SUCCESS('  rendered bytes are identical'))
+            else:
+                self.stderr.write(self.style.ERROR('  rendered bytes differ from the stdlib renderer'))
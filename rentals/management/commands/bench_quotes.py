@@ -0,0 +1,62 @@
+"""
+Benchmark quote_rental_costs against calling calculate_rental_cost once per
+(vehicle, interval) pair, as the search page would otherwise do.
+No database access is needed.
+"""
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from rentals.utils import calculate_rental_cost, quote_rental_costs
+
+
+class Command(BaseCommand):
+    help = 'Compare vectorized rental quoting with the scalar calculate_rental_cost'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vehicles', type=int, default=2000)
+        parser.add_argument('--intervals', type=int, default=24)
+        parser.add_argument('--distinct-rates', type=int, default=50, help='Number of price points in the fleet (0: every vehicle has its own rate)')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        if options['distinct_rates']:
+            price_points = [Decimal(rng.randint(20, 300)) + Decimal(rng.choice(['0.00', '0.50', '0.99'])) for _ in range(options['distinct_rates'])]
+            rates = [rng.choice(price_points) for _ in range(options['vehicles'])]
+        else:
+            rates = [Decimal(rng.randint(2000, 30000)) / 100 for _ in range(options['vehicles'])]
+        now = timezone.now()
+        intervals = []
+        for _ in range(options['intervals']):
+            rental_start = now + timedelta(minutes=rng.randint(0, 30 * 24 * 60))
+            intervals.append((rental_start, rental_start + timedelta(minutes=rng.randint(60, 14 * 24 * 60))))
+        pairs = len(rates) * len(intervals)
+
+        scalar = self._best_of(options['repeat'], lambda: [
+            [calculate_rental_cost(start, end, rate) for start, end in intervals] for rate in rates
+        ])
+        vectorized = self._best_of(options['repeat'], lambda: quote_rental_costs(rates, intervals))
+
+        self.stdout.write(f'{len(rates)} vehicles x {len(intervals)} intervals = {pairs} quotes')
+        self.stdout.write(f'calculate_rental_cost: {scalar[0] * 1000:9.2f} ms ({pairs / scalar[0]:,.0f} quotes/s)')
+        self.stdout.write(f'quote_rental_costs:    {vectorized[0] * 1000:9.2f} ms ({pairs / vectorized[0]:,.0f} quotes/s)')
+        self.stdout.write(f'speedup:               {scalar[0] / vectorized[0]:9.1f}x')
+        if scalar[1] == vectorized[1]:
+            self.stdout.write(self.style.SUCCESS('Results are identical'))
+        else:
+            self.stderr.write(self.style.ERROR('Results differ from calculate_rental_cost'))
+
+    def _best_of(self, repeat, func):
+        best, result = None, None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
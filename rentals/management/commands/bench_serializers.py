@@ -0,0 +1,121 @@
+"""
+Benchmark the list serializers (RentalSerializer, VehicleSeializer,
+UserSerializer) against their compiled values() twins
+(CarRentalService/values_serializers.py) on payloads of --rows rows, and
+check that both render the same JSON.
+
+"query + serialize" includes fetching the rows (model instances or values()
+dicts); "serialize" times only the conversion of already-fetched rows.
+Synthetic rows are inserted into the given tenant schema inside a
+transaction that is rolled back at the end, unless --keep is passed.
+"""
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from django_tenants.utils import schema_context
+from rest_framework.renderers import JSONRenderer
+
+from CarRentalService.values_serializers import compile_serializer
+from rentals.models import Rental, VehicleRating
+from rentals.serializers import RentalSerializer
+from users.models import User
+from users.serializers import UserSerializer
+from vehicles.models import Vehicle
+from vehicles.serializers import VehicleSeializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure rows/sec of the DRF list serializers and their compiled values() versions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schema', required=True, help='Tenant schema to run the benchmark in')
+        parser.add_argument('--rows', type=int, default=10_000, help='Rows per payload')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic rows instead of rolling them back')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with schema_context(options['schema']):
+            try:
+                with transaction.atomic():
+                    self._run(rng, options)
+                    if not options['keep']:
+                        raise Rollback
+            except Rollback:
+                self.stdout.write('Synthetic data rolled back.')
+
+    def _seed(self, rng, rows):
+        users = User.objects.bulk_create([
+            User(username=f'bench-serializers-{i}', email=f'bench-serializers-{i}@example.com',
+                 phone_number=f'+2547{i:08d}' if i % 2 else None)
+            for i in range(rows)
+        ])
+        vehicles = Vehicle.objects.bulk_create([
+            Vehicle(
+                make=rng.choice(['Toyota', 'Subaru', 'Mazda', 'Nissan']), model=rng.choice(['Corolla', 'Forester', 'CX-5', 'Note']),
+                year=rng.randint(2005, 2025), license_plate=f'BENCH-SER-{i}', rental_rate_per_day=Decimal(rng.randint(2000, 30000)) / 100,
+                current_mileage=rng.randint(0, 300_000), fuel_level=Decimal(rng.randint(0, 10000)) / 100,
+                latitude=Decimal(rng.randint(-90_000_000, 90_000_000)) / 1_000_000, longitude=Decimal(rng.randint(-180_000_000, 180_000_000)) / 1_000_000,
+            )
+            for i in range(rows)
+        ], batch_size=5000)
+        # half of the vehicles have been reviewed
+        VehicleRating.objects.bulk_create([
+            VehicleRating(vehicle=vehicle, review_count=count, rating_sum=rng.randint(count, 5 * count))
+            for vehicle, count in ((vehicle, rng.randint(1, 40)) for vehicle in vehicles[::2])
+        ], batch_size=5000)
+        now = timezone.now()
+        starts = [now + timedelta(minutes=rng.randint(60, 10**6)) for _ in range(rows)]
+        # one rental per vehicle, so none overlap
+        Rental.objects.bulk_create([
+            Rental(
+                user=users[i], vehicle=vehicles[i], rental_start=starts[i], rental_end=starts[i] + timedelta(minutes=rng.randint(60, 30 * 24 * 60)),
+                status=rng.choice(['active', 'confirmed', 'completed']),
+            )
+            for i in range(rows)
+        ], batch_size=5000)
+
+    def _best_of(self, repeat, func):
+        best, result = None, None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def _run(self, rng, options):
+        rows, repeat = options['rows'], options['repeat']
+        self._seed(rng, rows)
+        renderer = JSONRenderer()
+        payloads = [
+            ('RentalSerializer', RentalSerializer, Rental.objects.order_by('-rental_start', '-id')[:rows]),
+            ('VehicleSeializer', VehicleSeializer, Vehicle.objects.select_related('rating_summary').order_by('id')[:rows]),
+            ('UserSerializer', UserSerializer, User.objects.order_by('-id')[:rows]),
+        ]
+        for name, serializer_class, queryset in payloads:
+            compiled = compile_serializer(serializer_class)
+            instances, values = list(queryset), list(compiled.values(queryset))
+            # .all(): a fresh queryset every time, not the result cache of the first fetch
+            drf_total, drf_data = self._best_of(repeat, lambda: serializer_class(list(queryset.all()), many=True).data)
+            compiled_total, compiled_data = self._best_of(repeat, lambda: compiled.serialize(list(compiled.values(queryset.all()))))
+            drf_only = self._best_of(repeat, lambda: serializer_class(instances, many=True).data)[0]
+            compiled_only = self._best_of(repeat, lambda: compiled.serialize(values))[0]
+
+            self.stdout.write(f'{name} ({len(instances)} rows)')
+            self.stdout.write(f'  query + serialize  DRF {len(instances) / drf_total:10,.0f} rows/s   compiled {len(values) / compiled_total:10,.0f} rows/s   {drf_total / compiled_total:5.1f}x')
+            self.stdout.write(f'  serialize          DRF {len(instances) / drf_only:10,.0f} rows/s   compiled {len(values) / compiled_only:10,.0f} rows/s   {drf_only / compiled_only:5.1f}x')
+            if renderer.render(drf_data) == renderer.render(compiled_data):
+                self.stdout.write(self.style.SUCCESS('  JSON is identical'))
+            else:
+                self.stderr.write(self.style.ERROR('  JSON differs from the DRF serializer'))
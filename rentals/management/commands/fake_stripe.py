@@ -0,0 +1,134 @@
+"""
+Management command that serves a local stand-in for the Stripe API.
+It answers the two calls the payment workers make (POST /v1/payment_intents
+and POST /v1/refunds), honours Idempotency-Key headers like Stripe does, and
+can inject latency, server errors and card declines. Point the app at it
+with STRIPE_API_BASE=http://127.0.0.1:12111 for tests and load runs.
+"""
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from django.core.management.base import BaseCommand
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        form = dict(parse_qsl(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()))
+        idempotency_key = self.headers.get('Idempotency-Key')
+
+        # 1. Replay the stored response of a request we've already answered
+        with server.lock:
+            stored = server.responses.get(idempotency_key) if idempotency_key else None
+        if stored is not None:
+            return self._respond(*stored)
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        # 2. Injected failures: server errors are not stored, so a retry can succeed
+        if server.random.random() < server.failure_rate:
+            return self._respond(500, _error('api_error', 'Injected server error.'))
+
+        if self.path == '/v1/payment_intents':
+            response = self._create_payment_intent(form)
+        elif self.path == '/v1/refunds':
+            response = self._create_refund(form)
+        else:
+            response = (404, _error('invalid_request_error', f'Unrecognized request URL (POST: {self.path}).'))
+
+        if idempotency_key:
+            with server.lock:
+                response = server.responses.setdefault(idempotency_key, response)
+        self._respond(*response)
+
+    def _create_payment_intent(self, form):
+        server = self.server
+        if server.random.random() < server.decline_rate:
+            return 402, _error('card_error', 'Your card was declined.', code='card_declined')
+        intent = {
+            'id': f'pi_fake_{next(server.ids)}',
+            'object': 'payment_intent',
+            'amount': int(form.get('amount', 0)),
+            'currency': form.get('currency', 'usd'),
+            'status': 'requires_payment_method',
+            'metadata': {key[9:-1]: value for key, value in form.items() if key.startswith('metadata[')},
+        }
+        with server.lock:
+            server.payment_intents[intent['id']] = intent
+        return 200, intent
+
+    def _create_refund(self, form):
+        server = self.server
+        payment_intent_id = form.get('payment_intent')
+        with server.lock:
+            intent = server.payment_intents.get(payment_intent_id)
+            if intent is None:
+                return 400, _error('invalid_request_error', f"No such payment_intent: '{payment_intent_id}'", code='resource_missing')
+            if intent.get('refunded'):
+                return 400, _error('invalid_request_error', f'Charge for {payment_intent_id} has already been refunded.', code='charge_already_refunded')
+            intent['refunded'] = True
+        return 200, {
+            'id': f're_fake_{next(server.ids)}',
+            'object': 'refund',
+            'amount': intent['amount'],
+            'payment_intent': payment_intent_id,
+            'status': 'succeeded',
+        }
+
+    def _respond(self, status_code, body):
+        data = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.verbosity > 1:
+            super().log_message(format, *args)
+
+
+def _error(error_type, message, code=None):
+    error = {'type': error_type, 'message': message}
+    if code:
+        error['code'] = code
+    return {'error': error}
+
+
+class Command(BaseCommand):
+    help = 'Run a local fake of the Stripe payment intent and refund API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--latency-ms', type=int, default=0, help='Delay added to every request.')
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='Share of requests answered with a 500.')
+        parser.add_argument('--decline-rate', type=float, default=0.0, help='Share of payment intents declined with a card error.')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        server = ThreadingHTTPServer((options['host'], options['port']), FakeStripeHandler)
+        server.daemon_threads = True
+        server.latency = options['latency_ms'] / 1000
+        server.failure_rate = options['failure_rate']
+        server.decline_rate = options['decline_rate']
+        server.random = random.Random(options['seed'])
+        server.verbosity = options['verbosity']
+        server.lock = threading.Lock()
+        server.ids = itertools.count(1)
+        server.responses = {}
+        server.payment_intents = {}
+
+        self.stdout.write(self.style.SUCCESS(f'Fake Stripe listening on http://{options["host"]}:{options["port"]}'))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,68 @@
+"""
+Management command that runs the payment outbox workers.
+Every round claims a batch of due PaymentTasks per tenant and calls Stripe for
+them on a thread pool. Claims use SELECT ... FOR UPDATE SKIP LOCKED, so several
+copies of this command can run side by side.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django_tenants.utils import get_public_schema_name, get_tenant_model, schema_context
+from rentals import notifications
+from rentals.payments import claim_payment_tasks, process_payment_task
+
+
+def _process_in_schema(schema_name, task_id):
+    # Pool threads keep their own database connection between tasks
+    close_old_connections()
+    with schema_context(schema_name):
+        return process_payment_task(task_id)
+
+
+class Command(BaseCommand):
+    help = 'Process queued Stripe payments (checkout, extension, refund) for every tenant'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent Stripe calls.')
+        parser.add_argument('--batch-size', type=int, default=50, help='Tasks claimed per tenant per round.')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when no task is due.')
+        parser.add_argument('--once', action='store_true', help='Process the tasks due now, then exit.')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        try:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                while True:
+                    processed = self._run_round(executor, options['batch_size'])
+                    if processed:
+                        self.stdout.write(f'Processed {processed} payment tasks')
+                    elif options['once']:
+                        break
+                    else:
+                        time.sleep(options['poll_interval'])
+                    close_old_connections()
+        finally:
+            # the receipts and cancellation notices of the rentals processed above
+            notifications.flush()
+
+    def _run_round(self, executor, batch_size):
+        futures = []
+        schema_names = get_tenant_model().objects.exclude(schema_name=get_public_schema_name()).values_list('schema_name', flat=True)
+        for schema_name in schema_names:
+            with schema_context(schema_name):
+                task_ids = claim_payment_tasks(batch_size)
+            futures.extend(executor.submit(_process_in_schema, schema_name, task_id) for task_id in task_ids)
+
+        for future in futures:
+            try:
+                task = future.result()
+            except Exception as e:
+                # The task stays 'processing' and is claimed again once its lease expires
+                self.stderr.write(self.style.ERROR(f'Payment task crashed: {e}'))
+                continue
+            if self.verbosity > 1:
+                style = self.style.SUCCESS if task.status == 'succeeded' else self.style.WARNING
+                self.stdout.write(style(str(task)))
+        return len(futures)
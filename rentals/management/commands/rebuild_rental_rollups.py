@@ -0,0 +1,27 @@
+"""
+Management command to rebuild the daily rental rollups read by GET /rentals/stats/.
+Use it to backfill existing tenants or to repair drifted rollups.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django_tenants.utils import get_public_schema_name, get_tenant_model, schema_context
+from rentals.utils import rebuild_rental_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily per-vehicle rental rollups for one tenant (or all tenants) in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schema', help='Tenant schema to rebuild. If omitted, every tenant is rebuilt.')
+
+    def handle(self, *args, **options):
+        schema = options.get('schema')
+        tenants = get_tenant_model().objects.exclude(schema_name=get_public_schema_name())
+        if schema:
+            tenants = tenants.filter(schema_name=schema)
+            if not tenants.exists():
+                raise CommandError(f'Tenant not found: {schema}')
+
+        for schema_name in tenants.values_list('schema_name', flat=True):
+            with schema_context(schema_name):
+                count = rebuild_rental_rollups()
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} daily rollups in schema {schema_name}'))
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_vehicle_ratings(apps, schema_editor):
+    Review = apps.get_model('rentals', 'Review')
+    VehicleRating = apps.get_model('rentals', 'VehicleRating')
+    stars = {f'stars_{star}': Count('pk', filter=Q(rating=star)) for star in range(1, 6)}
+    rows = (
+        Review.objects.filter(rental__status='completed')
+        .values('rental__vehicle_id')
+        .annotate(review_count=Count('pk'), rating_sum=Sum('rating'), **stars)
+        .order_by()
+    )
+    VehicleRating.objects.bulk_create(
+        [VehicleRating(vehicle_id=row.pop('rental__vehicle_id'), **row) for row in rows],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0006_alter_rental_vehicle'),
+        ('vehicles', '0003_vehicle_owner'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VehicleRating',
+            fields=[
+                ('vehicle', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_summary', serialize=False, to='vehicles.vehicle')),
+                ('review_count', models.IntegerField(default=0)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('stars_1', models.IntegerField(default=0)),
+                ('stars_2', models.IntegerField(default=0)),
+                ('stars_3', models.IntegerField(default=0)),
+                ('stars_4', models.IntegerField(default=0)),
+                ('stars_5', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_vehicle_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:17
+
+import django.contrib.postgres.constraints
+import django.contrib.postgres.fields.ranges
+import rentals.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class OverlappingBookings(Exception):
+    """The table has rentals the rental_vehicle_no_overlap constraint rejects."""
+
+
+def check_no_overlapping_bookings(apps, schema_editor):
+    """
+    Raise OverlappingBookings naming every pair of active or confirmed rentals of one vehicle whose
+    periods overlap. Until now only a check in the serializer, which concurrent bookings could both
+    pass, kept them apart, and adding the constraint to a table with such a pair fails without saying
+    which rows.
+    """
+    Rental = apps.get_model('rentals', 'Rental')
+    quote = schema_editor.connection.ops.quote_name
+    table, vehicle = quote(Rental._meta.db_table), quote(Rental._meta.get_field('vehicle').column)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT a.id, b.id, a.{vehicle}
+            FROM {table} a JOIN {table} b ON b.{vehicle} = a.{vehicle} AND b.id > a.id
+                AND TSTZRANGE(a.rental_start, a.rental_end) && TSTZRANGE(b.rental_start, b.rental_end)
+            WHERE a.status IN ('active', 'confirmed') AND b.status IN ('active', 'confirmed')
+            ORDER BY a.id, b.id
+        """)
+        pairs = cursor.fetchall()
+    if pairs:
+        raise OverlappingBookings(
+            f'{len(pairs)} pair(s) of active or confirmed rentals of one vehicle overlap. Cancel or reschedule one '
+            'rental of each pair, then migrate again: ' + ', '.join(f'{first} and {second} (vehicle {vehicle_id})' for first, second, vehicle_id in pairs)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0007_vehicle_rating'),
+        ('vehicles', '0003_vehicle_owner'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # btree_gist lets the GiST index compare vehicle ids with '='. Extensions are
+        # database-wide, so install it in the public schema that every tenant's search_path includes.
+        migrations.RunSQL(
+            'CREATE EXTENSION IF NOT EXISTS btree_gist SCHEMA public',
+            migrations.RunSQL.noop,
+        ),
+        # the serializer check the constraint replaces was racy: fail on overlapping rentals booked
+        # before it with their ids, rather than with the constraint's bare exclusion violation
+        migrations.RunPython(check_no_overlapping_bookings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='rental',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(condition=models.Q(('status__in', ('active', 'confirmed'))), expressions=[(rentals.models.TsTzRange('rental_start', 'rental_end', django.contrib.postgres.fields.ranges.RangeBoundary()), '&&'), ('vehicle', '=')], name='rental_vehicle_no_overlap'),
+        ),
+    ]
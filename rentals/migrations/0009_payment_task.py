@@ -0,0 +1,38 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:24
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0008_rental_vehicle_no_overlap'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('checkout', 'Checkout'), ('extension', 'Extension'), ('refund', 'Refund')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('amount_cents', models.IntegerField(blank=True, null=True)),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('idempotency_key', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('stripe_id', models.CharField(blank=True, help_text='Stripe Payment Intent or Refund ID', max_length=255, null=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('rental', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payment_tasks', to='rentals.rental')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='payment_task_due_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status__in', ('pending', 'processing'))), fields=('rental', 'kind'), name='payment_task_one_in_flight')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:30
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # build the indexes without blocking writes to large rental tables
+    atomic = False
+
+    dependencies = [
+        ('rentals', '0009_payment_task'),
+        ('vehicles', '0003_vehicle_owner'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='rental',
+            index=models.Index(fields=['rental_start', 'id'], name='rental_list_keyset_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='rental',
+            index=models.Index(fields=['user', 'rental_start', 'id'], name='rental_user_keyset_idx'),
+        ),
+    ]
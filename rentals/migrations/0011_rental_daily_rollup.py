@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rentals', '0010_rental_keyset_indexes'),
+        ('vehicles', '0003_vehicle_owner'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RentalDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('occupied_seconds', models.BigIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('active_count', models.IntegerField(default=0)),
+                ('confirmed_count', models.IntegerField(default=0)),
+                ('completed_count', models.IntegerField(default=0)),
+                ('cancelled_count', models.IntegerField(default=0)),
+                ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='vehicles.vehicle')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'vehicle'), name='rental_rollup_day_vehicle')],
+            },
+        ),
+    ]
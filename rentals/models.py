@@ -1,10 +1,30 @@
+import uuid
 from django.db import models
 from users.models import User
 from vehicles.models import Vehicle
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db.models import Avg
+from django.utils import timezone
+from django.db.models import Avg, Func, Q
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import DateTimeRangeField, RangeBoundary, RangeOperators
+
+# statuses that keep the vehicle booked for [rental_start, rental_end)
+BLOCKING_STATUSES = ('active', 'confirmed')
+
+
+class TsTzRange(Func):
+    function = 'TSTZRANGE'
+    output_field = DateTimeRangeField()
+
+
+def rental_period():
+    """The [rental_start, rental_end) range indexed by the overlap exclusion constraint."""
+    return TsTzRange('rental_start', 'rental_end', RangeBoundary())
+
 
 class Rental(models.Model):
+    BLOCKING_STATUSES = BLOCKING_STATUSES
+
     id = models.AutoField(primary_key=True)
     user =models.ForeignKey(User, on_delete=models.CASCADE, db_column='user_id', related_name='rentals')
     vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, db_column='vehicle_id', related_name='rental_instances')
@@ -20,8 +40,43 @@ class Rental(models.Model):
     total_cost = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True) # Total cost of the rental
     payment_intent_id = models.CharField(max_length=50, null=True, blank=True, unique=True, help_text='Stripe Payment Intent ID') 
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember the values as loaded so signal handlers can tell what changed on save
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {
+            field.attname: self.__dict__[field.attname]
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+        }
+
+    class Meta:
+        indexes = [
+            # keyset pagination of GET /rentals/ (staff) and a user's rentals/history, see rentals/pagination.py
+            models.Index(fields=['rental_start', 'id'], name='rental_list_keyset_idx'),
+            models.Index(fields=['user', 'rental_start', 'id'], name='rental_user_keyset_idx'),
+        ]
+        constraints = [
+            # Two active/confirmed rentals of the same vehicle can never overlap.
+            # Enforced by a GiST index, which also serves the overlap lookups in rentals/utils.py.
+            ExclusionConstraint(
+                name='rental_vehicle_no_overlap',
+                expressions=[
+                    (rental_period(), RangeOperators.OVERLAPS),
+                    ('vehicle', RangeOperators.EQUAL),
+                ],
+                condition=Q(status__in=BLOCKING_STATUSES),
+            ),
+        ]
+
     def __str__(self):
-        return f'{self.user.name}  - {self.vehicle.make} {self.vehicle.model}({self.rental_start} to {self.rental_end})'
+        # ids only: loading the user and the vehicle here would cost two queries per rental listed
+        return f'Rental {self.pk} of User {self.user_id} - Vehicle {self.vehicle_id} ({self.rental_start} to {self.rental_end})'
     
 # Damage Report
 class DamageReport(models.Model):
@@ -34,7 +89,7 @@ class DamageReport(models.Model):
     is_resolved = models.BooleanField(default=False)
 
     def __str__(self):
-        return f'Damage Report for Rental {self.rental.id} by {self.reporter.name if self.reporter else "Unknown"}'
+        return f'Damage Report for Rental {self.rental_id} by {f"User {self.reporter_id}" if self.reporter_id else "Unknown"}'
     
 # Reviews
 class Review(models.Model):
@@ -46,4 +101,108 @@ class Review(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f'Review for Rental {self.rental_id} ({self.rating} stars)'
\ No newline at end of file
+        return f'Review for Rental {self.rental_id} ({self.rating} stars)'
+
+# Per-vehicle rating aggregate, kept current by rentals/signals.py
+class VehicleRating(models.Model):
+    vehicle = models.OneToOneField(Vehicle, on_delete=models.CASCADE, primary_key=True, related_name='rating_summary')
+    review_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    # histogram of 1-5 star reviews
+    stars_1 = models.IntegerField(default=0)
+    stars_2 = models.IntegerField(default=0)
+    stars_3 = models.IntegerField(default=0)
+    stars_4 = models.IntegerField(default=0)
+    stars_5 = models.IntegerField(default=0)
+
+    AGGREGATE_FIELDS = ('review_count', 'rating_sum', 'stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5')
+
+    @property
+    def average_rating(self):
+        return self.average(self.review_count, self.rating_sum)
+
+    @staticmethod
+    def average(review_count, rating_sum):
+        # review_count is None for a vehicle without a VehicleRating row (values() through a LEFT JOIN)
+        if not review_count:
+            return 0.0
+        return round(rating_sum / review_count, 2)
+
+    def __str__(self):
+        return f'Rating for Vehicle {self.vehicle_id} ({self.review_count} reviews)'
+
+# Daily per-vehicle rollup of rentals, kept current by rentals/signals.py
+# and read by GET /rentals/stats/ instead of scanning the rentals table
+class RentalDailyRollup(models.Model):
+    # statuses whose time counts as occupied and whose total_cost counts as revenue
+    OCCUPYING_STATUSES = ('active', 'confirmed', 'completed')
+    REVENUE_STATUSES = ('confirmed', 'completed')
+    COUNT_FIELDS = {
+        'active': 'active_count',
+        'confirmed': 'confirmed_count',
+        'completed': 'completed_count',
+        'cancelled': 'cancelled_count',
+    }
+    AGGREGATE_FIELDS = ('occupied_seconds', 'revenue', *COUNT_FIELDS.values())
+
+    day = models.DateField()
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, related_name='daily_rollups')
+    occupied_seconds = models.BigIntegerField(default=0) # Part of this day booked by occupying rentals
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0) # total_cost of paid rentals starting this day
+    # rentals starting this day, by status
+    active_count = models.IntegerField(default=0)
+    confirmed_count = models.IntegerField(default=0)
+    completed_count = models.IntegerField(default=0)
+    cancelled_count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'vehicle'], name='rental_rollup_day_vehicle'),
+        ]
+
+    def __str__(self):
+        return f'Rollup for Vehicle {self.vehicle_id} on {self.day}'
+
+# Payment outbox: Stripe calls recorded by the API and carried out by the
+# process_payments workers (see rentals/payments.py)
+class PaymentTask(models.Model):
+    IN_FLIGHT_STATUSES = ('pending', 'processing')
+
+    rental = models.ForeignKey(Rental, on_delete=models.CASCADE, related_name='payment_tasks')
+    kind = models.CharField(max_length=20, choices=[
+        ('checkout', 'Checkout'),
+        ('extension', 'Extension'),
+        ('refund', 'Refund')
+    ])
+    status = models.CharField(max_length=20, choices=[
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed')
+    ], default='pending')
+    amount_cents = models.IntegerField(null=True, blank=True) # Not set for refunds (Stripe refunds the whole charge)
+    payload = models.JSONField(default=dict, blank=True) # What to apply to the rental once Stripe succeeds or fails
+    idempotency_key = models.UUIDField(default=uuid.uuid4, unique=True, editable=False) # Sent to Stripe on every attempt
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    stripe_id = models.CharField(max_length=255, null=True, blank=True, help_text='Stripe Payment Intent or Refund ID')
+    last_error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # the workers' claim query
+            models.Index(fields=['status', 'next_attempt_at'], name='payment_task_due_idx'),
+        ]
+        constraints = [
+            # at most one checkout/extension/refund of a rental in flight at a time
+            models.UniqueConstraint(
+                fields=['rental', 'kind'],
+                condition=Q(status__in=('pending', 'processing')),
+                name='payment_task_one_in_flight',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} for Rental {self.rental_id} ({self.status})'
@@ -0,0 +1,139 @@
+"""
+Rental notification emails, sent off the request path.
+
+Signal handlers call notify(), which queues the notification when the
+surrounding transaction commits (so a rolled back booking never emails
+anyone). A background thread collects whatever arrives within
+NOTIFICATION_BATCH_WINDOW seconds, collapses duplicates of the same rental and
+kind, looks up all recipients with one query and sends the batch over one
+connection of the configured email backend. Whatever is still queued when
+the process exits is sent before it does.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+SUBJECTS = {
+    'booking_confirmation': 'Booking confirmation for rental {rental_id}',
+    'receipt': 'Receipt for rental {rental_id}',
+    'cancellation': 'Cancellation notice for rental {rental_id}',
+}
+
+BODIES = {
+    'booking_confirmation': 'Your rental {rental_id} from {rental_start} to {rental_end} is booked.',
+    'receipt': 'Thank you for returning your vehicle. Rental {rental_id} ({rental_start} to {rental_end}) total: {total_cost}.',
+    'cancellation': 'Your rental {rental_id} from {rental_start} to {rental_end} has been cancelled. Any payment will be refunded.',
+}
+
+
+class NotificationQueue:
+    """In-process queue drained in batches by one daemon thread."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._flushing = threading.Event()
+
+    def put(self, notification):
+        self._start_worker()
+        self._queue.put(notification)
+
+    def flush(self):
+        """Send everything queued so far and wait for it (used by tests, process_payments and at exit)."""
+        if self._thread is None:
+            return
+        self._flushing.set()
+        self._queue.join()
+        self._flushing.clear()
+
+    def _start_worker(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='rental-notifications', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + settings.NOTIFICATION_BATCH_WINDOW
+            # collect the rest of the window, unless flush() is waiting on us
+            while len(batch) < settings.NOTIFICATION_BATCH_SIZE:
+                timeout = 0 if self._flushing.is_set() else deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=max(timeout, 0)))
+                except queue.Empty:
+                    break
+            try:
+                send_batch(batch)
+            except Exception:
+                logger.exception('Failed to send %s rental notifications', len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+_notifications = NotificationQueue()
+# the worker is a daemon thread: without this, a restarting web worker drops its queue
+atexit.register(_notifications.flush)
+
+
+def notify(kind, rental):
+    """Queue a notification about this rental for when the current transaction commits."""
+    notification = {
+        'kind': kind,
+        'schema_name': connection.schema_name,
+        'rental_id': rental.pk,
+        'user_id': rental.user_id,
+        'rental_start': rental.rental_start,
+        'rental_end': rental.rental_end,
+        'total_cost': rental.total_cost,
+    }
+    transaction.on_commit(partial(_notifications.put, notification))
+
+
+def flush():
+    _notifications.flush()
+
+
+def send_batch(batch):
+    """Collapse duplicates, resolve recipients in one query and send over one connection."""
+    from users.models import User
+
+    # the latest event wins for each (tenant, rental, kind)
+    latest = {}
+    for notification in batch:
+        latest[(notification['schema_name'], notification['rental_id'], notification['kind'])] = notification
+    notifications = list(latest.values())
+
+    close_old_connections()
+    emails = dict(
+        User.objects.filter(pk__in={notification['user_id'] for notification in notifications})
+        .exclude(email='')
+        .values_list('pk', 'email')
+    )
+
+    messages = []
+    for notification in notifications:
+        email = emails.get(notification['user_id'])
+        if not email:
+            continue
+        messages.append(EmailMessage(
+            subject=SUBJECTS[notification['kind']].format(**notification),
+            body=BODIES[notification['kind']].format(**notification),
+            to=[email],
+        ))
+    if messages:
+        get_connection().send_messages(messages)
+    return len(messages)
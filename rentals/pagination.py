@@ -0,0 +1,103 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class RentalKeysetPagination(BasePagination):
+    """Keyset pagination on (rental_start, id), newest first, for GET /rentals/ and history.
+    Pages are values() rows (dicts with rental_start and id), serialized by the compiled RentalSerializer.
+
+    The cursor is the (rental_start, id) of the last row of the previous page, so
+    every page is an index range scan on rental_list_keyset_idx, however deep it is.
+    """
+    ordering = ('-rental_start', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            rental_start, rental_id = position
+            # The first condition bounds the index scan, the second breaks ties on id
+            queryset = queryset.filter(rental_start__lte=rental_start).filter(
+                Q(rental_start__lt=rental_start) | Q(id__lt=rental_id)
+            )
+
+        rows = list(queryset.order_by(*self.ordering)[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.next_position = (rows[-1]['rental_start'], rows[-1]['id']) if self.has_next else None
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Number of results to return per page.',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
+    def encode_cursor(self, position):
+        rental_start, rental_id = position
+        return base64.urlsafe_b64encode(f'{rental_start.isoformat()}|{rental_id}'.encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            rental_start, rental_id = base64.urlsafe_b64decode(encoded.encode()).decode().split('|')
+            position = datetime.fromisoformat(rental_start), int(rental_id)
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        # only cursors this class encodes: no trailing bytes, other spellings or naive datetimes
+        if self.encode_cursor(position) != encoded or position[0].tzinfo is None:
+            raise NotFound(self.invalid_cursor_message)
+        return position
@@ -0,0 +1,147 @@
+"""
+Payment outbox for checkout, extension and refund.
+
+The API never calls Stripe itself: it records a PaymentTask and answers 202.
+The process_payments workers claim due tasks, call Stripe with the task's
+idempotency key (so a retried or re-claimed task never charges twice) and then
+move the Rental forward: confirm it, add the extension cost, or cancel it.
+"""
+import logging
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import stripe
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import PaymentTask, Rental
+from .utils import PaymentInProgress
+
+logger = logging.getLogger(__name__)
+
+# Stripe or the network may recover from these, so the task is retried with backoff.
+# Anything else (card declined, invalid request, bad API key) fails the task right away.
+RETRYABLE_ERRORS = (stripe.APIConnectionError, stripe.RateLimitError, stripe.APIError)
+
+
+def enqueue_payment(rental, kind, amount_cents=None, **payload):
+    """Record a Stripe call for the workers. Raises PaymentInProgress if one of the same kind is queued."""
+    try:
+        with transaction.atomic():
+            return PaymentTask.objects.create(rental=rental, kind=kind, amount_cents=amount_cents, payload=payload)
+    except IntegrityError:
+        # payment_task_one_in_flight: e.g. a double-clicked checkout
+        raise PaymentInProgress()
+
+
+def claim_payment_tasks(batch_size):
+    """Mark up to batch_size due tasks of the current tenant as processing and return their ids.
+
+    Tasks left in 'processing' by a worker that died are claimed again once their lease expires.
+    """
+    now = timezone.now()
+    lease_expired = now - timedelta(seconds=settings.PAYMENT_TASK_LEASE)
+    with transaction.atomic():
+        task_ids = list(
+            PaymentTask.objects.select_for_update(skip_locked=True)
+            .filter(Q(status='pending', next_attempt_at__lte=now) | Q(status='processing', updated_at__lt=lease_expired))
+            .order_by('next_attempt_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        PaymentTask.objects.filter(id__in=task_ids).update(status='processing', attempts=F('attempts') + 1, updated_at=now)
+    return task_ids
+
+
+def process_payment_task(task_id):
+    """Carry out one claimed task: call Stripe, then apply the outcome to the rental."""
+    task = PaymentTask.objects.select_related('rental').get(pk=task_id)
+
+    # 1. A checkout or extension of a rental cancelled since it was queued is not charged
+    if task.kind in ('checkout', 'extension') and task.rental.status == 'cancelled':
+        _finish(task, 'failed', last_error='Rental was cancelled before the payment was processed.')
+        return task
+
+    # 2. Call Stripe
+    try:
+        stripe_object = _call_stripe(task)
+    except stripe.StripeError as e:
+        _payment_failed(task, e)
+        return task
+
+    # 3. Apply the outcome
+    _payment_succeeded(task, stripe_object)
+    return task
+
+
+def _call_stripe(task):
+    idempotency_key = str(task.idempotency_key)
+    if task.kind == 'refund':
+        return stripe.Refund.create(
+            payment_intent=task.payload['payment_intent_id'],
+            idempotency_key=idempotency_key,
+        )
+
+    metadata = {'rental_id': task.rental_id, 'user_id': task.rental.user_id}
+    if task.kind == 'extension':
+        metadata['extension'] = 'true'
+    return stripe.PaymentIntent.create(
+        amount=task.amount_cents,
+        currency='usd',
+        payment_method_types=['card'],
+        metadata=metadata,
+        idempotency_key=idempotency_key,
+    )
+
+
+def _payment_succeeded(task, stripe_object):
+    with transaction.atomic():
+        rental = Rental.objects.select_for_update().get(pk=task.rental_id)
+
+        if task.kind == 'checkout':
+            if rental.status == 'cancelled':
+                # Cancelled while the charge was in flight: give the money back
+                PaymentTask.objects.create(rental=rental, kind='refund', payload={'payment_intent_id': stripe_object.id})
+            else:
+                rental.total_cost = Decimal(task.payload['total_cost'])
+                rental.payment_intent_id = stripe_object.id
+                if rental.status == 'active':
+                    rental.status = 'confirmed'
+                rental.save()
+
+        elif task.kind == 'extension':
+            current_total_cost = rental.total_cost if rental.total_cost is not None else Decimal('0.00')
+            rental.total_cost = current_total_cost + Decimal(task.payload['extension_cost'])
+            rental.save()
+
+        elif task.payload.get('cancel_rental') and rental.status != 'cancelled':
+            rental.status = 'cancelled'
+            rental.save()
+
+        _finish(task, 'succeeded', stripe_id=stripe_object.id, last_error=None)
+
+
+def _payment_failed(task, error):
+    if isinstance(error, RETRYABLE_ERRORS) and task.attempts < settings.PAYMENT_MAX_ATTEMPTS:
+        delay = min(settings.PAYMENT_RETRY_DELAY * 2 ** (task.attempts - 1), settings.PAYMENT_RETRY_MAX_DELAY)
+        logger.warning('Payment task %s failed (attempt %s), retrying in %ss: %s', task.id, task.attempts, delay, error)
+        _finish(task, 'pending', next_attempt_at=timezone.now() + timedelta(seconds=delay), last_error=str(error))
+        return
+
+    logger.error('Payment task %s failed: %s', task.id, error)
+    with transaction.atomic():
+        if task.kind == 'extension':
+            # Give back the reserved extension, unless the rental has been changed since
+            rental = Rental.objects.select_for_update().get(pk=task.rental_id)
+            if rental.rental_end == datetime.fromisoformat(task.payload['new_rental_end']):
+                rental.rental_end = datetime.fromisoformat(task.payload['previous_rental_end'])
+                rental.save()
+        _finish(task, 'failed', last_error=str(error))
+
+
+def _finish(task, status, **fields):
+    for name, value in fields.items():
+        setattr(task, name, value)
+    task.status = status
+    task.save(update_fields=['status', 'updated_at', *fields])
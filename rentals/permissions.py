@@ -6,4 +6,5 @@ class IsRentalUserOrAdmin(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.user.is_staff or request.user.is_superuser:
             return True
-        return obj.user == request.user
\ No newline at end of file
+        # compare ids, so checking a rental doesn't load its user
+        return obj.user_id == request.user.pk
\ No newline at end of file
@@ -0,0 +1,39 @@
+from rest_framework.renderers import BaseRenderer
+
+from CarRentalService.fastjson import dumps
+
+# Rows fetched from the server-side cursor (and serialized) at a time when streaming
+STREAM_CHUNK_SIZE = 2000
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Newline-delimited JSON, selected with ?format=ndjson.
+
+    List endpoints stream their rows with stream_ndjson(); this renderer only
+    handles ordinary responses (errors, single objects) in that format.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return b''.join(_dumps(row) for row in rows)
+
+
+def stream_ndjson(queryset, serializer, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield one JSON line per row of a compiled serializer (values_serializers), holding at most chunk_size rows in memory."""
+    batch = []
+    for row in serializer.values(queryset).iterator(chunk_size=chunk_size):
+        batch.append(row)
+        if len(batch) == chunk_size:
+            yield b''.join(_dumps(row) for row in serializer.serialize(batch))
+            batch = []
+    if batch:
+        yield b''.join(_dumps(row) for row in serializer.serialize(batch))
+
+
+def _dumps(row):
+    return dumps(row) + b'\n'
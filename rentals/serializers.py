@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Rental, DamageReport, Review
+from .models import Rental, DamageReport, Review, PaymentTask
 from vehicles.models import Vehicle
 from django.utils import timezone
 from users.models import User
@@ -15,29 +15,73 @@ class RentalSerializer(serializers.ModelSerializer):
         read_only_fields = ['status'] # Status is managed by the system
 
     def validate(self, data):
-        rental_start = data['rental_start']
-        rental_end = data['rental_end']
-        vehicle = data['vehicle']
+        validate_rental_period(data['rental_start'], data['rental_end'])
+        # Overlaps with active/confirmed rentals are rejected atomically by the
+        # rental_vehicle_no_overlap exclusion constraint when the rental is saved
+        # (see RentalViewSet.perform_create), not by a check-then-insert here.
+        return data
+
+
+def validate_rental_period(rental_start, rental_end):
+    #check that rental_end is after rental_start
+    if rental_start >= rental_end:
+        raise serializers.ValidationError('Rental end date must be after the start date.')
+    
+    #check for future bookings(prevent backdated rentals)
+    if rental_start < timezone.now():
+        raise serializers.ValidationError('Rental start date cannot be in the past.')
+
+
+class BulkRentalItemSerializer(serializers.Serializer):
+    """One (vehicle_id, rental_start, rental_end) item of a bulk booking."""
+    vehicle_id = serializers.IntegerField()
+    rental_start = serializers.DateTimeField()
+    rental_end = serializers.DateTimeField()
+
+    def validate(self, data):
+        validate_rental_period(data['rental_start'], data['rental_end'])
+        return data
+
+
+class BulkRentalSerializer(serializers.Serializer):
+    MAX_ITEMS = 200
 
-        #check that rental_end is after rental_start
-        if rental_start >= rental_end:
+    mode = serializers.ChoiceField(choices=['all_or_nothing', 'best_effort'], default='all_or_nothing')
+    user_id = serializers.IntegerField(required=False)
+    # items are validated one by one in the view so each gets its own result
+    items = serializers.ListField(child=serializers.DictField(), allow_empty=False, max_length=MAX_ITEMS)
+
+class QuoteIntervalSerializer(serializers.Serializer):
+    rental_start = serializers.DateTimeField()
+    rental_end = serializers.DateTimeField()
+
+    def validate(self, data):
+        if data['rental_start'] >= data['rental_end']:
             raise serializers.ValidationError('Rental end date must be after the start date.')
-        
-        #check for future bookings(prevent backdated rentals)
-        if rental_start < timezone.now():
-            raise serializers.ValidationError('Rental start date cannot be in the past.')
-        
-        # Check for overlapping rentals for the same vehicle
-        overlapping_rentals = Rental.objects.filter(
-            vehicle=vehicle,
-            status__in=['active'], # Only check against active rentals
-            rental_start__lt=rental_end,
-            rental_end__gt=rental_start,
-        ).exists()
-        if overlapping_rentals:
-            raise serializers.ValidationError(f'Vehicle {vehicle.license_plate} is already booked during this period.')
         return data
-    
+
+
+class QuoteRequestSerializer(serializers.Serializer):
+    MAX_QUOTES = 100_000
+
+    vehicle_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=5000)
+    intervals = QuoteIntervalSerializer(many=True, allow_empty=False, max_length=500)
+
+    def validate(self, data):
+        if len(data['vehicle_ids']) * len(data['intervals']) > self.MAX_QUOTES:
+            raise serializers.ValidationError(f'At most {self.MAX_QUOTES} quotes (vehicles x intervals) per request.')
+        return data
+
+class PaymentTaskSerializer(serializers.ModelSerializer):
+    """Status of a queued Stripe call; status_url is what clients poll after a 202."""
+    rental_id = serializers.IntegerField(read_only=True)
+    status_url = serializers.HyperlinkedIdentityField(view_name='payment-detail')
+
+    class Meta:
+        model = PaymentTask
+        fields = ['id', 'rental_id', 'kind', 'status', 'amount_cents', 'stripe_id', 'last_error', 'attempts', 'created_at', 'updated_at', 'status_url']
+        read_only_fields = fields
+
 class DamageReportSerializer(serializers.ModelSerializer):
     class Meta:
         model = DamageReport
@@ -1,17 +1,144 @@
-from .models import Rental
-from django.db.models.signals import post_save
+from .models import Rental, Review
+from .utils import apply_review_to_rating, refresh_vehicle_rating, apply_rental_change, refresh_vehicle_rollups, ROLLUP_SOURCE_FIELDS
+from django.db import connection, transaction
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
+from functools import partial
+from vehicles import availability, calendar
+from CarRentalService import conditional
+from . import notifications
 
 
+# --- Notifications (rentals/notifications.py) ---
+# queued on commit and sent in batches by a background thread
+
 @receiver(post_save, sender=Rental)
-def send_rental_notifications(sender, instance, created, **kwargs):
+def send_rental_notifications(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
     if created:
-        # a new rental has been created(confirmed payment)
-        print(f"TASK: Sending Booking Confirmation to User {instance.user.email}") #replaece with actual email sending logic
-    elif instance.status == 'comleted':
+        # a new rental has been booked
+        notifications.notify('booking_confirmation', instance)
+        return
+    # only notify when the status actually changes, not on every save
+    previous_status = getattr(instance, '_loaded_values', {}).get('status')
+    if instance.status == previous_status:
+        return
+    if instance.status == 'completed':
         #rental status changed to completed(vehicle returned)
-        print(f'TASK: Sending Receipt to User {instance.user.email} for Rental {instance.id}') #replaece with actual email sending logic
+        notifications.notify('receipt', instance)
     elif instance.status == 'cancelled':
         #rental cancelled(refund if paid)
-        print(f'TASK: Sending Cancellation/Refund Notice to User {instance.user.email} for Rental {instance.id}') #replaece with actual email sending logic
-        
\ No newline at end of file
+        notifications.notify('cancellation', instance)
+
+
+# --- Vehicle rating aggregates (read by VehicleSeializer.get_average_rating) ---
+
+@receiver(post_save, sender=Rental)
+def update_rating_on_status_change(sender, instance, created, raw=False, **kwargs):
+    if created or raw:
+        return
+    previous_status = getattr(instance, '_loaded_values', {}).get('status')
+    was_completed = previous_status == 'completed'
+    is_completed = instance.status == 'completed'
+    if was_completed == is_completed:
+        return
+    # only reviews of completed rentals count, so the review moves in or out of the aggregate
+    rating = Review.objects.filter(rental_id=instance.pk).values_list('rating', flat=True).first()
+    if rating is not None:
+        apply_review_to_rating(instance.vehicle_id, rating, 1 if is_completed else -1)
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_review_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    rental = instance.rental
+    if created:
+        if rental.status == 'completed':
+            apply_review_to_rating(rental.vehicle_id, instance.rating, 1)
+    else:
+        # the rating may have been edited; recount this vehicle
+        refresh_vehicle_rating(rental.vehicle_id)
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_review_delete(sender, instance, **kwargs):
+    rental = Rental.objects.filter(pk=instance.rental_id).values('vehicle_id', 'status').first()
+    if rental and rental['status'] == 'completed':
+        apply_review_to_rating(rental['vehicle_id'], instance.rating, -1)
+
+
+# --- Daily rollups (read by GET /rentals/stats/) ---
+# applied in the same transaction as the rental change, so they roll back with it
+
+@receiver(pre_save, sender=Rental)
+def load_previous_values(sender, instance, raw=False, **kwargs):
+    # saved without being loaded first (or with deferred fields): read what the row holds,
+    # so the rollups of a vehicle the rental moves away from are updated too
+    loaded = getattr(instance, '_loaded_values', {})
+    if raw or instance.pk is None or all(field in loaded for field in ROLLUP_SOURCE_FIELDS):
+        return
+    previous = Rental.objects.filter(pk=instance.pk).values(*ROLLUP_SOURCE_FIELDS).first()
+    if previous:
+        instance._loaded_values = {**previous, **loaded}
+
+
+@receiver(post_save, sender=Rental)
+def update_rollups_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    new = {field: getattr(instance, field) for field in ROLLUP_SOURCE_FIELDS}
+    if created:
+        apply_rental_change(None, new)
+        return
+    loaded = getattr(instance, '_loaded_values', {})
+    if not all(field in loaded for field in ROLLUP_SOURCE_FIELDS):
+        # the row could not be read before the save: the previous values are unknown
+        refresh_vehicle_rollups(instance.vehicle_id)
+        return
+    apply_rental_change({field: loaded[field] for field in ROLLUP_SOURCE_FIELDS}, new)
+
+
+@receiver(post_delete, sender=Rental)
+def update_rollups_on_delete(sender, instance, **kwargs):
+    apply_rental_change({field: getattr(instance, field) for field in ROLLUP_SOURCE_FIELDS}, None)
+
+
+# --- Availability index (vehicles/availability.py) ---
+# applied on commit so a rolled back booking never shows up as busy
+
+@receiver(post_save, sender=Rental)
+def update_availability_on_save(sender, instance, **kwargs):
+    transaction.on_commit(partial(
+        availability.rental_changed,
+        connection.schema_name,
+        instance.pk,
+        instance.vehicle_id,
+        instance.rental_start,
+        instance.rental_end,
+        instance.status,
+    ))
+
+
+@receiver(post_delete, sender=Rental)
+def update_availability_on_delete(sender, instance, **kwargs):
+    transaction.on_commit(partial(availability.rental_deleted, connection.schema_name, instance.pk))
+
+
+# --- Occupancy calendar cache (vehicles/calendar.py) ---
+
+@receiver(post_save, sender=Rental)
+@receiver(post_delete, sender=Rental)
+def invalidate_calendar(sender, instance, **kwargs):
+    transaction.on_commit(partial(calendar.invalidate, connection.schema_name))
+
+
+# --- ETags of the rental read endpoints (CarRentalService/conditional.py) ---
+
+@receiver(post_save, sender=Rental)
+@receiver(post_delete, sender=Rental)
+def bump_rental_version(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    conditional.bump(Rental)
@@ -1,3 +1,1090 @@
-from django.test import TestCase
+import base64
+import json
+import random
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from functools import partial
+from importlib import import_module
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import stripe
+
+from django.apps import apps as django_apps
+from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.timezone import now as timezone_now
+from django.utils.timezone import override as override_timezone
+from django.utils.translation import gettext_lazy
+from django_tenants.test.cases import TenantTestCase
+from django_tenants.test.client import TenantClient
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser as DRFJSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.throttling import AnonRateThrottle
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from CarRentalService import authentication, cache, conditional, fastjson
+from CarRentalService.query_budget import QueryBudgetExceeded
+from CarRentalService.testing import QueryCountAssertions, TenantAPITestMixin
+from CarRentalService.values_serializers import compile_serializer
+from users.models import User
+from vehicles.models import TableVersion, Vehicle
+from .pagination import RentalKeysetPagination
+from .payments import claim_payment_tasks, enqueue_payment, process_payment_task
+from . import notifications
+from .models import PaymentTask, Rental, RentalDailyRollup, Review, VehicleRating
+from .renderers import _dumps, stream_ndjson
+from .serializers import BulkRentalSerializer, PaymentTaskSerializer, RentalSerializer
+from .utils import (
+    PaymentInProgress, apply_review_to_rating, calculate_rental_cost, quote_rental_costs, rebuild_rental_rollups, rebuild_vehicle_ratings, refresh_vehicle_rating,
+)
+from .views import RentalViewSet
+
+
+class QuoteRentalCostsTests(SimpleTestCase):
+    """quote_rental_costs must agree exactly with calculate_rental_cost."""
+
+    def random_rate(self, rng):
+        return rng.choice([
+            Decimal(rng.randint(0, 100_000)) / 100,   # DecimalField(decimal_places=2) rates
+            Decimal(rng.randint(1, 500)),
+            Decimal('45.5'),
+            Decimal('1E+1'),
+            Decimal(rng.random() * 100),              # float-derived rates take the scalar fallback
+            rng.randint(1, 500),
+        ])
+
+    def random_interval(self, rng):
+        rental_start = datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(microseconds=rng.randint(0, 10 ** 14))
+        duration = rng.choice([
+            timedelta(days=rng.randint(0, 60)),
+            timedelta(days=rng.randint(1, 10), microseconds=rng.choice([-1, 0, 1])),
+            timedelta(microseconds=rng.randint(1, 10 ** 12)),
+        ])
+        return rental_start, rental_start + duration
+
+    def assertSameCosts(self, rates, intervals):
+        quotes = quote_rental_costs(rates, intervals)
+        self.assertEqual(len(quotes), len(rates))
+        for rate, row in zip(rates, quotes):
+            expected = [calculate_rental_cost(start, end, rate) for start, end in intervals]
+            # compare the string form too: same value *and* same exponent
+            self.assertEqual([str(cost) for cost in row], [str(cost) for cost in expected])
+
+    def test_matches_scalar_function_on_random_inputs(self):
+        rng = random.Random(20251018)
+        for _ in range(500):
+            rates = [self.random_rate(rng) for _ in range(rng.randint(1, 8))]
+            intervals = [self.random_interval(rng) for _ in range(rng.randint(1, 8))]
+            with self.subTest(rates=rates, intervals=intervals):
+                self.assertSameCosts(rates, intervals)
+
+    def test_partial_days_round_up(self):
+        start = datetime(2025, 6, 1, 10, tzinfo=timezone.utc)
+        intervals = [(start, start + timedelta(days=1)), (start, start + timedelta(days=1, microseconds=1))]
+        self.assertEqual(quote_rental_costs([Decimal('45.50')], intervals), [[Decimal('45.50'), Decimal('91.00')]])
+
+    def test_negative_durations_and_rates_fall_back_to_scalar(self):
+        start = datetime(2025, 6, 1, tzinfo=timezone.utc)
+        self.assertSameCosts([Decimal('-3.00'), Decimal('0.00')], [(start, start - timedelta(hours=30))])
+
+    def test_empty_inputs(self):
+        self.assertEqual(quote_rental_costs([], [(datetime.now(timezone.utc),) * 2]), [])
+        self.assertEqual(quote_rental_costs([Decimal('10.00')], []), [[]])
+
+
+class FastJSONTests(SimpleTestCase):
+    """CarRentalService/fastjson.py renders and parses like DRF's JSONRenderer and JSONParser."""
+
+    def test_renders_like_drf(self):
+        nairobi = timezone(timedelta(hours=3))
+        data = {
+            'decimals': [Decimal('45.50'), Decimal('0'), Decimal('-1.000001'), Decimal('123456789.99')],
+            'aware': [datetime(2030, 1, 1, 9, 30, tzinfo=timezone.utc), datetime(2030, 1, 1, 9, 30, 15, 123456, tzinfo=timezone.utc),
+                      datetime(2030, 1, 1, 12, 30, tzinfo=nairobi)],
+            'naive': [datetime(2030, 1, 1, 9, 30), datetime(2030, 1, 1, 9, 30, 0, 500)],
+            'date': datetime(2030, 1, 1).date(),
+            'duration': timedelta(days=1, seconds=5),
+            'lazy': gettext_lazy('Invalid cursor'),
+            'separators': 'line\u2028paragraph\u2029end',
+            'unicode': 'Škoda Octavia “RS” 🚗',
+            'big': [2 ** 64, -2 ** 63 - 1, 2 ** 63 - 1],
+            'numbers': [0, -1, 1.5, 0.1, True, False, None],
+            'nested': {'empty': {}, 'list': [[]], 'key with "quotes"': 'a\\b\n'},
+        }
+        for value in [data, *data.values(), {1: 'not a str key'}, [], 'plain']:
+            with self.subTest(value=value):
+                self.assertEqual(fastjson.JSONRenderer().render(value), JSONRenderer().render(value))
+
+    def test_parse_errors_like_drf(self):
+        for body in [b'{', b'{"a": NaN}', b'[Infinity]', b'[1,]', b"{'a': 1}", b'\xff', b'', b'{"a": 1} x']:
+            errors = []
+            for parser in (fastjson.JSONParser(), DRFJSONParser()):
+                with self.assertRaises(ParseError) as raised:
+                    parser.parse(BytesIO(body), parser_context={'encoding': 'utf-8'})
+                errors.append(str(raised.exception.detail))
+            with self.subTest(body=body):
+                self.assertEqual(errors[0], errors[1])
+
+    def test_parses_like_drf(self):
+        body = '{"rate": 45.5, "ids": [1, 2, 18446744073709551615], "name": "Škoda", "none": null}'.encode()
+        self.assertEqual(
+            fastjson.JSONParser().parse(BytesIO(body), parser_context={'encoding': 'utf-8'}),
+            DRFJSONParser().parse(BytesIO(body), parser_context={'encoding': 'utf-8'}),
+        )
+
+
+class RentalValuesSerializerTests(TenantTestCase):
+    """The compiled RentalSerializer must render exactly like RentalSerializer."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='values', email='values@example.com', password=None)
+        self.vehicles = Vehicle.objects.bulk_create([
+            Vehicle(make='Toyota', model='Corolla', year=2018 + i, license_plate=f'VAL {i}', rental_rate_per_day=Decimal('45.50'))
+            for i in range(3)
+        ])
+        start = datetime(2030, 1, 1, 9, 30, tzinfo=timezone.utc)
+        statuses = ['active', 'confirmed', 'completed', 'cancelled']
+        rentals = []
+        for i in range(40):
+            rental_start = start + timedelta(days=3 * i, microseconds=i * 12345 if i % 3 else 0)
+            rentals.append(Rental(
+                user=self.user,
+                vehicle=self.vehicles[i % 3],
+                rental_start=rental_start,
+                rental_end=rental_start + timedelta(days=1, hours=i % 5),
+                status=statuses[i % 4],
+                total_cost=Decimal(i * 10) if i % 2 else None,
+            ))
+        Rental.objects.bulk_create(rentals)
+
+    def assertSameJSON(self, serializer_class, queryset):
+        compiled = compile_serializer(serializer_class)
+        expected = JSONRenderer().render(serializer_class(queryset, many=True).data)
+        self.assertEqual(JSONRenderer().render(compiled.serialize(compiled.values(queryset))), expected)
+
+    def test_rentals_render_identically(self):
+        self.assertSameJSON(RentalSerializer, Rental.objects.order_by('-rental_start', '-id'))
+
+    def test_datetimes_follow_the_current_timezone(self):
+        with override_timezone('Africa/Nairobi'):
+            self.assertSameJSON(RentalSerializer, Rental.objects.order_by('-rental_start', '-id'))
+
+    def test_ndjson_stream_matches_serializer(self):
+        queryset = Rental.objects.order_by('-rental_start', '-id')
+        expected = b''.join(_dumps(row) for row in RentalSerializer(queryset, many=True).data)
+        self.assertEqual(b''.join(stream_ndjson(queryset, compile_serializer(RentalSerializer), chunk_size=7)), expected)
+
+    def test_list_endpoint_pages_match_serializer(self):
+        token = authentication.add_claims(RefreshToken.for_user(self.user), self.user, self.tenant.schema_name).access_token
+        client = TenantClient(self.tenant, HTTP_AUTHORIZATION=f'Bearer {token}')
+        ordered = list(Rental.objects.order_by('-rental_start', '-id'))
+        first = client.get('/rentals/', {'page_size': 25}).json()
+        second = client.get(first['next']).json()
+        self.assertEqual(first['results'], json.loads(JSONRenderer().render(RentalSerializer(ordered[:25], many=True).data)))
+        self.assertEqual(second['results'], json.loads(JSONRenderer().render(RentalSerializer(ordered[25:], many=True).data)))
+        self.assertIsNone(second['next'])
+
+    def test_fields_without_values_equivalent_are_rejected(self):
+        # status_url is a hyperlink, built from the request
+        with self.assertRaises(ImproperlyConfigured):
+            compile_serializer(PaymentTaskSerializer)
+
+
+class RentalEndpointQueryCountTests(TenantAPITestMixin, QueryCountAssertions, TenantTestCase):
+    """Queries run by each endpoint of rentals/urls.py (with more rows than QUERY_REPEAT_LIMIT, so N+1 loops fail)."""
+
+    def setUp(self):
+        super().setUp()
+        self.vehicles = Vehicle.objects.bulk_create([
+            Vehicle(make='Toyota', model='Corolla', year=2020, license_plate=f'QC {i}', rental_rate_per_day=Decimal('45.50'))
+            for i in range(8)
+        ])
+        start = timezone_now().replace(microsecond=0) + timedelta(days=10)
+        self.start = start
+        self.rentals = Rental.objects.bulk_create([
+            Rental(user=self.user, vehicle=vehicle, rental_start=start, rental_end=start + timedelta(days=2), status=status)
+            for vehicle, status in zip(self.vehicles, ['active', 'active', 'active', 'confirmed', 'completed', 'completed', 'cancelled', 'active'])
+        ])
+        self.active, self.to_return, self.to_cancel, self.completed = self.rentals[0], self.rentals[1], self.rentals[2], self.rentals[4]
+        PaymentTask.objects.bulk_create([PaymentTask(rental=rental, kind='checkout', amount_cents=100, status='succeeded') for rental in self.rentals])
+        # the aggregates the signals keep current, as a backfill leaves them
+        rebuild_rental_rollups()
+        VehicleRating.objects.bulk_create([VehicleRating(vehicle=vehicle) for vehicle in self.vehicles])
+
+    def test_list(self):
+        self.assertRequestQueries(2, self.client.get, '/rentals/')
+
+    def test_list_over_budget(self):
+        with mock.patch.object(RentalViewSet, 'query_budget', {'list': 1}), self.assertRaisesMessage(QueryBudgetExceeded, 'over its budget of 1'):
+            self.assertRequestQueries(2, self.client.get, '/rentals/')
+
+    def test_list_ndjson(self):
+        self.assertRequestQueries(1, self.client.get, '/rentals/', {'format': 'ndjson'})
+
+    def test_retrieve(self):
+        self.assertRequestQueries(2, self.client.get, f'/rentals/{self.active.pk}/')
+
+    def test_history(self):
+        self.assertRequestQueries(3, self.client.get, f'/rentals/history/{self.user.pk}/')
+
+    def test_create(self):
+        vehicle = Vehicle.objects.create(make='Mazda', model='CX-5', year=2022, license_plate='QC NEW', rental_rate_per_day=Decimal('75.00'))
+        self.assertRequestQueries(6, self.client.post, '/rentals/', {
+            'user_id': self.user.pk, 'vehicle_id': vehicle.pk, 'rental_start': self.iso(self.start), 'rental_end': self.iso(self.start + timedelta(days=1)),
+        }, content_type='application/json', status_code=201)
+
+    def test_return_vehicle(self):
+        self.assertRequestQueries(6, self.client.put, f'/rentals/{self.to_return.pk}/return_vehicle/')
+
+    def test_checkout(self):
+        PaymentTask.objects.all().delete()
+        self.assertRequestQueries(4, self.client.post, f'/rentals/{self.active.pk}/checkout/', status_code=202)
+
+    def test_cancel(self):
+        PaymentTask.objects.all().delete()
+        self.assertRequestQueries(6, self.client.delete, f'/rentals/{self.to_cancel.pk}/')
+
+    def test_extend(self):
+        PaymentTask.objects.all().delete()
+        self.assertRequestQueries(9, self.client.put, f'/rentals/{self.active.pk}/extend/', {
+            'new_rental_end': self.iso(self.active.rental_end + timedelta(days=1)),
+        }, content_type='application/json', status_code=202)
+
+    def test_bulk(self):
+        vehicles = Vehicle.objects.bulk_create([
+            Vehicle(make='Kia', model='Rio', year=2021, license_plate=f'QC BULK {i}', rental_rate_per_day=Decimal('30.00')) for i in range(6)
+        ])
+        self.assertRequestQueries(7, self.client.post, '/rentals/bulk/', {
+            'mode': 'best_effort',
+            'items': [
+                {'vehicle_id': vehicle.pk, 'rental_start': self.iso(self.start), 'rental_end': self.iso(self.start + timedelta(days=1))}
+                for vehicle in vehicles
+            ],
+        }, content_type='application/json', status_code=201)
+        # the rollups of the six rentals, added in one statement, are what a rebuild computes
+        rollups = list(RentalDailyRollup.objects.order_by('day', 'vehicle_id').values())
+        rebuild_rental_rollups()
+        self.assertEqual([{**row, 'id': None} for row in rollups], [
+            {**row, 'id': None} for row in RentalDailyRollup.objects.order_by('day', 'vehicle_id').values()
+        ])
+
+    def test_quotes(self):
+        self.assertRequestQueries(1, self.client.post, '/rentals/quotes/', {
+            'vehicle_ids': [vehicle.pk for vehicle in self.vehicles],
+            'intervals': [{'rental_start': self.iso(self.start), 'rental_end': self.iso(self.start + timedelta(days=3))}],
+        }, content_type='application/json')
+
+    def test_quotes_throttled_for_anonymous_users(self):
+        body = {
+            'vehicle_ids': [vehicle.pk for vehicle in self.vehicles],
+            'intervals': [{'rental_start': self.iso(self.start), 'rental_end': self.iso(self.start + timedelta(days=3))}],
+        }
+        anonymous = TenantClient(self.tenant)
+        with mock.patch.dict(AnonRateThrottle.THROTTLE_RATES, {'anon': '2/minute'}):
+            statuses = [anonymous.post('/rentals/quotes/', body, content_type='application/json').status_code for _ in range(3)]
+            # the authenticated client isn't throttled
+            self.assertEqual(self.client.post('/rentals/quotes/', body, content_type='application/json').status_code, 200)
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_stats(self):
+        self.assertRequestQueries(2, self.admin_client.get, '/rentals/stats/', {'group_by': 'vehicle'})
+
+    def test_payments(self):
+        self.assertRequestQueries(1, self.client.get, '/rentals/payments/')
+
+    def test_payment(self):
+        self.assertRequestQueries(1, self.client.get, f'/rentals/payments/{PaymentTask.objects.first().pk}/')
+
+    def test_damage_report(self):
+        self.assertRequestQueries(2, self.client.post, '/rentals/reports/', {
+            'rental': self.active.pk, 'description': 'Scratched door',
+        }, content_type='application/json', status_code=201)
+
+    def test_review(self):
+        self.assertRequestQueries(4, self.client.post, '/rentals/reviews/', {
+            'rental': self.completed.pk, 'rating': 4, 'comment': 'Clean car',
+        }, content_type='application/json', status_code=201)
+
+
+class BillingRateTests(TenantAPITestMixin, TenantTestCase):
+    """Checkout and extension bill from the vehicle's rate in the database, not from a worker's cached copy."""
+
+    def setUp(self):
+        super().setUp()
+        self.vehicle = Vehicle.objects.create(make='Toyota', model='Corolla', year=2020, license_plate='RATE 1', rental_rate_per_day=Decimal('50.00'))
+        start = timezone_now().replace(microsecond=0) + timedelta(days=10)
+        self.rental = Rental.objects.create(user=self.user, vehicle=self.vehicle, rental_start=start, rental_end=start + timedelta(days=2), status='active')
+        # cached by this worker, then repriced by another one: this worker's copy isn't dropped
+        cache.get_object(Vehicle, self.vehicle.pk)
+        Vehicle.objects.filter(pk=self.vehicle.pk).update(rental_rate_per_day=Decimal('80.00'))
+
+    def test_checkout(self):
+        response = self.client.post(f'/rentals/{self.rental.pk}/checkout/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['total_cost'], Decimal('160.00'))
+        self.assertEqual(PaymentTask.objects.get(rental=self.rental).amount_cents, 16000)
+
+    def test_extend(self):
+        response = self.client.put(f'/rentals/{self.rental.pk}/extend/', {
+            'new_rental_end': self.iso(self.rental.rental_end + timedelta(days=1)),
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['extension_cost'], Decimal('80.00'))
+
+
+class BookingConflictTests(TenantAPITestMixin, TenantTestCase):
+    """Overlapping bookings of a vehicle are refused by the rental_vehicle_no_overlap constraint with a 409."""
+
+    def setUp(self):
+        super().setUp()
+        self.vehicle = Vehicle.objects.create(make='Toyota', model='Corolla', year=2020, license_plate='BOOK 1', rental_rate_per_day=Decimal('50.00'))
+        self.start = timezone_now().replace(microsecond=0) + timedelta(days=10)
+        self.booked = Rental.objects.create(
+            user=self.user, vehicle=self.vehicle, rental_start=self.start, rental_end=self.start + timedelta(days=2), status='active',
+        )
+        self.earlier = Rental.objects.create(
+            user=self.user, vehicle=self.vehicle, rental_start=self.start - timedelta(days=3), rental_end=self.start - timedelta(days=1), status='confirmed',
+        )
+
+    def book(self, start, end):
+        return self.client.post('/rentals/', {
+            'user_id': self.user.pk, 'vehicle_id': self.vehicle.pk, 'rental_start': self.iso(start), 'rental_end': self.iso(end),
+        }, content_type='application/json')
+
+    def extend(self, rental, new_end):
+        return self.client.put(f'/rentals/{rental.pk}/extend/', {'new_rental_end': self.iso(new_end)}, content_type='application/json')
+
+    def test_create_overlapping(self):
+        response = self.book(self.start + timedelta(days=1), self.start + timedelta(days=3))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['detail'].code, 'booking_conflict')
+        self.assertEqual(Rental.objects.count(), 2)
+
+    def test_create_touching(self):
+        # periods are half-open: a booking may start when the previous one ends
+        self.assertEqual(self.book(self.start + timedelta(days=2), self.start + timedelta(days=3)).status_code, 201)
+
+    def test_create_over_cancelled(self):
+        Rental.objects.filter(pk=self.booked.pk).update(status='cancelled')
+        self.assertEqual(self.book(self.start, self.start + timedelta(days=1)).status_code, 201)
+
+    def test_extend_into_booking(self):
+        response = self.extend(self.earlier, self.start + timedelta(hours=1))
+        self.assertEqual(response.status_code, 409)
+        self.earlier.refresh_from_db()
+        self.assertEqual(self.earlier.rental_end, self.start - timedelta(days=1))
+        self.assertFalse(PaymentTask.objects.exists())
+
+    def test_extend_into_concurrent_booking(self):
+        # a booking committed between the availability check and the save
+        with mock.patch('rentals.views.is_vehicle_available_for_new_dates', return_value=True):
+            response = self.extend(self.earlier, self.start + timedelta(hours=1))
+        self.assertEqual(response.status_code, 409)
+        self.earlier.refresh_from_db()
+        self.assertEqual(self.earlier.rental_end, self.start - timedelta(days=1))
+        self.assertFalse(PaymentTask.objects.exists())
+
+    def test_existing_overlaps_are_listed(self):
+        migration = import_module('rentals.migrations.0008_rental_vehicle_no_overlap')
+        check_no_overlapping_bookings = partial(migration.check_no_overlapping_bookings, django_apps, connection.schema_editor())
+        check_no_overlapping_bookings()
+        # rows booked before migration 0008 added the constraint (dropped in this test's transaction only)
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            cursor.execute(f'ALTER TABLE {Rental._meta.db_table} DROP CONSTRAINT rental_vehicle_no_overlap')
+        overlapping = Rental.objects.create(
+            user=self.user, vehicle=self.vehicle, rental_start=self.start + timedelta(days=1), rental_end=self.start + timedelta(days=4), status='confirmed',
+        )
+        Rental.objects.create(
+            user=self.user, vehicle=self.vehicle, rental_start=self.start, rental_end=self.start + timedelta(days=4), status='cancelled',
+        )
+        with self.assertRaisesMessage(migration.OverlappingBookings, '1 pair(s) of active or confirmed rentals of one vehicle overlap'):
+            check_no_overlapping_bookings()
+        with self.assertRaisesMessage(migration.OverlappingBookings, f': {self.booked.pk} and {overlapping.pk} (vehicle {self.vehicle.pk})'):
+            check_no_overlapping_bookings()
+
+
+class BulkRentalTests(TenantAPITestMixin, TenantTestCase):
+    """POST /rentals/bulk/ in both modes."""
+
+    def setUp(self):
+        super().setUp()
+        self.vehicles = Vehicle.objects.bulk_create([
+            Vehicle(make='Kia', model='Rio', year=2021, license_plate=f'BULK {i}', rental_rate_per_day=Decimal('30.00')) for i in range(3)
+        ])
+        self.start = timezone_now().replace(microsecond=0) + timedelta(days=10)
+        self.booked = Rental.objects.create(
+            user=self.user, vehicle=self.vehicles[0], rental_start=self.start, rental_end=self.start + timedelta(days=2), status='confirmed',
+        )
+
+    def item(self, vehicle, days=0, length=1):
+        rental_start = self.start + timedelta(days=days)
+        return {'vehicle_id': vehicle.pk, 'rental_start': self.iso(rental_start), 'rental_end': self.iso(rental_start + timedelta(days=length))}
+
+    def bulk(self, items, mode='all_or_nothing'):
+        return self.client.post('/rentals/bulk/', {'mode': mode, 'items': items}, content_type='application/json')
+
+    def statuses(self, response):
+        return [result['status'] for result in response.data['results']]
+
+    def test_all_or_nothing(self):
+        response = self.bulk([self.item(self.vehicles[1]), self.item(self.vehicles[2], days=3)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 0))
+        self.assertEqual(Rental.objects.filter(user=self.user).count(), 3)
+
+    def test_all_or_nothing_conflict(self):
+        response = self.bulk([self.item(self.vehicles[1]), self.item(self.vehicles[0], days=1), self.item(self.vehicles[2])])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.statuses(response), ['skipped', 'conflict', 'skipped'])
+        self.assertEqual(Rental.objects.count(), 1)
+
+    def test_all_or_nothing_invalid(self):
+        invalid = {**self.item(self.vehicles[1]), 'rental_end': self.iso(self.start - timedelta(hours=1))}
+        unknown = {**self.item(self.vehicles[2]), 'vehicle_id': self.vehicles[2].pk + 1000}
+        response = self.bulk([invalid, self.item(self.vehicles[1], days=3), unknown])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.statuses(response), ['invalid', 'skipped', 'invalid'])
+        self.assertEqual(response.data['results'][2]['errors'], {'vehicle_id': ['Vehicle not found.']})
+        self.assertEqual(Rental.objects.count(), 1)
+
+    def test_best_effort(self):
+        invalid = {**self.item(self.vehicles[2]), 'rental_start': 'tomorrow'}
+        response = self.bulk([self.item(self.vehicles[0], days=1), self.item(self.vehicles[1]), invalid, self.item(self.vehicles[0], days=2)], mode='best_effort')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 2))
+        self.assertEqual(self.statuses(response), ['conflict', 'created', 'invalid', 'created'])
+        self.assertEqual(
+            sorted(Rental.objects.exclude(pk=self.booked.pk).values_list('vehicle_id', flat=True)),
+            [self.vehicles[0].pk, self.vehicles[1].pk],
+        )
+
+    def test_best_effort_nothing_created(self):
+        response = self.bulk([self.item(self.vehicles[0])], mode='best_effort')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.statuses(response), ['conflict'])
+
+    def test_overlapping_items(self):
+        # the later of two overlapping items conflicts; touching ones don't
+        response = self.bulk([
+            self.item(self.vehicles[1], length=2), self.item(self.vehicles[1], days=1), self.item(self.vehicles[1], days=2),
+        ], mode='best_effort')
+        self.assertEqual(self.statuses(response), ['created', 'conflict', 'created'])
+        response = self.bulk([self.item(self.vehicles[2], length=2), self.item(self.vehicles[2], days=1)])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.statuses(response), ['skipped', 'conflict'])
+
+    @mock.patch('rentals.views.find_booking_conflicts', return_value=set())
+    def test_concurrent_booking(self, find_booking_conflicts):
+        # booked since the conflict check: the constraint refuses the insert
+        items = [self.item(self.vehicles[1]), self.item(self.vehicles[0], days=1)]
+        response = self.bulk(items)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.statuses(response), ['conflict', 'conflict'])
+        self.assertEqual(Rental.objects.count(), 1)
+        response = self.bulk(items, mode='best_effort')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.statuses(response), ['created', 'conflict'])
+        self.assertEqual(Rental.objects.filter(vehicle=self.vehicles[1]).count(), 1)
+
+    def test_item_limit(self):
+        limit = BulkRentalSerializer.MAX_ITEMS
+        response = self.bulk([self.item(self.vehicles[1], days=day) for day in range(limit + 1)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('items', response.data)
+        self.assertEqual(Rental.objects.count(), 1)
+        response = self.bulk([self.item(self.vehicles[1], days=day) for day in range(limit)])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], limit)
+
+
+class PaymentOutboxTests(TenantAPITestMixin, TenantTestCase):
+    """The payment outbox of rentals/payments.py, with Stripe mocked."""
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(override_settings(PAYMENT_MAX_ATTEMPTS=3, PAYMENT_RETRY_DELAY=5, PAYMENT_RETRY_MAX_DELAY=8, PAYMENT_TASK_LEASE=300))
+        self.vehicle = Vehicle.objects.create(make='Toyota', model='Corolla', year=2020, license_plate='PAY 1', rental_rate_per_day=Decimal('50.00'))
+        self.start = timezone_now().replace(microsecond=0) + timedelta(days=10)
+        self.rental = Rental.objects.create(
+            user=self.user, vehicle=self.vehicle, rental_start=self.start, rental_end=self.start + timedelta(days=2), status='active',
+        )
+        self.payment_intent = self.enterContext(mock.patch('stripe.PaymentIntent.create', return_value=mock.Mock(id='pi_1')))
+        self.refund = self.enterContext(mock.patch('stripe.Refund.create', return_value=mock.Mock(id='re_1')))
+
+    def run_task(self, task):
+        """Claim the task as a worker does and process it."""
+        self.assertEqual(claim_payment_tasks(10), [task.pk])
+        return process_payment_task(task.pk)
+
+    def test_checkout(self):
+        response = self.client.post(f'/rentals/{self.rental.pk}/checkout/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data['total_cost'], response.data['payment']['status']), (Decimal('100.00'), 'pending'))
+        self.rental.refresh_from_db()
+        self.assertEqual(self.rental.status, 'active')
+        self.payment_intent.assert_not_called()
+
+        task = self.run_task(PaymentTask.objects.get(pk=response.data['payment']['id']))
+        self.payment_intent.assert_called_once_with(
+            amount=10000, currency='usd', payment_method_types=['card'],
+            metadata={'rental_id': self.rental.pk, 'user_id': self.user.pk}, idempotency_key=str(task.idempotency_key),
+        )
+        self.assertEqual((task.status, task.stripe_id, task.attempts), ('succeeded', 'pi_1', 1))
+        self.rental.refresh_from_db()
+        self.assertEqual((self.rental.status, self.rental.total_cost, self.rental.payment_intent_id), ('confirmed', Decimal('100.00'), 'pi_1'))
+
+    def test_double_checkout(self):
+        self.assertEqual(self.client.post(f'/rentals/{self.rental.pk}/checkout/').status_code, 202)
+        response = self.client.post(f'/rentals/{self.rental.pk}/checkout/')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['detail'].code, 'payment_in_progress')
+        self.assertEqual(PaymentTask.objects.count(), 1)
+
+    def test_enqueue_once_in_flight(self):
+        first = enqueue_payment(self.rental, 'checkout', amount_cents=100, total_cost='1.00')
+        with self.assertRaises(PaymentInProgress):
+            enqueue_payment(self.rental, 'checkout', amount_cents=100, total_cost='1.00')
+        # payment_task_one_in_flight is per kind, and only while pending or processing
+        enqueue_payment(self.rental, 'refund', payment_intent_id='pi_0')
+        PaymentTask.objects.filter(pk=first.pk).update(status='failed')
+        second = enqueue_payment(self.rental, 'checkout', amount_cents=100, total_cost='1.00')
+        self.assertNotEqual(first.idempotency_key, second.idempotency_key)
+
+    def test_claim(self):
+        now = timezone_now()
+        due = [enqueue_payment(Rental.objects.create(
+            user=self.user, vehicle=self.vehicle, rental_start=self.start + timedelta(days=10 * i), rental_end=self.start + timedelta(days=10 * i + 1),
+        ), 'checkout', amount_cents=100, total_cost='1.00') for i in range(1, 4)]
+        for task, minutes_ago in zip(due, [1, 3, 2]):
+            PaymentTask.objects.filter(pk=task.pk).update(next_attempt_at=now - timedelta(minutes=minutes_ago))
+        later = enqueue_payment(self.rental, 'checkout', amount_cents=100, total_cost='1.00')
+        PaymentTask.objects.filter(pk=later.pk).update(next_attempt_at=now + timedelta(minutes=1))
+
+        with CaptureQueriesContext(connection) as queries:
+            claimed = claim_payment_tasks(2)
+        self.assertTrue(any('FOR UPDATE SKIP LOCKED' in query['sql'] for query in queries))
+        # the longest due first, at most batch_size
+        self.assertEqual(claimed, [due[1].pk, due[2].pk])
+        self.assertEqual(
+            set(PaymentTask.objects.filter(pk__in=claimed).values_list('status', 'attempts')), {('processing', 1)},
+        )
+        self.assertEqual(claim_payment_tasks(10), [due[0].pk])
+        self.assertEqual(claim_payment_tasks(10), [])
+
+    def test_claim_after_lease_expiry(self):
+        task = enqueue_payment(self.rental, 'checkout', amount_cents=100, total_cost='1.00')
+        self.assertEqual(claim_payment_tasks(10), [task.pk])
+        # the worker died while processing it
+        PaymentTask.objects.filter(pk=task.pk).update(updated_at=timezone_now() - timedelta(seconds=299))
+        self.assertEqual(claim_payment_tasks(10), [])
+        PaymentTask.objects.filter(pk=task.pk).update(updated_at=timezone_now() - timedelta(seconds=301))
+        self.assertEqual(claim_payment_tasks(10), [task.pk])
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), ('processing', 2))
+
+    def test_retry_with_backoff(self):
+        self.payment_intent.side_effect = stripe.APIConnectionError('Connection reset')
+        task = enqueue_payment(self.rental, 'checkout', amount_cents=100, total_cost='1.00')
+        for attempt, delay in [(1, 5), (2, 8)]:
+            before = timezone_now()
+            with self.assertLogs('rentals.payments', 'WARNING') as logs:
+                task = self.run_task(task)
+            self.assertIn(f'retrying in {delay}s', logs.output[0])
+            self.assertEqual((task.status, task.attempts, task.last_error), ('pending', attempt, 'Connection reset'))
+            self.assertGreaterEqual(task.next_attempt_at, before + timedelta(seconds=delay))
+            self.assertLessEqual(task.next_attempt_at, timezone_now() + timedelta(seconds=delay))
+            self.assertEqual(claim_payment_tasks(10), [])
+            PaymentTask.objects.filter(pk=task.pk).update(next_attempt_at=timezone_now())
+
+        # the last attempt fails the task
+        with self.assertLogs('rentals.payments', 'ERROR'):
+            task = self.run_task(task)
+        self.assertEqual((task.status, task.attempts), ('failed', 3))
+        keys = {call.kwargs['idempotency_key'] for call in self.payment_intent.call_args_list}
+        self.assertEqual(keys, {str(task.idempotency_key)})
+        self.rental.refresh_from_db()
+        self.assertEqual(self.rental.status, 'active')
+
+    def test_retry_then_success(self):
+        self.payment_intent.side_effect = [stripe.RateLimitError('Too many requests'), mock.Mock(id='pi_2')]
+        task = enqueue_payment(self.rental, 'checkout', amount_cents=100, total_cost='1.00')
+        with self.assertLogs('rentals.payments', 'WARNING'):
+            task = self.run_task(task)
+        PaymentTask.objects.filter(pk=task.pk).update(next_attempt_at=timezone_now())
+        task = self.run_task(task)
+        self.assertEqual((task.status, task.stripe_id, task.attempts, task.last_error), ('succeeded', 'pi_2', 2, None))
+        first, second = self.payment_intent.call_args_list
+        self.assertEqual(first.kwargs['idempotency_key'], str(task.idempotency_key))
+        self.assertEqual(second.kwargs['idempotency_key'], str(task.idempotency_key))
+
+    def test_permanent_failure(self):
+        self.payment_intent.side_effect = stripe.CardError('Your card was declined.', param=None, code='card_declined')
+        with self.assertLogs('rentals.payments', 'ERROR'):
+            task = self.run_task(enqueue_payment(self.rental, 'checkout', amount_cents=100, total_cost='1.00'))
+        self.assertEqual((task.status, task.attempts, task.last_error), ('failed', 1, 'Your card was declined.'))
+        self.rental.refresh_from_db()
+        self.assertEqual((self.rental.status, self.rental.payment_intent_id), ('active', None))
+
+    def test_extend(self):
+        new_end = self.rental.rental_end + timedelta(days=1)
+        response = self.client.put(f'/rentals/{self.rental.pk}/extend/', {'new_rental_end': self.iso(new_end)}, content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        # the new end date is reserved before the charge
+        self.rental.refresh_from_db()
+        self.assertEqual(self.rental.rental_end, new_end)
+
+        task = self.run_task(PaymentTask.objects.get(pk=response.data['payment']['id']))
+        self.assertEqual(task.status, 'succeeded')
+        self.assertEqual(self.payment_intent.call_args.kwargs['metadata']['extension'], 'true')
+        self.rental.refresh_from_db()
+        self.assertEqual((self.rental.rental_end, self.rental.total_cost), (new_end, Decimal('50.00')))
+
+    def test_extend_failure(self):
+        self.payment_intent.side_effect = stripe.CardError('Your card was declined.', param=None, code='card_declined')
+        end = self.rental.rental_end
+        response = self.client.put(f'/rentals/{self.rental.pk}/extend/', {'new_rental_end': self.iso(end + timedelta(days=1))}, content_type='application/json')
+        self.assertEqual(response.status_code, 202)
+        with self.assertLogs('rentals.payments', 'ERROR'):
+            task = self.run_task(PaymentTask.objects.get(pk=response.data['payment']['id']))
+        self.assertEqual(task.status, 'failed')
+        # the reserved dates are given back
+        self.rental.refresh_from_db()
+        self.assertEqual((self.rental.rental_end, self.rental.total_cost), (end, None))
+
+    def test_cancel_confirmed(self):
+        Rental.objects.filter(pk=self.rental.pk).update(status='confirmed', payment_intent_id='pi_0', total_cost=Decimal('100.00'))
+        response = self.client.delete(f'/rentals/{self.rental.pk}/')
+        self.assertEqual(response.status_code, 202)
+        self.rental.refresh_from_db()
+        self.assertEqual(self.rental.status, 'confirmed')
+
+        task = self.run_task(PaymentTask.objects.get(pk=response.data['payment']['id']))
+        self.refund.assert_called_once_with(payment_intent='pi_0', idempotency_key=str(task.idempotency_key))
+        self.assertEqual((task.status, task.stripe_id), ('succeeded', 're_1'))
+        self.rental.refresh_from_db()
+        self.assertEqual(self.rental.status, 'cancelled')
+
+    def test_cancel_during_checkout(self):
+        self.assertEqual(self.client.post(f'/rentals/{self.rental.pk}/checkout/').status_code, 202)
+        self.assertEqual(self.client.delete(f'/rentals/{self.rental.pk}/').status_code, 409)
+
+    def test_checkout_of_cancelled_rental(self):
+        task = enqueue_payment(self.rental, 'checkout', amount_cents=100, total_cost='1.00')
+        Rental.objects.filter(pk=self.rental.pk).update(status='cancelled')
+        task = self.run_task(task)
+        self.assertEqual(task.status, 'failed')
+        self.payment_intent.assert_not_called()
+
+
+class ConditionalGetTests(TenantAPITestMixin, TenantTestCase):
+    """ETags of GET /rentals/ (CarRentalService/conditional.py), moved on by the commit of a write."""
+
+    def setUp(self):
+        super().setUp()
+        # sent by a thread whose database connection would outlive the test database
+        self.enterContext(mock.patch.object(notifications, 'notify'))
+        # committed, as the writes of a test would otherwise join its pending bump (which never runs)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vehicle = Vehicle.objects.create(make='Toyota', model='Corolla', year=2020, license_plate='ETAG 1', rental_rate_per_day=Decimal('50.00'))
+        self.start = timezone_now().replace(microsecond=0) + timedelta(days=10)
+
+    def book(self, days):
+        return Rental.objects.create(
+            user=self.user, vehicle=self.vehicle, rental_start=self.start + timedelta(days=days), rental_end=self.start + timedelta(days=days + 1),
+        )
+
+    def version(self):
+        return conditional.versions([Rental])[0]
+
+    def test_unchanged(self):
+        response = self.client.get('/rentals/')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get('/rentals/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_write(self):
+        etag = self.client.get('/rentals/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            rental = self.book(0)
+        response = self.client.get('/rentals/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual([item['id'] for item in response.json()['results']], [rental.pk])
+
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            rental.status = 'cancelled'
+            rental.save()
+        self.assertEqual(self.client.get('/rentals/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_rolled_back_write(self):
+        etag = self.client.get('/rentals/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.book(0)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(self.client.get('/rentals/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_one_bump_per_transaction(self):
+        version = self.version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                for days in range(5):
+                    self.book(2 * days)
+                with transaction.atomic():
+                    self.book(20)
+                Vehicle.objects.filter(pk=self.vehicle.pk).update(rental_rate_per_day=Decimal('60.00'))
+                conditional.bump(Vehicle)
+        self.assertEqual(len([callback for callback in callbacks if isinstance(callback, conditional._Bump)]), 1)
+        self.assertEqual(self.version(), version + 1)
+        self.assertEqual(conditional.versions([Vehicle])[0], TableVersion.objects.get(table=Vehicle._meta.db_table).version)
+
+    def test_bump_after_rolled_back_savepoint(self):
+        version = self.version()
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                try:
+                    # its bump is dropped with the savepoint
+                    with transaction.atomic():
+                        self.book(0)
+                        raise RuntimeError
+                except RuntimeError:
+                    pass
+                self.book(2)
+        self.assertEqual(self.version(), version + 1)
+
+
+class VehicleRatingTests(TenantTestCase):
+    """The signals of rentals/signals.py keep VehicleRating equal to what rebuild_vehicle_ratings() writes."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='ratings', email='ratings@example.com', password=None)
+        self.vehicles = Vehicle.objects.bulk_create([
+            Vehicle(make='Toyota', model='Corolla', year=2020, license_plate=f'RT {i}', rental_rate_per_day=Decimal('45.50'))
+            for i in range(3)
+        ])
+        self.start = datetime(2030, 1, 1, 9, tzinfo=timezone.utc)
+        self.booked = 0
+        self.statuses = [status for status, _ in Rental._meta.get_field('status').choices]
+
+    def book(self, vehicle, status='completed'):
+        # three days apart, so no two rentals of a vehicle overlap
+        rental_start = self.start + timedelta(days=3 * self.booked)
+        self.booked += 1
+        rental = Rental.objects.create(
+            user=self.user, vehicle=vehicle, rental_start=rental_start,
+            rental_end=rental_start + timedelta(days=1), status=status,
+        )
+        return Rental.objects.get(pk=rental.pk)
+
+    def ratings(self):
+        # a vehicle whose reviews were all removed keeps a row of zeros, which a rebuild leaves out
+        return {
+            row['vehicle_id']: row
+            for row in VehicleRating.objects.values('vehicle_id', *VehicleRating.AGGREGATE_FIELDS)
+            if row['review_count']
+        }
+
+    def assertMatchesRebuild(self):
+        maintained = self.ratings()
+        rebuild_vehicle_ratings()
+        self.assertEqual(maintained, self.ratings())
+
+    def test_review_created(self):
+        Review.objects.create(rental=self.book(self.vehicles[0]), rating=4)
+        Review.objects.create(rental=self.book(self.vehicles[0]), rating=5)
+        # reviews of rentals that are not completed don't count
+        Review.objects.create(rental=self.book(self.vehicles[1], status='active'), rating=1)
+        self.assertEqual(VehicleRating.objects.get(vehicle=self.vehicles[0]).average_rating, 4.5)
+        self.assertFalse(VehicleRating.objects.filter(vehicle=self.vehicles[1]).exists())
+        self.assertMatchesRebuild()
+
+    def test_review_edited(self):
+        review = Review.objects.create(rental=self.book(self.vehicles[0]), rating=2)
+        Review.objects.create(rental=self.book(self.vehicles[0]), rating=3)
+        review.rating = 5
+        review.save()
+        rating = VehicleRating.objects.get(vehicle=self.vehicles[0])
+        self.assertEqual((rating.review_count, rating.stars_2, rating.stars_5), (2, 0, 1))
+        self.assertMatchesRebuild()
+
+    def test_review_deleted(self):
+        review = Review.objects.create(rental=self.book(self.vehicles[0]), rating=2)
+        Review.objects.create(rental=self.book(self.vehicles[0]), rating=4)
+        Review.objects.create(rental=self.book(self.vehicles[1], status='cancelled'), rating=1).delete()
+        review.delete()
+        self.assertEqual(VehicleRating.objects.get(vehicle=self.vehicles[0]).average_rating, 4.0)
+        self.assertMatchesRebuild()
+
+    def test_status_into_completed(self):
+        rental = self.book(self.vehicles[0], status='active')
+        Review.objects.create(rental=rental, rating=3)
+        rental.status = 'completed'
+        rental.save()
+        self.assertEqual(VehicleRating.objects.get(vehicle=self.vehicles[0]).review_count, 1)
+        self.assertMatchesRebuild()
+
+    def test_status_out_of_completed(self):
+        rental = self.book(self.vehicles[0])
+        Review.objects.create(rental=rental, rating=3)
+        Review.objects.create(rental=self.book(self.vehicles[0]), rating=5)
+        rental.status = 'cancelled'
+        rental.save()
+        rating = VehicleRating.objects.get(vehicle=self.vehicles[0])
+        self.assertEqual((rating.review_count, rating.rating_sum, rating.stars_3), (1, 5, 0))
+        self.assertMatchesRebuild()
+
+    def test_removed_without_aggregate_row(self):
+        # nothing to subtract from: no row is made up
+        apply_review_to_rating(self.vehicles[0].pk, 3, -1)
+        self.assertFalse(VehicleRating.objects.exists())
+        # adding to a vehicle without a row counts its reviews from scratch
+        Review.objects.bulk_create([Review(rental=self.book(self.vehicles[0]), rating=4)])
+        apply_review_to_rating(self.vehicles[0].pk, 2, 1)
+        rating = VehicleRating.objects.get(vehicle=self.vehicles[0])
+        self.assertEqual((rating.review_count, rating.stars_4, rating.stars_2), (1, 1, 0))
+
+    def test_refresh(self):
+        Review.objects.bulk_create([Review(rental=self.book(self.vehicles[0]), rating=star) for star in (1, 5, 5)])
+        refresh_vehicle_rating(self.vehicles[0].pk)
+        refresh_vehicle_rating(self.vehicles[1].pk)
+        self.assertEqual(VehicleRating.objects.get(vehicle=self.vehicles[1]).review_count, 0)
+        self.assertMatchesRebuild()
+
+    def test_random_changes(self):
+        rng = random.Random(1)
+        rentals = [self.book(rng.choice(self.vehicles), rng.choice(self.statuses)) for _ in range(30)]
+        for _ in range(200):
+            rental = rng.choice(rentals)
+            review = Review.objects.filter(rental=rental).first()
+            action = rng.randrange(4)
+            if action == 0:
+                rental.status = rng.choice(self.statuses)
+                rental.save()
+            elif review is None:
+                Review.objects.create(rental=rental, rating=rng.randint(1, 5))
+            elif action == 1:
+                review.rating = rng.randint(1, 5)
+                review.save()
+            else:
+                review.delete()
+        self.assertMatchesRebuild()
+
+
+class RentalRollupTests(TenantTestCase):
+    """The signals of rentals/signals.py keep RentalDailyRollup equal to what rebuild_rental_rollups() writes."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='rollups', email='rollups@example.com', password=None)
+        self.vehicles = Vehicle.objects.bulk_create([
+            Vehicle(make='Toyota', model='Corolla', year=2020, license_plate=f'RU {i}', rental_rate_per_day=Decimal('45.50'))
+            for i in range(4)
+        ])
+        self.statuses = [status for status, _ in Rental._meta.get_field('status').choices]
+        self.rng = random.Random(7)
+
+    def random_values(self):
+        rental_start = datetime(2030, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=self.rng.randrange(60 * 24 * 30))
+        return {
+            'vehicle': self.rng.choice(self.vehicles),
+            'rental_start': rental_start,
+            'rental_end': rental_start + timedelta(minutes=self.rng.randrange(1, 60 * 24 * 4)),
+            'status': self.rng.choice(self.statuses),
+            'total_cost': self.rng.choice([None, Decimal(self.rng.randrange(1, 50000)) / 100]),
+        }
+
+    def rollups(self):
+        # a row whose rentals all moved away stays behind with zeros, which a rebuild leaves out
+        return {
+            (row.pop('day'), row.pop('vehicle_id')): row
+            for row in RentalDailyRollup.objects.values('day', 'vehicle_id', *RentalDailyRollup.AGGREGATE_FIELDS)
+            if any(row[field] for field in RentalDailyRollup.AGGREGATE_FIELDS)
+        }
+
+    def assertMatchesRebuild(self):
+        maintained = self.rollups()
+        rebuild_rental_rollups()
+        self.assertEqual(maintained, self.rollups())
+
+    def save(self, rental):
+        try:
+            with transaction.atomic():
+                rental.save()
+        except IntegrityError:
+            # overlaps an active or confirmed rental of the vehicle: rolled back with its rollups
+            pass
+
+    def test_random_changes(self):
+        for _ in range(30):
+            self.save(Rental(user=self.user, **self.random_values()))
+        for _ in range(300):
+            rental = self.rng.choice(list(Rental.objects.all()))
+            action = self.rng.randrange(6)
+            if action == 0:
+                rental.status = self.rng.choice(self.statuses)
+            elif action == 1:
+                rental.rental_end += timedelta(minutes=self.rng.randrange(-60 * 12, 60 * 24 * 2))
+                if rental.rental_end <= rental.rental_start:
+                    continue
+            elif action == 2:
+                values = self.random_values()
+                rental.rental_start, rental.rental_end = values['rental_start'], values['rental_end']
+            elif action == 3:
+                for field, value in self.random_values().items():
+                    setattr(rental, field, value)
+            elif action == 4:
+                # saved without being loaded: the signal can't tell what changed
+                rental = Rental(pk=rental.pk, user=self.user, **self.random_values())
+            else:
+                rental.delete()
+                self.save(Rental(user=self.user, **self.random_values()))
+                continue
+            self.save(rental)
+        self.assertMatchesRebuild()
+
+    def test_rolled_back_change(self):
+        rental = Rental.objects.create(user=self.user, **{**self.random_values(), 'status': 'confirmed'})
+        rollups = self.rollups()
+        try:
+            with transaction.atomic():
+                rental.status = 'cancelled'
+                rental.rental_end += timedelta(days=2)
+                rental.save()
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(self.rollups(), rollups)
+        self.assertMatchesRebuild()
+
+
+class RentalKeysetPaginationTests(TenantAPITestMixin, TenantTestCase):
+    """The cursors of GET /rentals/ (rentals/pagination.py)."""
+
+    def setUp(self):
+        super().setUp()
+        vehicles = Vehicle.objects.bulk_create([
+            Vehicle(make='Toyota', model='Corolla', year=2020, license_plate=f'PAGE {i}', rental_rate_per_day=Decimal('45.50'))
+            for i in range(5)
+        ])
+        start = datetime(2030, 1, 1, 9, tzinfo=timezone.utc)
+        # rentals of several vehicles starting at the same time, which only their ids tell apart
+        Rental.objects.bulk_create([
+            Rental(user=self.user, vehicle=vehicle, rental_start=start + timedelta(days=3 * day), rental_end=start + timedelta(days=3 * day + 1))
+            for day in range(4) for vehicle in vehicles
+        ])
+        self.ordered = list(Rental.objects.order_by('-rental_start', '-id').values_list('id', flat=True))
+
+    def test_pages_across_equal_rental_starts(self):
+        for page_size in (1, 3, 4, 7):
+            ids, url, params = [], '/rentals/', {'page_size': page_size}
+            while url:
+                page = self.client.get(url, params).json()
+                self.assertLessEqual(len(page['results']), page_size)
+                ids += [rental['id'] for rental in page['results']]
+                url, params = page['next'], None
+            self.assertEqual(ids, self.ordered)
+
+    def test_cursor_within_equal_rental_starts(self):
+        rental = Rental.objects.get(pk=self.ordered[2])
+        cursor = RentalKeysetPagination().encode_cursor((rental.rental_start, rental.pk))
+        page = self.client.get('/rentals/', {'cursor': cursor, 'page_size': 4}).json()
+        self.assertEqual([rental['id'] for rental in page['results']], self.ordered[3:7])
+
+    def test_invalid_cursor(self):
+        def encode(text):
+            return base64.urlsafe_b64encode(text.encode()).decode()
+
+        valid = RentalKeysetPagination().encode_cursor((datetime(2030, 1, 4, 9, tzinfo=timezone.utc), self.ordered[0]))
+        for cursor in [
+            'garbage!', valid[:-3], valid + 'x', encode('2030-01-04T09:00:00+00:00'), encode('2030-01-04T09:00:00+00:00|7|8'),
+            encode('2030-01-04T09:00:00+00:00|seven'), encode('2030-01-04T09:00:00+00:00|007'), encode('2030-01-04T09:00:00|7'),
+            encode('yesterday|7'), base64.urlsafe_b64encode(b'\xff\xfe|1').decode(),
+        ]:
+            with self.subTest(cursor=cursor):
+                response = self.client.get('/rentals/', {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json(), {'detail': RentalKeysetPagination.invalid_cursor_message})
+
+    def test_cursor_past_the_id_range(self):
+        cursor = RentalKeysetPagination().encode_cursor((datetime(2030, 1, 10, 9, tzinfo=timezone.utc), 10 ** 20))
+        page = self.client.get('/rentals/', {'cursor': cursor}).json()
+        self.assertEqual([rental['id'] for rental in page['results']], self.ordered)
+
+
+class NotificationTests(TenantTestCase):
+    """Rental notification emails (rentals/notifications.py)."""
+
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(username=f'notified{i}', email=f'notified{i}@example.com', password=None)
+            for i in range(3)
+        ]
+        self.vehicle = Vehicle.objects.create(make='Toyota', model='Corolla', year=2020, license_plate='MAIL 1', rental_rate_per_day=Decimal('45.50'))
+        self.start = datetime(2030, 1, 1, 9, tzinfo=timezone.utc)
+        # the batch is sent from this test's transaction, not the worker's connection
+        self.enterContext(mock.patch('rentals.notifications.close_old_connections'))
+
+    def notification(self, user, rental_id, kind='booking_confirmation', total_cost=None):
+        return {
+            'kind': kind, 'schema_name': self.tenant.schema_name, 'rental_id': rental_id, 'user_id': user.pk,
+            'rental_start': self.start, 'rental_end': self.start + timedelta(days=1), 'total_cost': total_cost,
+        }
+
+    def book(self):
+        return Rental.objects.create(user=self.users[0], vehicle=self.vehicle, rental_start=self.start, rental_end=self.start + timedelta(days=1))
+
+    def test_duplicates_collapsed(self):
+        sent = notifications.send_batch([
+            self.notification(self.users[0], 1, 'receipt', total_cost=Decimal('10.00')),
+            self.notification(self.users[0], 1, 'booking_confirmation'),
+            self.notification(self.users[0], 1, 'receipt', total_cost=Decimal('12.50')),
+            # the same rental id in another tenant is another rental
+            {**self.notification(self.users[1], 1, 'receipt'), 'schema_name': 'other'},
+        ])
+        self.assertEqual(sent, 3)
+        self.assertEqual(
+            [(message.subject, message.to) for message in mail.outbox],
+            [('Receipt for rental 1', ['notified0@example.com']), ('Booking confirmation for rental 1', ['notified0@example.com']),
+             ('Receipt for rental 1', ['notified1@example.com'])],
+        )
+        # the latest receipt wins
+        self.assertIn('total: 12.50', mail.outbox[0].body)
+
+    def test_one_recipient_query_per_batch(self):
+        batch = [self.notification(user, rental_id) for rental_id, user in enumerate(self.users * 4)]
+        # a recipient without an email address is skipped
+        self.users[2].email = ''
+        self.users[2].save()
+        with self.assertNumQueries(1):
+            self.assertEqual(notifications.send_batch(batch), 8)
+
+    @mock.patch.object(notifications._notifications, 'put')
+    def test_rolled_back_booking_sends_nothing(self, put):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.book()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        put.assert_not_called()
+        with self.captureOnCommitCallbacks(execute=True):
+            rental = self.book()
+        put.assert_called_once()
+        self.assertEqual((put.call_args.args[0]['kind'], put.call_args.args[0]['rental_id']), ('booking_confirmation', rental.pk))
+
+    @mock.patch('rentals.notifications.flush')
+    def test_process_payments_flushes(self, flush):
+        call_command('process_payments', '--once', stdout=StringIO())
+        flush.assert_called_once_with()
@@ -1,7 +1,7 @@
 # rentals/urls.py
 
 from rest_framework.routers import DefaultRouter
-from .views import RentalViewSet, DamageReportViewSet, ReviewViewSet
+from .views import RentalViewSet, DamageReportViewSet, ReviewViewSet, PaymentTaskViewSet
 from django.urls import path
 
 # --- 1. Define View Functions (Method Mapping) ---
@@ -22,6 +22,8 @@ urlpatterns = [
 
 # --- 3. Add Router Paths (Handles /rentals/, /rentals/{id}/, etc.) ---
 router = DefaultRouter()
+# Payment status polling: GET /rentals/payments/ and /rentals/payments/{id}/ (registered before the '' prefix)
+router.register(r'payments', PaymentTaskViewSet, basename='payment')
 router.register(r'', RentalViewSet, basename='rental')
 
 # Append the router's URLs to the list
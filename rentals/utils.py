@@ -1,8 +1,39 @@
-from datetime import timedelta, datetime
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta, datetime, time
 from decimal import Decimal
-from django.db.models import Q
-from .models import Rental
+import numpy as np
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.db import IntegrityError, connection, transaction
+from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
+from django.db.models import Q, F, Count, Sum
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from .models import Rental, RentalDailyRollup, Review, VehicleRating, rental_period
+from CarRentalService import conditional
 
+# SQLSTATE raised by Postgres when an exclusion constraint rejects a row
+EXCLUSION_VIOLATION = '23P01'
+# rollup additions collected by batched_rollup_additions(), None outside of one
+_pending_additions = ContextVar('pending_rollup_additions', default=None)
+
+
+def parse_datetime_param(value):
+    """
+    Parse an ISO 8601 query parameter into an aware datetime.
+    Returns None when the value is missing or malformed. Naive values use the default time zone.
+    """
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        return None
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_default_timezone())
+    return parsed
 
 def calculate_rental_cost(rental_start, rental_end, rental_rate_per_day):
     """
@@ -25,30 +56,383 @@ def calculate_rental_cost(rental_start, rental_end, rental_rate_per_day):
     total_cost = Decimal(total_days_charged) * rate_decimal
     return total_cost
 
+# Rates with more decimal places than this (e.g. floats converted to Decimal)
+# are priced one by one with calculate_rental_cost instead.
+MAX_VECTOR_RATE_PLACES = 6
+DECIMAL_PRECISION = 28
+
+
+def quote_rental_costs(rates, intervals):
+    """
+    Price every rate against every (rental_start, rental_end) interval in one
+    vectorized pass. Returns one list of costs per rate, each equal to
+    calculate_rental_cost(rental_start, rental_end, rate).
+
+    Days charged are computed exactly like the scalar function (float seconds
+    divided by a day, rounded up) and multiplied with the rates as integer
+    multiples of the smallest rate unit, so no Decimal arithmetic is needed
+    per quote.
+    """
+    rates = [Decimal(rate) for rate in rates]
+    if not rates or not intervals:
+        return [[] for _ in rates]
+
+    rate_tuples = [rate.as_tuple() for rate in rates]
+    if any(
+        not rate.is_finite() or rate.is_signed() or -exponent > MAX_VECTOR_RATE_PLACES
+        for rate, (_, _, exponent) in zip(rates, rate_tuples)
+    ):
+        return [[calculate_rental_cost(start, end, rate) for start, end in intervals] for rate in rates]
+
+    # 1. Days charged per interval, exactly as calculate_rental_cost computes them
+    microseconds = np.array([(end - start) // timedelta(microseconds=1) for start, end in intervals], dtype=np.int64)
+    days = np.ceil(microseconds / 1e6 / (60 * 60 * 24)).astype(np.int64)
+
+    # 2. Rates as integers in units of 10**-places
+    places = max(0, max(-exponent for _, _, exponent in rate_tuples))
+    units = [int(rate.scaleb(places)) for rate in rates]
+    largest = int(days.max()) * max(units)
+    if days.min() < 0 or largest >= 2 ** 63 or len(str(largest)) > DECIMAL_PRECISION:
+        return [[calculate_rental_cost(start, end, rate) for start, end in intervals] for rate in rates]
+
+    # 3. N x M costs in one multiplication
+    costs = np.outer(np.array(units, dtype=np.int64), days)
+
+    # 4. Back to Decimals carrying each rate's own exponent, as Decimal(days) * rate does.
+    # Only the distinct costs of each exponent group are converted; numpy fans them back out.
+    exponents = np.array([exponent for _, _, exponent in rate_tuples])
+    quotes = np.empty(costs.shape, dtype=object)
+    for exponent in np.unique(exponents).tolist():
+        rows = exponents == exponent
+        distinct, positions = np.unique(costs[rows], return_inverse=True)
+        divisor = 10 ** (places + exponent)
+        decimals = np.array([Decimal(value // divisor).scaleb(exponent) for value in distinct.tolist()] + [None], dtype=object)[:-1]
+        quotes[rows] = decimals[positions.reshape(-1)].reshape(costs[rows].shape)
+    return quotes.tolist()
+
+
+class BookingConflict(APIException):
+    """The vehicle is already booked (active or confirmed) for an overlapping period."""
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Vehicle is already booked during this period.'
+    default_code = 'booking_conflict'
+
+
+class PaymentInProgress(APIException):
+    """A payment of the same kind is already queued or being processed for this rental."""
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A payment for this rental is already being processed.'
+    default_code = 'payment_in_progress'
+
+
+def is_overlap_violation(error):
+    """True if an IntegrityError was raised by the rental_vehicle_no_overlap exclusion constraint."""
+    cause = error.__cause__
+    # psycopg 3 names the SQLSTATE `sqlstate`, psycopg2 `pgcode`
+    return getattr(cause, 'sqlstate', None) == EXCLUSION_VIOLATION or getattr(cause, 'pgcode', None) == EXCLUSION_VIOLATION
+
+
 def is_vehicle_available_for_new_dates(vehicle, start_date, end_date, exclude_rental_id=None):
     """
     Checks if a specific vehicle is available between start_date and end_date, 
     excluding a specified rental ID (for extensions/modifications).
+
+    The lookup uses the same range expression as the rental_vehicle_no_overlap
+    exclusion constraint, so it is answered from its GiST index. It is only a
+    fast pre-check: the constraint is what makes the booking itself race-free.
     """
-    
-    # 1. Start with rentals that are active or confirmed
-    conflicting_rentals = Rental.objects.filter(
+    conflicting_rentals = Rental.objects.annotate(period=rental_period()).filter(
         vehicle=vehicle,
-        status__in=['active', 'confirmed']
+        status__in=Rental.BLOCKING_STATUSES,
+        period__overlap=DateTimeTZRange(start_date, end_date),
     )
 
-    # 2. Exclude the current rental being extended/modified
+    # Exclude the current rental being extended/modified
     if exclude_rental_id:
         conflicting_rentals = conflicting_rentals.exclude(pk=exclude_rental_id)
 
-    # 3. Check for overlaps using Q objects
-    # A conflict occurs if:
-    #   - The new rental starts before the existing one ends AND
-    #   - The new rental ends after the existing one starts.
-    overlap_query = Q(rental_start__lt=end_date) & Q(rental_end__gt=start_date)
-    
-    # If any conflicting rentals match the overlap query, the car is NOT available.
-    if conflicting_rentals.filter(overlap_query).exists():
+    return not conflicting_rentals.exists()
+
+
+def find_booking_conflicts(items):
+    """
+    Return the positions of the (vehicle_id, rental_start, rental_end) items that
+    overlap an existing active/confirmed rental, or an earlier item of the same list.
+
+    Existing bookings for all items are fetched with a single query over the
+    bounding window, answered from the exclusion constraint's GiST index.
+    """
+    if not items:
+        return set()
+    window = DateTimeTZRange(min(item[1] for item in items), max(item[2] for item in items))
+    booked = {}
+    existing = Rental.objects.annotate(period=rental_period()).filter(
+        vehicle_id__in={item[0] for item in items},
+        status__in=Rental.BLOCKING_STATUSES,
+        period__overlap=window,
+    ).values_list('vehicle_id', 'rental_start', 'rental_end')
+    for vehicle_id, rental_start, rental_end in existing:
+        booked.setdefault(vehicle_id, []).append((rental_start, rental_end))
+
+    conflicts = set()
+    for position, (vehicle_id, rental_start, rental_end) in enumerate(items):
+        intervals = booked.setdefault(vehicle_id, [])
+        if any(start < rental_end and end > rental_start for start, end in intervals):
+            conflicts.add(position)
+        else:
+            # later items of the same request must not overlap this one either
+            intervals.append((rental_start, rental_end))
+    return conflicts
+
+
+def _rating_aggregates(reviews):
+    """Group reviews by vehicle into the columns stored on VehicleRating."""
+    stars = {
+        f'stars_{star}': Count('pk', filter=Q(rating=star))
+        for star in range(1, 6)
+    }
+    return reviews.values('rental__vehicle_id').annotate(
+        review_count=Count('pk'),
+        rating_sum=Sum('rating'),
+        **stars,
+    )
+
+
+def refresh_vehicle_rating(vehicle_id):
+    """
+    Recompute the rating aggregate of a single vehicle from its reviews.
+    Only reviews on completed rentals count towards the rating.
+    """
+    reviews = Review.objects.filter(rental__vehicle_id=vehicle_id, rental__status='completed')
+    totals = _rating_aggregates(reviews).order_by('rental__vehicle_id').first() or {}
+    totals.pop('rental__vehicle_id', None)
+    defaults = {field: totals.get(field) or 0 for field in VehicleRating.AGGREGATE_FIELDS}
+    VehicleRating.objects.update_or_create(vehicle_id=vehicle_id, defaults=defaults)
+    # average_rating is part of every vehicle response
+    conditional.bump(VehicleRating)
+
+
+def apply_review_to_rating(vehicle_id, rating, delta):
+    """
+    Incrementally add (delta=1) or remove (delta=-1) one review from the
+    vehicle's rating aggregate without re-reading its other reviews.
+    """
+    updated = VehicleRating.objects.filter(vehicle_id=vehicle_id).update(
+        review_count=F('review_count') + delta,
+        rating_sum=F('rating_sum') + delta * rating,
+        **{f'stars_{rating}': F(f'stars_{rating}') + delta},
+    )
+    # No aggregate row yet (e.g. never backfilled): build it from scratch when adding.
+    # When removing there is nothing to subtract from.
+    if not updated and delta > 0:
+        refresh_vehicle_rating(vehicle_id)
+    elif updated:
+        conditional.bump(VehicleRating)
+
+
+def rebuild_vehicle_ratings():
+    """
+    Rebuild the rating aggregates of every vehicle in the current tenant schema
+    with one grouped query and a bulk insert. Returns the number of rows written.
+    """
+    reviews = Review.objects.filter(rental__status='completed')
+    ratings = [
+        VehicleRating(vehicle_id=row.pop('rental__vehicle_id'), **row)
+        for row in _rating_aggregates(reviews).order_by()
+    ]
+    with transaction.atomic():
+        VehicleRating.objects.all().delete()
+        VehicleRating.objects.bulk_create(ratings, batch_size=1000)
+        conditional.bump(VehicleRating)
+    return len(ratings)
+
+
+# Fields of a rental that feed the daily rollups
+ROLLUP_SOURCE_FIELDS = ('vehicle_id', 'rental_start', 'rental_end', 'status', 'total_cost')
+
+
+def rollup_contribution(vehicle_id, rental_start, rental_end, status, total_cost):
+    """
+    What one rental adds to the daily rollups, as {(day, vehicle_id): {field: amount}}.
+    Occupied time is split across the days (in the default time zone) the rental
+    covers; revenue and the status count go to the day the rental starts.
+    """
+    rows = defaultdict(lambda: defaultdict(int))
+    if vehicle_id is None or rental_start is None:
+        return rows
+    start_day = timezone.localtime(rental_start).date()
+
+    count_field = RentalDailyRollup.COUNT_FIELDS.get(status)
+    if count_field:
+        rows[start_day, vehicle_id][count_field] += 1
+    if status in RentalDailyRollup.REVENUE_STATUSES and total_cost:
+        rows[start_day, vehicle_id]['revenue'] += Decimal(total_cost)
+
+    if status in RentalDailyRollup.OCCUPYING_STATUSES and rental_end is not None:
+        day, cursor = start_day, rental_start
+        while cursor < rental_end:
+            midnight = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+            rows[day, vehicle_id]['occupied_seconds'] += (min(midnight, rental_end) - cursor) // timedelta(seconds=1)
+            day, cursor = day + timedelta(days=1), midnight
+    return rows
+
+
+def _sum_contributions(rentals):
+    """Add up the rollup contributions of a queryset of rentals, streamed from the database."""
+    totals = defaultdict(lambda: defaultdict(int))
+    for values in rentals.values_list(*ROLLUP_SOURCE_FIELDS).iterator(chunk_size=2000):
+        for key, amounts in rollup_contribution(*values).items():
+            for field, amount in amounts.items():
+                totals[key][field] += amount
+    return totals
+
+
+def refresh_vehicle_rollups(vehicle_id):
+    """Recompute every daily rollup row of a single vehicle from its rentals."""
+    totals = _sum_contributions(Rental.objects.filter(vehicle_id=vehicle_id))
+    with transaction.atomic():
+        RentalDailyRollup.objects.filter(vehicle_id=vehicle_id).delete()
+        RentalDailyRollup.objects.bulk_create(
+            [RentalDailyRollup(day=day, vehicle_id=vehicle_id, **amounts) for (day, _), amounts in totals.items()],
+            batch_size=1000,
+        )
+
+
+def apply_rental_change(old, new):
+    """
+    Move a rental's contribution in the daily rollups from its old values to
+    its new ones (dicts of ROLLUP_SOURCE_FIELDS, None for a created or deleted
+    rental), touching only the rows whose totals actually change.
+    """
+    old_rows = rollup_contribution(*(old[field] for field in ROLLUP_SOURCE_FIELDS)) if old else {}
+    new_rows = rollup_contribution(*(new[field] for field in ROLLUP_SOURCE_FIELDS)) if new else {}
+
+    additions, changes = {}, {}
+    for key in old_rows.keys() | new_rows.keys():
+        old_amounts, new_amounts = old_rows.get(key, {}), new_rows.get(key, {})
+        deltas = {field: new_amounts.get(field, 0) - old_amounts.get(field, 0) for field in old_amounts.keys() | new_amounts.keys()}
+        deltas = {field: delta for field, delta in deltas.items() if delta}
+        if deltas:
+            (additions if all(delta > 0 for delta in deltas.values()) else changes)[key] = deltas
+
+    # rows that only grow are upserted together (or with the rest of a batch)
+    pending = _pending_additions.get()
+    if pending is None:
+        _upsert_rollups(additions)
+    else:
+        for key, deltas in additions.items():
+            for field, delta in deltas.items():
+                pending[key][field] += delta
+
+    refreshed = set()
+    for (day, vehicle_id), deltas in changes.items():
+        if vehicle_id in refreshed:
+            continue
+        if _add_to_rollup(day, vehicle_id, deltas):
+            continue
+        # No row to subtract from: the rollups of this vehicle have drifted (or were never
+        # backfilled), so rebuild them from scratch. Pure removals have nothing to undo.
+        if any(delta > 0 for delta in deltas.values()):
+            refresh_vehicle_rollups(vehicle_id)
+            refreshed.add(vehicle_id)
+
+
+@contextmanager
+def batched_rollup_additions():
+    """
+    Collect what the rentals saved in the block add to the rollups and upsert it
+    in one statement at the end, instead of one per rental (bulk bookings).
+    """
+    pending = defaultdict(lambda: defaultdict(int))
+    token = _pending_additions.set(pending)
+    try:
+        yield
+    finally:
+        _pending_additions.reset(token)
+    _upsert_rollups(pending)
+
+
+def _upsert_rollups(rows):
+    """Add {(day, vehicle_id): {field: amount}} to the rollups, creating missing rows, in one statement."""
+    if not rows:
+        return
+    table = connection.ops.quote_name(RentalDailyRollup._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(field) for field in ('day', 'vehicle_id', *RentalDailyRollup.AGGREGATE_FIELDS))
+    increments = ', '.join(
+        f'{quoted} = {table}.{quoted} + EXCLUDED.{quoted}'
+        for quoted in map(connection.ops.quote_name, RentalDailyRollup.AGGREGATE_FIELDS)
+    )
+    placeholders = '(' + ', '.join(['%s'] * (2 + len(RentalDailyRollup.AGGREGATE_FIELDS))) + ')'
+    params = []
+    for (day, vehicle_id), amounts in sorted(rows.items()):
+        params += [day, vehicle_id, *(amounts.get(field, 0) for field in RentalDailyRollup.AGGREGATE_FIELDS)]
+    with connection.cursor() as cursor:
+        # sorted, so concurrent upserts lock the rows in the same order
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}) VALUES {", ".join([placeholders] * len(rows))} '
+            f'ON CONFLICT (day, vehicle_id) DO UPDATE SET {increments}',
+            params,
+        )
+
+
+def _add_to_rollup(day, vehicle_id, deltas):
+    """Add deltas to one rollup row, creating it when it is new and they only add. False if that is not possible."""
+    rows = RentalDailyRollup.objects.filter(day=day, vehicle_id=vehicle_id)
+    if rows.update(**{field: F(field) + delta for field, delta in deltas.items()}):
+        return True
+    if any(delta < 0 for delta in deltas.values()):
         return False
-        
-    return True
\ No newline at end of file
+    try:
+        with transaction.atomic():
+            RentalDailyRollup.objects.create(day=day, vehicle_id=vehicle_id, **deltas)
+    except IntegrityError:
+        # created by a concurrent booking since the update above
+        rows.update(**{field: F(field) + delta for field, delta in deltas.items()})
+    return True
+
+
+def rebuild_rental_rollups():
+    """
+    Rebuild the daily rollups of the current tenant schema from its rentals in
+    one pass and a bulk insert. Returns the number of rows written.
+    """
+    totals = _sum_contributions(Rental.objects.all())
+    rollups = [RentalDailyRollup(day=day, vehicle_id=vehicle_id, **amounts) for (day, vehicle_id), amounts in totals.items()]
+    with transaction.atomic():
+        RentalDailyRollup.objects.all().delete()
+        RentalDailyRollup.objects.bulk_create(rollups, batch_size=1000)
+    return len(rollups)
+
+
+def rental_rollup_stats(start_day, end_day, group_by='day'):
+    """
+    Utilization, revenue and status counts for the days [start_day, end_day],
+    grouped by 'day' or 'vehicle'. Reads only the daily rollups, never the rentals.
+    """
+    group_field = 'vehicle_id' if group_by == 'vehicle' else 'day'
+    window_seconds = ((end_day - start_day).days + 1) * 86400
+    sums = {field: Sum(field) for field in RentalDailyRollup.AGGREGATE_FIELDS}
+    rollups = RentalDailyRollup.objects.filter(day__gte=start_day, day__lte=end_day)
+
+    def summary(row):
+        counts = {status: row[field] or 0 for status, field in RentalDailyRollup.COUNT_FIELDS.items()}
+        return {
+            'occupied_hours': round((row['occupied_seconds'] or 0) / 3600, 2),
+            'revenue': row['revenue'] or Decimal('0.00'),
+            'rentals': sum(counts.values()),
+            'rentals_by_status': counts,
+        }
+
+    results = []
+    for row in rollups.values(group_field).annotate(**sums).order_by(group_field):
+        result = {group_field: row[group_field], **summary(row)}
+        if group_field == 'vehicle_id':
+            result['utilization'] = round((row['occupied_seconds'] or 0) / window_seconds, 4)
+        results.append(result)
+    return {
+        'start': start_day,
+        'end': end_day,
+        'group_by': group_by,
+        'totals': summary(rollups.aggregate(**sums)),
+        'results': results,
+    }
@@ -1,30 +1,70 @@
 from rest_framework import viewsets, mixins, status
 from rest_framework.response import Response
-from .models import Rental, DamageReport, Review
-from .serializers import RentalSerializer, DamageReportSerializer, ReviewSerializer
+from .models import Rental, DamageReport, Review, PaymentTask
+from .serializers import RentalSerializer, DamageReportSerializer, ReviewSerializer, BulkRentalSerializer, BulkRentalItemSerializer, QuoteRequestSerializer, PaymentTaskSerializer
 from .filters import UserRentalFilter
 from .permissions import IsRentalUserOrAdmin
 from users.models import User
-from django.shortcuts import get_object_or_404
 from vehicles.models import Vehicle
-from rest_framework.permissions import IsAuthenticated
+from vehicles.filters import OwnerFilter
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 from rest_framework.decorators import action
+from rest_framework.throttling import AnonRateThrottle
 from django.utils import timezone
-import stripe
-from .utils import calculate_rental_cost, is_vehicle_available_for_new_dates
-from datetime import datetime
+from django.utils.dateparse import parse_date
+from .utils import batched_rollup_additions, calculate_rental_cost, quote_rental_costs, rental_rollup_stats, is_vehicle_available_for_new_dates, is_overlap_violation, find_booking_conflicts, BookingConflict, PaymentInProgress
+from .payments import enqueue_payment
+from .pagination import RentalKeysetPagination
+from .renderers import NDJSONRenderer, stream_ndjson
+from CarRentalService import cache as object_cache
+from CarRentalService.conditional import ConditionalGetMixin
+from CarRentalService.values_serializers import ValuesListMixin
+from rest_framework.settings import api_settings
+from django.http import StreamingHttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_save
+from datetime import datetime, timedelta, timezone as dt_timezone
 from decimal import Decimal
 
 
 class RentalViewSet(
+    ConditionalGetMixin,
+    ValuesListMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
     mixins.CreateModelMixin,
     viewsets.GenericViewSet
 ):
-    queryset = Rental.objects.all().order_by('-rental_start')
+    queryset = Rental.objects.all().order_by('-rental_start', '-id')
     serializer_class = RentalSerializer
     filter_backends = [UserRentalFilter]
+    pagination_class = RentalKeysetPagination
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
+    # polled endpoints answer If-None-Match with 304 until a rental changes
+    conditional_actions = {
+        'list': [Rental],
+        'retrieve': [Rental],
+        'history': [Rental],
+    }
+    # most queries an action may run (CarRentalService/query_budget.py), as pinned in tests.py
+    query_budget = {
+        'list': 2,
+        'retrieve': 2,
+        'history': 3,
+        'quotes': 1,
+        'stats': 2,
+    }
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # these bill from the vehicle's rate: read it with the rental, never from a worker's object cache
+        if self.action in ('checkout', 'extend_rental'):
+            queryset = queryset.select_related('vehicle')
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self._paginated_or_streamed(queryset)
 
     def perform_create(self, serializer):
 
@@ -32,12 +72,21 @@ class RentalViewSet(
         if not user_id:
             raise ValueError('A "user_id" is required for booking.')
         
-        user_instance = get_object_or_404(User, pk=user_id)
+        user_instance = object_cache.get_object_or_404(User, user_id)
 
-        rental_instance = serializer.save(
-            user=user_instance,
-            status='active' # New rentals are always 'active'
-         )
+        # The rental_vehicle_no_overlap exclusion constraint rejects overlapping
+        # bookings atomically, so two concurrent POSTs can't both succeed.
+        try:
+            with transaction.atomic():
+                rental_instance = serializer.save(
+                    user=user_instance,
+                    status='active' # New rentals are always 'active'
+                 )
+        except IntegrityError as e:
+            if not is_overlap_violation(e):
+                raise
+            vehicle = serializer.validated_data['vehicle']
+            raise BookingConflict(f'Vehicle {vehicle.license_plate} is already booked during this period.')
     
     # 1. Return Vehicle Endpoint: PUT /rentals/{id}/return/ [cite: 31]
     # detail=True means this action is on a specific instance (needs {id} in URL path)
@@ -69,13 +118,12 @@ class RentalViewSet(
              return Response({'detail': 'You do not have permission to view this history.'}, status=status.HTTP_403_FORBIDDEN)
         
         try:
-            user_instance = User.objects.get(pk=user_pk)
+            user_instance = object_cache.get_object(User, user_pk)
         except User.DoesNotExist:
             return Response({'detail': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
 
-        queryset = Rental.objects.filter(user=user_instance).order_by('-rental_start')
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
+        queryset = Rental.objects.filter(user=user_instance)
+        return self._paginated_or_streamed(queryset)
     
     # 3. Checkout Endpoint: POST /rentals/{id}/checkout/ [cite: 33]
     @action(detail=True, methods=['post'], url_path='checkout', permission_classes=[IsAuthenticated])
@@ -94,28 +142,15 @@ class RentalViewSet(
         except Exception as e:
             return Response({'detail': f'Error calculating rental cost: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
-        #C. Create Stripe Payment Intent (Simulated here)
+        #C. Queue the charge in the payment outbox. The process_payments workers call Stripe
+        # and confirm the rental, so a slow Stripe response never holds up this request.
         # Note: In a real app, the frontend sends a payment method ID or token to complete the payment
-        try:
-            intent = stripe.PaymentIntent.create(
-                amount = amount_in_cents,
-                currency = 'usd',
-                payment_method_types = ['card'],
-                metadata = {'rental_id': rental.id, 'user_id': rental.user.id}
-            )
-        except stripe.error.StripeError as e:
-            return Response({'detail': f'Stripe payment failed: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        #D. Update Rental with payment intent details
-        rental.total_cost = cost
-        rental.payment_intent_id = intent.id
-        rental.status = 'confirmed'
-        rental.save()
+        task = enqueue_payment(rental, 'checkout', amount_cents=amount_in_cents, total_cost=str(cost))
         return Response({
-            'detail': 'Checkout successful. Rental confirmed.',
+            'detail': 'Checkout accepted. Payment is being processed.',
             'total_cost': cost,
-            'payment_intent_id': intent.id
-        }, status=status.HTTP_200_OK)
+            'payment': PaymentTaskSerializer(task, context=self.get_serializer_context()).data
+        }, status=status.HTTP_202_ACCEPTED)
     
     # 4. Implement refund and cancellation endpoints
     #DELETE /rentals/{id}/
@@ -130,27 +165,25 @@ class RentalViewSet(
 
         # Process refund only if payment was confirmed
         if rental.status == 'confirmed' and rental.payment_intent_id:
-            try:
-                # 1. Initiate Refund via Stripe
-                refund = stripe.Refund.create(
-                    payment_intent=rental.payment_intent_id,
-                    # partial refunds logic can be added here
-                )
-                # 2. Update message upon successful refund
-                refund_status_message = f"Refund successful. Stripe Refund ID: {refund.id}"
-            
-            except stripe.error.InvalidRequestError as e: 
-                # 3. ABORT: If refund fails (e.g., charge already refunded, or invalid intent)
-                return Response({
-                    'detail': 'Cancellation failed. Could not process refund through Stripe.',
-                    'error': str(e)
-                }, status=status.HTTP_400_BAD_REQUEST)
-
-        # 4. Finalize: Update status and save, regardless of refund attempt outcome
+            # 1. Queue the refund. The workers cancel the rental once Stripe has refunded it;
+            # if the refund fails, the rental stays confirmed and the payment shows the error.
+            task = enqueue_payment(rental, 'refund', payment_intent_id=rental.payment_intent_id, cancel_rental=True)
+            return Response({
+                'detail': 'Cancellation accepted. The rental is cancelled once the refund has been processed.',
+                'rental': self.get_serializer(rental).data,
+                'refund_status': 'Refund pending.',
+                'payment': PaymentTaskSerializer(task, context=self.get_serializer_context()).data
+            }, status=status.HTTP_202_ACCEPTED)
+
+        # 2. An unpaid rental whose checkout is still being processed can't be cancelled yet
+        if rental.payment_tasks.filter(status__in=PaymentTask.IN_FLIGHT_STATUSES).exists():
+            raise PaymentInProgress()
+
+        # 3. Finalize: Update status and save
         rental.status = 'cancelled'
         rental.save()
         
-        # 5. Return success response with explicit refund status
+        # 4. Return success response with explicit refund status
         return Response({
             'detail': 'Rental successfully cancelled.',
             'rental': self.get_serializer(rental).data,
@@ -168,50 +201,229 @@ class RentalViewSet(
             return Response({'detail': 'New rental end date is required.'}, status=status.HTTP_400_BAD_REQUEST)
         #A. Validation and date conversion
         try:
-            new_end_date = datetime.strptime(new_end_date_str, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+            new_end_date = datetime.strptime(new_end_date_str, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=dt_timezone.utc)
         except ValueError:
             return Response({'detail': 'Invalid date format. Use ISO 8601 (YYYY-MM-DDTHH:MM:SSZ).'}, status=status.HTTP_400_BAD_REQUEST)
         
         if new_end_date <= rental.rental_end:
             return Response({'detail': 'New end date must be after the current end date.'}, status=status.HTTP_400_BAD_REQUEST)
-        #B. Availability check for the extension period
+        #B. Availability pre-check for the extension period (served by the exclusion constraint's GiST index)
         if not is_vehicle_available_for_new_dates(rental.vehicle, rental.rental_end, new_end_date, exclude_rental_id=rental.id):
-            return Response({'detail': 'Vehicle is already booked during the requested extension period.'}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({'detail': 'Vehicle is already booked during the requested extension period.'}, status=status.HTTP_409_CONFLICT)
 
         #C. Calculate additional cost for the extension
+        rental_rate_per_day = rental.vehicle.rental_rate_per_day
         if rental_rate_per_day is None:
             return Response({'detail': 'Vehicle rental rate is missing.'}, status=status.HTTP_400_BAD_REQUEST)
-        rate_as_float = float(rental_rate_per_day)
-        extension_cost = calculate_rental_cost(rental.rental_end, new_end_date, rate_as_float)
-        #D. Process payment for the extension via Stripe
+        extension_cost = calculate_rental_cost(rental.rental_end, new_end_date, rental_rate_per_day)
         amount_in_cents = int(extension_cost * 100)
-        try:
-            intent = stripe.PaymentIntent.create(
-                amount = amount_in_cents,
-                currency = 'usd',
-                payment_method_types = ['card'],
-                metadata = {'rental_id': rental.id, 'user_id': rental.user.id, 'extension': 'true'}
-            )
-        except stripe.error.StripeError as e:
-            return Response({'detail': f'Stripe payment for extension failed: {str(e)}'}, status=status.HTTP_400_BAD_REQUEST)
-        #E. Update rental with new end date and adjusted total cost
         current_total_cost = rental.total_cost if rental.total_cost is not None else Decimal('0.00')
 
-        # IMPORTANT: Ensure extension_cost is also treated as Decimal for safe addition
-        if not isinstance(extension_cost, Decimal):
-            extension_cost = Decimal(extension_cost)
-    
-        rental.total_cost = current_total_cost + extension_cost
-        rental.rental_end = new_end_date
-        rental.save()
+        #D. Reserve the new end date now (the exclusion constraint rejects an overlapping
+        # extension) and queue the charge. The workers add the extension cost once it is
+        # paid, or give the reserved dates back if the payment fails.
+        previous_rental_end = rental.rental_end
+        try:
+            with transaction.atomic():
+                rental.rental_end = new_end_date
+                rental.save()
+                task = enqueue_payment(
+                    rental, 'extension', amount_cents=amount_in_cents,
+                    extension_cost=str(extension_cost),
+                    previous_rental_end=previous_rental_end.isoformat(),
+                    new_rental_end=new_end_date.isoformat(),
+                )
+        except IntegrityError as e:
+            if not is_overlap_violation(e):
+                raise
+            return Response({'detail': 'Vehicle is already booked during the requested extension period.'}, status=status.HTTP_409_CONFLICT)
 
         return Response({
-            'detail': 'Rental successfully extended.',
+            'detail': 'Extension accepted. Payment is being processed.',
             'extension_cost': extension_cost,
-            'new_total_cost': rental.total_cost,
-            'new_rental_end': rental.rental_end
+            'new_total_cost': current_total_cost + extension_cost,
+            'new_rental_end': rental.rental_end,
+            'payment': PaymentTaskSerializer(task, context=self.get_serializer_context()).data
+        }, status=status.HTTP_202_ACCEPTED)
+
+    # 5. Bulk Booking Endpoint: POST /rentals/bulk/
+    # {"mode": "all_or_nothing" | "best_effort", "user_id": 1, "items": [{"vehicle_id": 1, "rental_start": ..., "rental_end": ...}]}
+    @action(detail=False, methods=['post'], url_path='bulk', permission_classes=[IsAuthenticated])
+    def bulk(self, request):
+        bulk_serializer = BulkRentalSerializer(data=request.data)
+        bulk_serializer.is_valid(raise_exception=True)
+        mode = bulk_serializer.validated_data['mode']
+        items = bulk_serializer.validated_data['items']
+        user_instance = object_cache.get_object_or_404(User, bulk_serializer.validated_data.get('user_id', request.user.pk))
+
+        #A. Validate each item on its own and resolve all vehicles with one query
+        results = [None] * len(items)
+        valid_items = []
+        for position, item in enumerate(items):
+            item_serializer = BulkRentalItemSerializer(data=item)
+            if item_serializer.is_valid():
+                valid_items.append((position, item_serializer.validated_data))
+            else:
+                results[position] = {'index': position, 'status': 'invalid', 'errors': item_serializer.errors}
+
+        vehicles = Vehicle.objects.in_bulk({item['vehicle_id'] for _, item in valid_items})
+        for position, item in valid_items:
+            if item['vehicle_id'] not in vehicles:
+                results[position] = {'index': position, 'status': 'invalid', 'errors': {'vehicle_id': ['Vehicle not found.']}}
+        valid_items = [(position, item) for position, item in valid_items if item['vehicle_id'] in vehicles]
+
+        #B. One set-based conflict check against existing bookings and the other items
+        conflicts = find_booking_conflicts([(item['vehicle_id'], item['rental_start'], item['rental_end']) for _, item in valid_items])
+        bookable = []
+        for i, (position, item) in enumerate(valid_items):
+            if i in conflicts:
+                results[position] = {'index': position, 'status': 'conflict', 'detail': f'Vehicle {vehicles[item["vehicle_id"]].license_plate} is already booked during this period.'}
+            else:
+                bookable.append((position, item))
+
+        if mode == 'all_or_nothing' and len(bookable) < len(items):
+            return self._bulk_rejected(results, bookable)
+
+        #C. Insert everything in one statement. The exclusion constraint still guards
+        # against bookings made concurrently since the check above.
+        rentals = [
+            Rental(
+                user=user_instance,
+                vehicle=vehicles[item['vehicle_id']],
+                rental_start=item['rental_start'],
+                rental_end=item['rental_end'],
+                status='active',
+            )
+            for _, item in bookable
+        ]
+        try:
+            # the rollups of all the new rentals are added in one statement
+            with transaction.atomic(), batched_rollup_additions():
+                Rental.objects.bulk_create(rentals)
+                # bulk_create skips post_save; send it so signal receivers see the new rentals
+                for rental in rentals:
+                    post_save.send(sender=Rental, instance=rental, created=True, update_fields=None, raw=False, using=rental._state.db)
+        except IntegrityError as e:
+            if not is_overlap_violation(e):
+                raise
+            if mode == 'all_or_nothing':
+                for position, _ in bookable:
+                    results[position] = {'index': position, 'status': 'conflict', 'detail': 'A concurrent booking overlaps this period.'}
+                return self._bulk_rejected(results, [])
+            with transaction.atomic(), batched_rollup_additions():
+                rentals = self._create_rentals_one_by_one(rentals)
+
+        created = 0
+        for (position, _), rental in zip(bookable, rentals):
+            if rental is None:
+                results[position] = {'index': position, 'status': 'conflict', 'detail': 'A concurrent booking overlaps this period.'}
+            else:
+                results[position] = {'index': position, 'status': 'created', 'rental': self.get_serializer(rental).data}
+                created += 1
+
+        if not created:
+            return self._bulk_rejected(results, [])
+        return Response({'created': created, 'failed': len(items) - created, 'results': results}, status=status.HTTP_201_CREATED)
+
+    # 6. Price Quote Endpoint: POST /rentals/quotes/
+    # {"vehicle_ids": [1, 2], "intervals": [{"rental_start": ..., "rental_end": ...}]}
+    # Prices every vehicle against every interval in one vectorized pass (see quote_rental_costs).
+    # Open to anonymous users, who are throttled per IP (ANON_THROTTLE_RATE): a request can ask for 100,000 quotes.
+    @action(detail=False, methods=['post'], url_path='quotes', permission_classes=[AllowAny], throttle_classes=[AnonRateThrottle])
+    def quotes(self, request):
+        quote_serializer = QuoteRequestSerializer(data=request.data)
+        quote_serializer.is_valid(raise_exception=True)
+        vehicle_ids = quote_serializer.validated_data['vehicle_ids']
+        intervals = [(interval['rental_start'], interval['rental_end']) for interval in quote_serializer.validated_data['intervals']]
+
+        # Only quote vehicles this user is allowed to see, in the order they were requested
+        visible = OwnerFilter().filter_queryset(request, Vehicle.objects.filter(id__in=vehicle_ids), self)
+        rates = dict(visible.values_list('id', 'rental_rate_per_day'))
+        vehicle_ids = [vehicle_id for vehicle_id in dict.fromkeys(vehicle_ids) if vehicle_id in rates]
+
+        costs = quote_rental_costs([rates[vehicle_id] for vehicle_id in vehicle_ids], intervals)
+        return Response({
+            'intervals': quote_serializer.data['intervals'],
+            'quotes': [
+                {'vehicle_id': vehicle_id, 'costs': [str(cost) for cost in row]}
+                for vehicle_id, row in zip(vehicle_ids, costs)
+            ],
         }, status=status.HTTP_200_OK)
 
+    # 7. Utilization and Revenue Stats: GET /rentals/stats/?start=2025-01-01&end=2025-01-31&group_by=day|vehicle
+    # Answered from the daily rollups kept by rentals/signals.py (rebuild with rebuild_rental_rollups).
+    @action(detail=False, methods=['get'], url_path='stats', permission_classes=[IsAdminUser])
+    def stats(self, request):
+        #A. Window of days, inclusive (default: the last 30 days)
+        try:
+            end_day = parse_date(request.query_params.get('end') or timezone.localdate().isoformat())
+            start_day = end_day and parse_date(request.query_params.get('start') or (end_day - timedelta(days=29)).isoformat())
+        except ValueError:
+            end_day = start_day = None
+        if start_day is None or end_day is None:
+            return Response({'detail': 'start and end must be dates (YYYY-MM-DD).'}, status=status.HTTP_400_BAD_REQUEST)
+        if start_day > end_day:
+            return Response({'detail': 'start must not be after end.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        #B. Group by day or by vehicle
+        group_by = request.query_params.get('group_by', 'day')
+        if group_by not in ('day', 'vehicle'):
+            return Response({'detail': 'group_by must be "day" or "vehicle".'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(rental_rollup_stats(start_day, end_day, group_by), status=status.HTTP_200_OK)
+
+    def _paginated_or_streamed(self, queryset):
+        """One keyset page of the rentals, or all of them as an NDJSON stream for ?format=ndjson."""
+        queryset = queryset.order_by(*RentalKeysetPagination.ordering)
+        if self.request.accepted_renderer.format == NDJSONRenderer.format:
+            # constant memory: rows come from a server-side cursor and are serialized chunk by chunk
+            rows = stream_ndjson(queryset, self.get_values_serializer())
+            return StreamingHttpResponse(rows, content_type=NDJSONRenderer.media_type)
+
+        return self.values_response(queryset)
+
+    def _bulk_rejected(self, results, skipped):
+        """Response for a bulk booking that created nothing."""
+        for position, _ in skipped:
+            results[position] = {'index': position, 'status': 'skipped', 'detail': 'Not booked because other items failed.'}
+        has_conflict = any(result['status'] == 'conflict' for result in results)
+        return Response(
+            {'detail': 'No rentals were created.', 'created': 0, 'failed': len(results), 'results': results},
+            status=status.HTTP_409_CONFLICT if has_conflict else status.HTTP_400_BAD_REQUEST,
+        )
+
+    def _create_rentals_one_by_one(self, rentals):
+        """Best-effort fallback: insert each rental in its own savepoint, None where it conflicts."""
+        created = []
+        for rental in rentals:
+            try:
+                with transaction.atomic():
+                    rental.save()
+                created.append(rental)
+            except IntegrityError as e:
+                if not is_overlap_violation(e):
+                    raise
+                created.append(None)
+        return created
+
+
+class PaymentTaskViewSet(
+    mixins.ListModelMixin,
+    mixins.RetrieveModelMixin,
+    viewsets.GenericViewSet
+):
+    """Lets users poll the payments queued by checkout, extension and cancellation."""
+    queryset = PaymentTask.objects.all().order_by('-created_at')
+    serializer_class = PaymentTaskSerializer
+    permission_classes = [IsAuthenticated]
+    query_budget = 1
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.user.is_staff or self.request.user.is_superuser:
+            return queryset
+        return queryset.filter(rental__user_id=self.request.user.pk)
+
 
 class DamageReportViewSet(
     mixins.CreateModelMixin,
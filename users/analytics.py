@@ -0,0 +1,119 @@
+"""
+Cross-tenant fleet analytics for platform operators.
+
+Each tenant schema is summarized with a few aggregate queries (rentals by
+status, revenue, vehicle-days booked, fleet size). Schemas are queried in
+parallel on a thread pool, each thread on its own connection, and the merged
+report is cached for ANALYTICS_CACHE_TTL seconds.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Count, DurationField, ExpressionWrapper, Q, Sum
+from django.db.models.functions import Greatest, Least
+from django.utils import timezone
+from django_tenants.utils import get_public_schema_name, schema_context
+
+from .models import Client
+
+# statuses whose days count as booked, and whose total_cost counts as revenue
+BOOKED_STATUSES = ('active', 'confirmed', 'completed')
+REVENUE_STATUSES = ('confirmed', 'completed')
+STATUSES = ('active', 'confirmed', 'completed', 'cancelled')
+DEFAULT_WINDOW = timedelta(days=30)
+
+
+def tenant_summary(schema_name, start, end):
+    """Aggregate one tenant's rentals over [start, end). Runs on the calling thread's connection."""
+    from rentals.models import Rental
+    from vehicles.models import Vehicle
+
+    with schema_context(schema_name):
+        #A. Rentals starting in the window: counts by status and revenue, in one query
+        counts = {f'{status}_count': Count('id', filter=Q(status=status)) for status in STATUSES}
+        starting = Rental.objects.filter(rental_start__gte=start, rental_start__lt=end).aggregate(
+            rentals=Count('id'),
+            revenue=Sum('total_cost', filter=Q(status__in=REVENUE_STATUSES)),
+            **counts,
+        )
+
+        #B. Vehicle-days booked inside the window (rentals clipped to it)
+        booked = Rental.objects.filter(
+            status__in=BOOKED_STATUSES, rental_start__lt=end, rental_end__gt=start,
+        ).aggregate(
+            booked=Sum(ExpressionWrapper(Least('rental_end', end) - Greatest('rental_start', start), output_field=DurationField())),
+        )['booked']
+
+        fleet_size = Vehicle.objects.count()
+
+    vehicle_days = booked.total_seconds() / 86400 if booked else 0.0
+    window_days = (end - start).total_seconds() / 86400
+    return {
+        'rentals': starting['rentals'],
+        'rentals_by_status': {status: starting[f'{status}_count'] for status in STATUSES},
+        'revenue': starting['revenue'] or Decimal('0.00'),
+        'vehicle_days_booked': round(vehicle_days, 2),
+        'fleet_size': fleet_size,
+        'utilization': round(vehicle_days / (fleet_size * window_days), 4) if fleet_size and window_days else None,
+    }
+
+
+def _summary_on_own_connection(schema_name, start, end):
+    try:
+        return tenant_summary(schema_name, start, end)
+    finally:
+        # pool threads end with the report; don't leave their connections open
+        connection.close()
+
+
+def fleet_analytics(start=None, end=None, workers=None, refresh=False):
+    """Per-tenant summaries and platform totals for [start, end) (default: the last 30 days)."""
+    # the default window moves with the clock, so it is cached under its own key; the report
+    # covers every tenant, so it lives in the cache that isn't namespaced by tenant
+    cache_key = f'fleet_analytics:{start.isoformat() if start else "-"}:{end.isoformat() if end else "now"}'
+    end = end or timezone.now()
+    start = start or end - DEFAULT_WINDOW
+    if not refresh:
+        report = caches['global'].get(cache_key)
+        if report is not None:
+            return report
+
+    tenants = list(Client.objects.exclude(schema_name=get_public_schema_name()).order_by('schema_name').values_list('schema_name', 'name'))
+    with ThreadPoolExecutor(max_workers=workers or settings.ANALYTICS_WORKERS) as executor:
+        futures = [(schema_name, name, executor.submit(_summary_on_own_connection, schema_name, start, end)) for schema_name, name in tenants]
+
+    rows, failed = [], []
+    for schema_name, name, future in futures:
+        try:
+            rows.append({'schema_name': schema_name, 'name': name, **future.result()})
+        except Exception as e:
+            failed.append({'schema_name': schema_name, 'error': str(e)})
+
+    report = {
+        'window': {'start': start, 'end': end},
+        'generated_at': timezone.now(),
+        'totals': _merge(rows, start, end),
+        'tenants': rows,
+        'failed': failed,
+    }
+    caches['global'].set(cache_key, report, settings.ANALYTICS_CACHE_TTL)
+    return report
+
+
+def _merge(rows, start, end):
+    vehicle_days = sum(row['vehicle_days_booked'] for row in rows)
+    fleet_size = sum(row['fleet_size'] for row in rows)
+    window_days = (end - start).total_seconds() / 86400
+    return {
+        'tenants': len(rows),
+        'rentals': sum(row['rentals'] for row in rows),
+        'rentals_by_status': {status: sum(row['rentals_by_status'][status] for row in rows) for status in STATUSES},
+        'revenue': sum((row['revenue'] for row in rows), Decimal('0.00')),
+        'vehicle_days_booked': round(vehicle_days, 2),
+        'fleet_size': fleet_size,
+        'utilization': round(vehicle_days / (fleet_size * window_days), 4) if fleet_size and window_days else None,
+    }
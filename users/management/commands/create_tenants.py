@@ -1,9 +1,70 @@
+from django.core.management import call_command
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction, IntegrityError
+from django.db import connection, connections, transaction, IntegrityError
+from django.conf import settings
+from django_tenants.postgresql_backend.base import is_valid_schema_name
+from django_tenants.utils import get_creation_fakes_migrations, schema_exists
 from users.models import Client, Domain
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager, nullcontext
 import csv
 import json
+import multiprocessing
 import os
+import time
+import zlib
+
+# held by each tenant's transaction while it clones the template (see provision_tenant)
+CLONE_LOCK = zlib.crc32(b'create_tenants clone_schema')
+
+
+@contextmanager
+def clone_from_template(template_schema):
+    """Have django-tenants clone new schemas from template_schema in the block (forked workers inherit it)."""
+    overrides = {'TENANT_BASE_SCHEMA': template_schema, 'TENANT_CREATION_FAKES_MIGRATIONS': True}
+    missing = object()
+    previous = {name: getattr(settings, name, missing) for name in overrides}
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is missing:
+                delattr(settings, name)
+            else:
+                setattr(settings, name, value)
+
+
+def provision_tenant(row):
+    """Create one tenant with its schema and domain; returns the seconds it took.
+
+    Runs in the command's process or in a pool worker. With TENANT_BASE_SCHEMA
+    and TENANT_CREATION_FAKES_MIGRATIONS set (--template-schema) django-tenants
+    clones the schema from that (migrated, empty) one, including its
+    django_migrations rows, instead of running every tenant migration.
+    """
+    started = time.monotonic()
+    with transaction.atomic():
+        if get_creation_fakes_migrations():
+            # each clone replaces the clone_schema() SQL function, and a replacement concurrent
+            # with another transaction's fails ("tuple concurrently updated"): clones take turns
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [CLONE_LOCK])
+        client = Client(
+            schema_name=row['schema_name'],
+            name=row['name'],
+        )
+        if row['paid_until']:
+            client.paid_until = row['paid_until']
+        client.on_trial = row['on_trial']
+        # auto_create_schema True ensures django-tenants will create the schema (by running migrations, or cloning)
+        client.auto_create_schema = True
+        client.save(verbosity=0)
+
+        if row['domain']:
+            Domain.objects.create(domain=row['domain'], tenant=client, is_primary=row['is_primary'])
+    return time.monotonic() - started
 
 
 class Command(BaseCommand):
@@ -19,6 +80,11 @@ class Command(BaseCommand):
         parser.add_argument('--format', choices=['csv', 'json'], default='csv')
         parser.add_argument('--dry-run', action='store_true', help='Validate input and print actions without saving')
         parser.add_argument('--skip-migrations', action='store_true', help='Do not rely on auto-create schema behavior (no-op)')
+        parser.add_argument('--workers', type=int, default=1, help='Provision this many tenants in parallel (process pool)')
+        parser.add_argument(
+            '--template-schema',
+            help='Migrate this schema once (creating it if needed) and clone it for every new tenant instead of running migrations',
+        )
 
     def _parse_csv(self, path):
         rows = []
@@ -73,6 +139,7 @@ class Command(BaseCommand):
             self.stdout.write('No tenants to create.')
             return
 
+        rows = []
         for row in tenants:
             schema_name = row.get('schema_name')
             name = row.get('name')
@@ -82,30 +149,75 @@ class Command(BaseCommand):
             on_trial = str(row.get('on_trial', 'True')).lower() in ('1', 'true', 'yes', 'y')
 
             self.stdout.write(f"Preparing tenant: schema='{schema_name}' name='{name}' domain='{domain}' primary={is_primary}")
+            rows.append({
+                'schema_name': schema_name,
+                'name': name,
+                'domain': domain,
+                'is_primary': is_primary,
+                'paid_until': paid_until,
+                'on_trial': on_trial,
+            })
+
+        if dry:
+            return
+
+        template_schema = options.get('template_schema')
+        if template_schema:
+            self._prepare_template(template_schema)
+            template = clone_from_template(template_schema)
+        else:
+            template = nullcontext()
+
+        workers = options.get('workers') or 1
+        failed = 0
+        with template:
+            if workers > 1:
+                results = self._provision_in_pool(rows, workers)
+            else:
+                results = self._provision_in_process(rows)
+
+            for position, (row, seconds, error) in enumerate(results, start=1):
+                progress = f"[{position}/{len(rows)}]"
+                if error is None:
+                    self.stdout.write(self.style.SUCCESS(f"{progress} Created tenant: {row['schema_name']} ({seconds:.1f}s)"))
+                elif isinstance(error, IntegrityError):
+                    failed += 1
+                    self.stderr.write(self.style.ERROR(f"{progress} Failed to create tenant {row['schema_name']}: {error}"))
+                else:
+                    failed += 1
+                    self.stderr.write(self.style.ERROR(f"{progress} Unexpected error for {row['schema_name']}: {error}"))
+
+        self.stdout.write(self.style.NOTICE(f'Batch tenant creation complete: {len(rows) - failed} created, {failed} failed.'))
+
+    def _prepare_template(self, template_schema):
+        """Bring the template schema up to date."""
+        if not is_valid_schema_name(template_schema):
+            raise CommandError(f'Invalid schema name: {template_schema}')
+        if Client.objects.filter(schema_name=template_schema).exists():
+            raise CommandError(f'{template_schema} belongs to a tenant and cannot be used as a template')
 
-            if dry:
-                continue
+        self.stdout.write(f"Migrating template schema '{template_schema}'")
+        if not schema_exists(template_schema):
+            with connection.cursor() as cursor:
+                cursor.execute(f'CREATE SCHEMA "{template_schema}"')
+        call_command('migrate_schemas', tenant=True, schema_name=template_schema, interactive=False, verbosity=0)
+        connection.set_schema_to_public()
 
+    def _provision_in_process(self, rows):
+        for row in rows:
             try:
-                with transaction.atomic():
-                    client = Client(
-                        schema_name=schema_name,
-                        name=name,
-                    )
-                    if paid_until:
-                        client.paid_until = paid_until
-                    client.on_trial = on_trial
-                    # auto_create_schema True ensures django-tenants will create the schema
-                    client.auto_create_schema = True
-                    client.save()
-
-                    if domain:
-                        Domain.objects.create(domain=domain, tenant=client, is_primary=is_primary)
-
-                    self.stdout.write(self.style.SUCCESS(f"Created tenant: {schema_name}"))
-            except IntegrityError as e:
-                self.stderr.write(self.style.ERROR(f"Failed to create tenant {schema_name}: {e}"))
+                yield row, provision_tenant(row), None
             except Exception as e:
-                self.stderr.write(self.style.ERROR(f"Unexpected error for {schema_name}: {e}"))
+                yield row, None, e
 
-        self.stdout.write(self.style.NOTICE('Batch tenant creation complete.'))
+    def _provision_in_pool(self, rows, workers):
+        # forked workers must not share the parent's database connection (they drop the inherited pool: CarRentalService/db_backend)
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = {executor.submit(provision_tenant, row): row for row in rows}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, e
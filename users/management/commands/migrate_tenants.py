@@ -0,0 +1,125 @@
+"""
+Management command to run tenant migrations across all tenant schemas in parallel.
+Schemas are migrated by a bounded process pool (one database connection per
+worker). Every schema's outcome is recorded in SchemaMigrationStatus, so
+re-running after a failure only migrates the schemas that have not reached
+the current migrations yet. Run `migrate_schemas --shared` first.
+"""
+import io
+import multiprocessing
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.recorder import MigrationRecorder
+from django_tenants.utils import get_public_schema_name, get_tenant_model, schema_context
+from users.models import SchemaMigrationStatus
+
+
+def migrate_schema(schema_name):
+    """Run the tenant migrations of one schema; returns (seconds, error or None)."""
+    started = time.monotonic()
+    try:
+        call_command(
+            'migrate_schemas',
+            tenant=True,
+            schema_name=schema_name,
+            interactive=False,
+            verbosity=0,
+            stdout=io.StringIO(),
+        )
+    except Exception:
+        return time.monotonic() - started, traceback.format_exc()
+    finally:
+        connection.set_schema_to_public()
+    return time.monotonic() - started, None
+
+
+class Command(BaseCommand):
+    help = 'Run tenant migrations for every tenant schema in a process pool, resuming after failures'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Schemas migrated in parallel.')
+        parser.add_argument('--schema', action='append', dest='schemas', help='Only migrate this schema (repeatable).')
+        parser.add_argument(
+            '--only-pending', action='store_true',
+            help="Check each schema's django_migrations table and skip schemas with no unapplied migration.",
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Ignore the recorded status and migrate every schema again.',
+        )
+
+    def handle(self, *args, **options):
+        loader = MigrationLoader(None, ignore_no_migrations=True)
+        target = ','.join(sorted(f'{app}.{name}' for app, name in loader.graph.leaf_nodes()))
+
+        schema_names = get_tenant_model().objects.exclude(schema_name=get_public_schema_name())
+        if options['schemas']:
+            schema_names = schema_names.filter(schema_name__in=options['schemas'])
+        schema_names = list(schema_names.order_by('schema_name').values_list('schema_name', flat=True))
+
+        #A. Resume: skip schemas a previous run already migrated to this target
+        if not options['restart']:
+            done = set(
+                SchemaMigrationStatus.objects.filter(schema_name__in=schema_names, target=target, status='succeeded')
+                .values_list('schema_name', flat=True)
+            )
+            if done:
+                self.stdout.write(f'Skipping {len(done)} schemas already migrated by a previous run')
+            schema_names = [schema_name for schema_name in schema_names if schema_name not in done]
+
+        #B. Skip schemas with nothing to apply
+        if options['only_pending']:
+            schema_names = [schema_name for schema_name in schema_names if self._has_pending_migrations(loader, schema_name)]
+
+        if not schema_names:
+            self.stdout.write(self.style.SUCCESS('All tenant schemas are up to date.'))
+            return
+
+        #C. Migrate in a process pool, recording each outcome as it arrives
+        self.stdout.write(f'Migrating {len(schema_names)} schemas with {options["workers"]} workers')
+        failed = []
+        for position, (schema_name, seconds, error) in enumerate(self._migrate(schema_names, options['workers']), start=1):
+            SchemaMigrationStatus.objects.update_or_create(
+                schema_name=schema_name,
+                defaults={
+                    'target': target,
+                    'status': 'failed' if error else 'succeeded',
+                    'error': error,
+                    'duration': seconds,
+                },
+            )
+            progress = f'[{position}/{len(schema_names)}]'
+            if error:
+                failed.append(schema_name)
+                self.stderr.write(self.style.ERROR(f'{progress} {schema_name} failed after {seconds:.1f}s:\n{error}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{progress} {schema_name} migrated ({seconds:.1f}s)'))
+
+        if failed:
+            raise CommandError(f'{len(failed)} schemas failed: {", ".join(failed)}. Re-run to resume.')
+        self.stdout.write(self.style.SUCCESS(f'Migrated {len(schema_names)} schemas.'))
+
+    def _has_pending_migrations(self, loader, schema_name):
+        with schema_context(schema_name):
+            applied = MigrationRecorder(connection).applied_migrations()
+        return any(node not in applied for node in loader.graph.nodes)
+
+    def _migrate(self, schema_names, workers):
+        if workers <= 1:
+            for schema_name in schema_names:
+                yield (schema_name, *migrate_schema(schema_name))
+            return
+
+        # forked workers must not share the parent's database connection (they drop the inherited pool: CarRentalService/db_backend)
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = {executor.submit(migrate_schema, schema_name): schema_name for schema_name in schema_names}
+            for future in as_completed(futures):
+                yield (futures[future], *future.result())
@@ -0,0 +1,46 @@
+"""
+Management command to print fleet utilization and revenue across all tenants.
+Same report as GET /users/clients/analytics/, computed with per-schema queries
+fanned out over a thread pool.
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.utils.encoders import JSONEncoder
+from rentals.utils import parse_datetime_param
+from users.analytics import STATUSES, fleet_analytics
+
+
+class Command(BaseCommand):
+    help = 'Report rentals, revenue and utilization for every tenant and in total'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='Window start (ISO 8601). Default: 30 days before --end.')
+        parser.add_argument('--end', help='Window end (ISO 8601). Default: now.')
+        parser.add_argument('--workers', type=int, help='Schemas queried in parallel (default: ANALYTICS_WORKERS).')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        window = {}
+        for name in ('start', 'end'):
+            window[name] = parse_datetime_param(options[name])
+            if options[name] and window[name] is None:
+                raise CommandError(f'Invalid --{name} date. Use ISO 8601.')
+
+        report = fleet_analytics(window['start'], window['end'], workers=options['workers'], refresh=True)
+        if options['json']:
+            self.stdout.write(json.dumps(report, cls=JSONEncoder, indent=2))
+            return
+
+        self.stdout.write(f"Window: {report['window']['start']:%Y-%m-%d %H:%M} to {report['window']['end']:%Y-%m-%d %H:%M}")
+        header = f"{'schema':<24}{'rentals':>9}" + ''.join(f'{status:>11}' for status in STATUSES) + f"{'revenue':>14}{'veh-days':>11}{'fleet':>7}{'util':>8}"
+        self.stdout.write(header)
+        for row in [*report['tenants'], {'schema_name': 'TOTAL', **report['totals']}]:
+            utilization = f"{row['utilization']:.1%}" if row['utilization'] is not None else '-'
+            self.stdout.write(
+                f"{row['schema_name']:<24}{row['rentals']:>9}"
+                + ''.join(f"{row['rentals_by_status'][status]:>11}" for status in STATUSES)
+                + f"{row['revenue']:>14}{row['vehicle_days_booked']:>11}{row['fleet_size']:>7}{utilization:>8}"
+            )
+        for failure in report['failed']:
+            self.stderr.write(self.style.ERROR(f"{failure['schema_name']} failed: {failure['error']}"))
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_client_domain'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchemaMigrationStatus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('schema_name', models.CharField(max_length=63, unique=True)),
+                ('target', models.TextField(help_text='Leaf migrations the schema was migrated to')),
+                ('status', models.CharField(choices=[('succeeded', 'Succeeded'), ('failed', 'Failed')], max_length=20)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('duration', models.FloatField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
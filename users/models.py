@@ -25,4 +25,31 @@ class Client(TenantMixin):
 # domain model for the tenant links a tenant(client) to a specific domain/subdomain
 class Domain(DomainMixin):
     """links a tenant to a specific hostname for routing."""
-    pass
\ No newline at end of file
+    pass
+# Outcome of the last migrate_tenants run for each tenant schema
+class SchemaMigrationStatus(models.Model):
+    """Lets migrate_tenants resume: schemas already migrated to the current target are skipped."""
+    schema_name = models.CharField(max_length=63, unique=True)
+    target = models.TextField(help_text='Leaf migrations the schema was migrated to')
+    status = models.CharField(max_length=20, choices=[
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed')
+    ])
+    error = models.TextField(null=True, blank=True)
+    duration = models.FloatField(null=True, blank=True) # seconds
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.schema_name}: {self.status}'
+
+# JWTs revoked before they expire (POST /api/token/revoke/, or a change to the user's claims)
+class RevokedToken(models.Model):
+    """One revoked token (jti), or without a jti every token of the user issued up to revoked_at."""
+    jti = models.CharField(max_length=255, unique=True, null=True, blank=True)
+    # no constraint: the revocation has to outlive a deleted user
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    revoked_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True, help_text='The revoked tokens have expired by then')
+
+    def __str__(self):
+        return f'{self.jti or "all tokens"} of user {self.user_id}'
@@ -1,4 +1,10 @@
 from rest_framework import serializers
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from CarRentalService import authentication
 from .models import User, Client, Domain
 
 class UserSerializer(serializers.ModelSerializer):
@@ -25,4 +31,58 @@ class ClientSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         """Create a new client with auto_create_schema enabled"""
         client = Client.objects.create(**validated_data)
-        return client
\ No newline at end of file
+        return client
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Issues tokens with the claims ClaimsJWTAuthentication reads instead of the User row."""
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        refresh = authentication.add_claims(self.get_token(self.user), self.user, authentication.host_schema(self.context['request']))
+        # the access token copies the refresh token's claims
+        data['refresh'], data['access'] = str(refresh), str(refresh.access_token)
+        return data
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    Issues access tokens with the user's current claims: the refresh token's copies may predate a
+    demotion whose revocation this worker hasn't loaded yet, and the new token's iat would pass it.
+    """
+
+    def validate(self, attrs):
+        try:
+            refresh = RefreshToken(attrs['refresh'])
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+        if authentication.is_revoked(refresh, exact=True):
+            raise InvalidToken('Token has been revoked')
+        user = User.objects.filter(pk=authentication.token_user_id(refresh)).first()
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages['no_active_account'], 'no_active_account')
+
+        # tokens issued before the claims were added are bound to the host they are refreshed on, like new ones
+        schema_name = refresh['tenant'] if 'tenant' in refresh else authentication.host_schema(self.context['request'])
+        data = {'access': str(authentication.add_claims(refresh.access_token, user, schema_name))}
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            authentication.add_claims(refresh, user, schema_name)
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data['refresh'] = str(refresh)
+        return data
+
+
+class TokenRevokeSerializer(serializers.Serializer):
+    """The refresh token to revoke along with the access token of the request."""
+    refresh = serializers.CharField(required=False)
+
+    def validate_refresh(self, value):
+        try:
+            refresh = RefreshToken(value)
+        except TokenError as e:
+            raise serializers.ValidationError(e.args[0])
+        if authentication.token_user_id(refresh) != self.context['request'].user.pk:
+            raise serializers.ValidationError('The token belongs to another user.')
+        return refresh
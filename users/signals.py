@@ -0,0 +1,45 @@
+from .models import Client, Domain, User
+from CarRentalService import authentication, cache
+from CarRentalService.tenant_cache import tenant_cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+
+
+# --- Tenant routing cache (CarRentalService/tenant_cache.py) ---
+# cleared on commit, so a concurrent request can't re-cache the old rows
+
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+@receiver(post_save, sender=Domain)
+@receiver(post_delete, sender=Domain)
+def invalidate_tenant_cache(sender, **kwargs):
+    transaction.on_commit(tenant_cache.clear)
+
+
+# --- Object cache (CarRentalService/cache.py) ---
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def drop_cached_user(sender, instance, **kwargs):
+    cache.objects_changed(User, [instance.pk])
+
+
+# --- Token claims (CarRentalService/authentication.py) ---
+# tokens aren't checked against the User row, so the tokens issued before a
+# change to the user's claims, status or password are revoked
+
+@receiver(pre_save, sender=User)
+def revoke_outdated_tokens(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and not set(update_fields) & set(authentication.REVOKING_FIELDS):
+        return
+    previous = User.objects.filter(pk=instance.pk).values(*authentication.REVOKING_FIELDS).first()
+    if previous and any(previous[field] != getattr(instance, field) for field in authentication.REVOKING_FIELDS):
+        authentication.revoke_user(instance.pk)
+
+
+@receiver(pre_delete, sender=User)
+def revoke_deleted_user_tokens(sender, instance, **kwargs):
+    authentication.revoke_user(instance.pk)
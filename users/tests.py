@@ -1,3 +1,466 @@
-from django.test import TestCase
+import io
+import os
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.loader import MigrationLoader
+from django.http import Http404
+from django.test import Client as HTTPClient, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django_tenants.clone import CloneSchema
+from django_tenants.test.cases import TenantTestCase
+from django_tenants.test.client import TenantClient
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from CarRentalService import authentication, cache
+from CarRentalService.db_backend import base as db_backend
+from CarRentalService.tenant_cache import MISSING, TenantCache, tenant_cache
+from CarRentalService.testing import QueryCountAssertions, TenantAPITestMixin, reset_process_state
+from CarRentalService.values_serializers import compile_serializer
+from vehicles.models import Vehicle
+from .management.commands.create_tenants import clone_from_template, provision_tenant
+from .models import Client, Domain, SchemaMigrationStatus, User
+from .serializers import UserSerializer
+
+
+class UserValuesSerializerTests(TestCase):
+    """The compiled UserSerializer must render exactly like UserSerializer."""
+
+    def test_users_render_identically(self):
+        User.objects.create_user(username='plain', email='plain@example.com', password=None)
+        User.objects.create_user(
+            username='full', email='Full.Name+rentals@example.com', password=None,
+            phone_number='+254 700 000000', driver_license_number='DL-123',
+        )
+        User.objects.create_user(username='ünïcode', email='u@example.com', password=None, phone_number='')
+        queryset = User.objects.order_by('id')
+        compiled = compile_serializer(UserSerializer)
+        self.assertEqual(
+            JSONRenderer().render(compiled.serialize(compiled.values(queryset))),
+            JSONRenderer().render(UserSerializer(queryset, many=True).data),
+        )
+
+
+class DatabaseBackendTests(TenantTestCase):
+    """search_path reuse and pools of CarRentalService/db_backend."""
+
+    def show_search_path(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW search_path')
+            return cursor.fetchone()[0]
+
+    def test_savepoint_rollback_after_schema_switch(self):
+        self.assertIn(self.tenant.schema_name, self.show_search_path())
+        try:
+            with transaction.atomic():
+                connection.set_schema_to_public()
+                self.assertNotIn(self.tenant.schema_name, self.show_search_path())
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        # the rollback reverted the SET to public: it must be issued again, not assumed
+        try:
+            self.assertNotIn(self.tenant.schema_name, self.show_search_path())
+        finally:
+            connection.set_tenant(self.tenant)
+        self.assertIn(self.tenant.schema_name, self.show_search_path())
+
+    def test_forked_process_drops_inherited_pools(self):
+        if connection.pool is None:
+            self.skipTest('DB_POOL is off')
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if not db_backend.DatabaseWrapper._connection_pools and db_backend._inherited_pools else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertIn(connection.alias, db_backend.DatabaseWrapper._connection_pools)
+
+
+class ProvisionTenantTests(TenantTestCase):
+    """create_tenants --template-schema has django-tenants clone new schemas from the template."""
+
+    def test_clone_from_template(self):
+        # the test tenant's schema is migrated and empty, as a template is
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT app, name FROM django_migrations ORDER BY id')
+            migrations = cursor.fetchall()
+        connection.set_schema_to_public()
+        self.addCleanup(connection.set_tenant, self.tenant)
+
+        row = {'schema_name': 'cloned', 'name': 'Cloned', 'domain': 'cloned.test.com', 'is_primary': True, 'paid_until': None, 'on_trial': True}
+        with clone_from_template(self.tenant.schema_name), \
+                mock.patch.object(CloneSchema, 'clone_schema', autospec=True, side_effect=CloneSchema.clone_schema) as clone_schema:
+            provision_tenant(row)
+        clone_schema.assert_called_once_with(mock.ANY, self.tenant.schema_name, 'cloned', 'DATA')
+
+        client = Client.objects.get(schema_name='cloned')
+        self.assertEqual(client.get_primary_domain().domain, 'cloned.test.com')
+        connection.set_tenant(client)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT app, name FROM django_migrations ORDER BY id')
+            self.assertEqual(cursor.fetchall(), migrations)
+        self.assertFalse(Vehicle.objects.exists())
+
+    def test_clone_from_template_restores_settings(self):
+        with override_settings(TENANT_BASE_SCHEMA='base'):
+            with clone_from_template('template'):
+                self.assertEqual((settings.TENANT_BASE_SCHEMA, settings.TENANT_CREATION_FAKES_MIGRATIONS), ('template', True))
+            self.assertEqual(settings.TENANT_BASE_SCHEMA, 'base')
+            self.assertFalse(hasattr(settings, 'TENANT_CREATION_FAKES_MIGRATIONS'))
+
+
+class MigrateTenantsTests(TenantTestCase):
+    """migrate_tenants resumes from SchemaMigrationStatus and --only-pending skips migrated schemas."""
+
+    def setUp(self):
+        loader = MigrationLoader(None, ignore_no_migrations=True)
+        self.target = ','.join(sorted(f'{app}.{name}' for app, name in loader.graph.leaf_nodes()))
+        self.migrate_schema = self.enterContext(mock.patch(
+            'users.management.commands.migrate_tenants.migrate_schema', return_value=(0.1, None),
+        ))
+        self.addCleanup(connection.set_tenant, self.tenant)
+
+    def migrate_tenants(self, *args):
+        call_command('migrate_tenants', '--workers=1', f'--schema={self.tenant.schema_name}', *args, stdout=io.StringIO())
+
+    def test_failed_schema_is_retried(self):
+        SchemaMigrationStatus.objects.create(schema_name=self.tenant.schema_name, target=self.target, status='failed', error='Traceback')
+        self.migrate_tenants()
+        self.migrate_schema.assert_called_once_with(self.tenant.schema_name)
+        status = SchemaMigrationStatus.objects.get(schema_name=self.tenant.schema_name)
+        self.assertEqual((status.status, status.error), ('succeeded', None))
+
+    def test_succeeded_schema_is_skipped(self):
+        SchemaMigrationStatus.objects.create(schema_name=self.tenant.schema_name, target=self.target, status='succeeded')
+        self.migrate_tenants()
+        self.migrate_schema.assert_not_called()
+
+        # a run for newer migrations, or --restart, migrates it again
+        SchemaMigrationStatus.objects.filter(schema_name=self.tenant.schema_name).update(target='vehicles.0001_initial')
+        self.migrate_tenants()
+        self.migrate_tenants('--restart')
+        self.assertEqual(self.migrate_schema.call_count, 2)
+
+    def test_only_pending(self):
+        # the test tenant's schema has every migration applied
+        self.migrate_tenants('--only-pending')
+        self.migrate_schema.assert_not_called()
+
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM django_migrations WHERE id = (SELECT max(id) FROM django_migrations)')
+        self.migrate_tenants('--only-pending')
+        self.migrate_schema.assert_called_once_with(self.tenant.schema_name)
+
+
+class TenantCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.enterContext(mock.patch('CarRentalService.tenant_cache.time.monotonic', side_effect=lambda: self.now))
+        self.cache = TenantCache(max_size=3, ttl=60)
+
+    def test_lru_eviction(self):
+        for hostname in ('a', 'b', 'c'):
+            self.cache.set(hostname, hostname.upper())
+        # reading 'a' makes 'b' the least recently used
+        self.assertEqual(self.cache.get('a'), 'A')
+        self.cache.set('d', 'D')
+        self.assertIs(self.cache.get('b'), MISSING)
+        self.assertEqual([self.cache.get(hostname) for hostname in ('a', 'c', 'd')], ['A', 'C', 'D'])
+        # setting an entry again refreshes it too
+        self.cache.set('a', 'A2')
+        self.cache.set('e', 'E')
+        self.assertIs(self.cache.get('c'), MISSING)
+        self.assertEqual(self.cache.get('a'), 'A2')
+        self.assertEqual(self.cache.stats()['size'], 3)
+
+    def test_ttl(self):
+        self.cache.set('a', 'A')
+        self.now += 60
+        self.assertEqual(self.cache.get('a'), 'A')
+        self.now += 1
+        self.assertIs(self.cache.get('a'), MISSING)
+        # reading doesn't extend an entry's lifetime
+        self.cache.set('b', 'B')
+        self.now += 30
+        self.cache.get('b')
+        self.now += 31
+        self.assertIs(self.cache.get('b'), MISSING)
+
+    def test_unknown_hostnames(self):
+        self.cache.set('unknown', None)
+        self.assertIsNone(self.cache.get('unknown'))
+        self.assertIs(self.cache.get('never-seen'), MISSING)
+        self.now += 61
+        self.assertIs(self.cache.get('unknown'), MISSING)
+        self.assertEqual((self.cache.stats()['hits'], self.cache.stats()['misses']), (1, 2))
+
+    def test_clear(self):
+        self.cache.set('a', 'A')
+        self.cache.set('unknown', None)
+        self.cache.clear()
+        self.assertIs(self.cache.get('a'), MISSING)
+        self.assertIs(self.cache.get('unknown'), MISSING)
+
+
+class TenantRoutingTests(TenantTestCase):
+    """CustomTenantMiddleware resolves hostnames through tenant_cache, which users/signals.py clears on commit."""
+
+    def setUp(self):
+        super().setUp()
+        tenant_cache.clear()
+
+    def domain_queries(self, client, status_code):
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get('/vehicles/')
+        self.assertEqual(response.status_code, status_code)
+        return [query['sql'] for query in queries if Domain._meta.db_table in query['sql']]
+
+    def test_known_hostname(self):
+        client = HTTPClient(HTTP_HOST=self.domain.domain)
+        self.assertTrue(self.domain_queries(client, 200))
+        self.assertEqual(tenant_cache.get(self.domain.domain), self.tenant)
+        self.assertEqual(self.domain_queries(client, 200), [])
+
+    def test_unknown_hostname(self):
+        client = HTTPClient(HTTP_HOST='unknown.test.com')
+        self.assertTrue(self.domain_queries(client, 404))
+        self.assertIsNone(tenant_cache.get('unknown.test.com'))
+        self.assertEqual(self.domain_queries(client, 404), [])
+
+    def test_cleared_when_a_domain_is_added(self):
+        client = HTTPClient(HTTP_HOST='added.test.com')
+        self.domain_queries(client, 404)
+        with self.captureOnCommitCallbacks(execute=True):
+            domain = Domain.objects.create(domain='added.test.com', tenant=self.tenant, is_primary=False)
+        self.assertIs(tenant_cache.get('added.test.com'), MISSING)
+        self.assertTrue(self.domain_queries(client, 200))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            domain.delete()
+        self.assertIs(tenant_cache.get('added.test.com'), MISSING)
+        self.domain_queries(client, 404)
+
+    def test_cleared_when_a_client_changes(self):
+        tenant_cache.set(self.domain.domain, self.tenant)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tenant.on_trial = not self.tenant.on_trial
+            self.tenant.save()
+        self.assertIs(tenant_cache.get(self.domain.domain), MISSING)
+
+    def test_kept_when_the_change_rolls_back(self):
+        tenant_cache.set(self.domain.domain, self.tenant)
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Domain.objects.create(domain='rolled-back.test.com', tenant=self.tenant, is_primary=False)
+                    raise IntegrityError
+            except IntegrityError:
+                pass
+        self.assertEqual(tenant_cache.get(self.domain.domain), self.tenant)
+
+
+class ObjectCacheTests(TenantTestCase):
+    """Users cached by primary key (CarRentalService/cache.py), dropped by users/signals.py once a change commits."""
+
+    def setUp(self):
+        reset_process_state()
+        self.user = User.objects.create_user(username='cached', email='cached@example.com', password=None)
+
+    def test_cached(self):
+        with self.assertNumQueries(1):
+            cache.get_object(User, self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get_object(User, str(self.user.pk)).email, 'cached@example.com')
+        with self.assertRaises(Http404):
+            cache.get_object_or_404(User, 'not-a-pk')
+        with self.assertRaises(Http404):
+            cache.get_object_or_404(User, self.user.pk + 1000)
+
+    def test_dropped_on_save(self):
+        cache.get_object(User, self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.email = 'changed@example.com'
+            self.user.save()
+        self.assertEqual(cache.get_object(User, self.user.pk).email, 'changed@example.com')
+
+    def test_dropped_on_delete(self):
+        cache.get_object(User, self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(pk=self.user.pk).delete()
+        with self.assertRaises(User.DoesNotExist):
+            cache.get_object(User, self.user.pk)
+
+    def test_kept_on_rollback(self):
+        cache.get_object(User, self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    self.user.email = 'rolled-back@example.com'
+                    self.user.save()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get_object(User, self.user.pk).email, 'cached@example.com')
+
+    def test_objects_changed(self):
+        # for writes that send no signals
+        cache.get_object(User, self.user.pk)
+        User.objects.filter(pk=self.user.pk).update(email='updated@example.com')
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.objects_changed(User, [self.user.pk])
+        self.assertEqual(cache.get_object(User, self.user.pk).email, 'updated@example.com')
+
+
+class TokenClaimsTests(TenantAPITestMixin, TenantTestCase):
+    """Revocation and refresh of tokens with claims (CarRentalService/authentication.py)."""
+
+    def setUp(self):
+        super().setUp()
+        # each request sends the token under test
+        self.client = TenantClient(self.tenant)
+
+    def issue(self, user):
+        return authentication.add_claims(RefreshToken.for_user(user), user, self.tenant.schema_name)
+
+    def get_user(self, access):
+        return self.client.get(f'/users/{self.admin.pk}/', HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def refresh(self, refresh):
+        return self.client.post('/api/token/refresh/', {'refresh': str(refresh)}, content_type='application/json')
+
+    def test_revoke(self):
+        refresh = self.issue(self.admin)
+        access = refresh.access_token
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/token/revoke/', {'refresh': str(refresh)}, content_type='application/json',
+                                        HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.assertEqual(response.json(), {'revoked': 2})
+        self.assertEqual(self.get_user(access).status_code, 401)
+        self.assertEqual(self.refresh(refresh).status_code, 401)
+
+    def test_refresh(self):
+        response = self.refresh(self.issue(self.admin))
+        self.assertEqual(response.status_code, 200)
+        access = AccessToken(response.json()['access'])
+        self.assertEqual((access['is_staff'], access['is_superuser'], access['tenant']), (True, False, self.tenant.schema_name))
+        self.assertEqual(self.get_user(access).status_code, 200)
+
+    def test_refresh_after_demotion_is_revoked(self):
+        refresh = self.issue(self.admin)
+        # the revocation is committed, but this worker hasn't loaded it (on_commit isn't run)
+        self.admin.is_staff = False
+        self.admin.save()
+        self.assertFalse(authentication.is_revoked(refresh))
+        self.assertEqual(self.refresh(refresh).status_code, 401)
+
+    def test_refresh_takes_claims_from_the_user(self):
+        refresh = self.issue(self.admin)
+        # a change that revoked nothing: the refresh token's claims are out of date
+        User.objects.filter(pk=self.admin.pk).update(is_staff=False)
+        response = self.refresh(refresh)
+        self.assertEqual(response.status_code, 200)
+        self.assertIs(AccessToken(response.json()['access'])['is_staff'], False)
+
+    def test_refresh_of_inactive_user(self):
+        refresh = self.issue(self.admin)
+        User.objects.filter(pk=self.admin.pk).update(is_active=False)
+        self.assertEqual(self.refresh(refresh).status_code, 401)
+
+    def test_legacy_tokens(self):
+        # tokens issued before the claims were added: the user is loaded, and refreshes add the claims
+        refresh = RefreshToken.for_user(self.admin)
+        self.assertEqual(self.get_user(refresh.access_token).status_code, 200)
+        response = self.refresh(refresh)
+        self.assertEqual(response.status_code, 200)
+        access = AccessToken(response.json()['access'])
+        self.assertEqual((access['is_staff'], access['tenant']), (True, self.tenant.schema_name))
+
+
+class UserEndpointQueryCountTests(TenantAPITestMixin, QueryCountAssertions, TenantTestCase):
+    """
+    Queries run by each endpoint of users/urls.py (with more rows than QUERY_REPEAT_LIMIT, so N+1 loops fail).
+    Creating and deleting clients creates and drops schemas, and isn't covered; neither is deleting a
+    user, whose cascade reaches tenant tables the public schema /users/ runs in doesn't have.
+    """
+
+    def setUp(self):
+        super().setUp()
+        User.objects.bulk_create([User(username=f'counted-{i}', email=f'counted-{i}@example.com') for i in range(8)])
+
+    def add_clients(self):
+        # bulk_create skips save(), so no schemas are created for them
+        clients = Client.objects.bulk_create([Client(schema_name=f'counted_{i}', name=f'Counted {i}') for i in range(8)])
+        Domain.objects.bulk_create([
+            Domain(domain=f'counted-{client.pk}-{i}.test.com', tenant=client, is_primary=not i) for client in clients for i in range(2)
+        ])
+        return clients
+
+    def test_user_list(self):
+        self.assertRequestQueries(1, self.admin_client.get, '/users/')
+
+    def test_user_retrieve(self):
+        self.assertRequestQueries(1, self.client.get, f'/users/{self.user.pk}/')
+
+    def test_user_create(self):
+        self.assertRequestQueries(3, TenantClient(self.tenant).post, '/users/', {
+            'username': 'registered', 'email': 'registered@example.com',
+        }, content_type='application/json', status_code=201)
+
+    def test_user_update(self):
+        self.assertRequestQueries(3, self.client.patch, f'/users/{self.user.pk}/', {
+            'phone_number': '+254 700 000001',
+        }, content_type='application/json')
+
+    def test_client_list(self):
+        self.add_clients()
+        # the domains of every client in one query
+        self.assertRequestQueries(2, self.admin_client.get, '/users/clients/')
+
+    def test_client_retrieve(self):
+        self.assertRequestQueries(2, self.admin_client.get, f'/users/clients/{self.tenant.pk}/')
+
+    def test_client_update(self):
+        self.assertRequestQueries(5, self.admin_client.patch, f'/users/clients/{self.tenant.pk}/', {
+            'on_trial': False,
+        }, content_type='application/json')
+
+    def test_tenant_cache(self):
+        self.assertRequestQueries(0, self.admin_client.get, '/users/clients/tenant-cache/')
+
+    def test_analytics(self):
+        # the tenants are summarized on the thread pool's own connections, which aren't counted
+        self.assertRequestQueries(1, self.admin_client.get, '/users/clients/analytics/')
+
+    def test_db_pool(self):
+        self.assertRequestQueries(0, self.admin_client.get, '/users/clients/db-pool/')
+
+    def test_query_stats(self):
+        self.assertRequestQueries(0, self.admin_client.get, '/users/clients/query-stats/')
+
+    def test_domain_list(self):
+        self.add_clients()
+        self.assertRequestQueries(1, self.admin_client.get, '/users/domains/')
+
+    def test_domain_retrieve(self):
+        self.assertRequestQueries(1, self.admin_client.get, f'/users/domains/{self.tenant.get_primary_domain().pk}/')
+
+    def test_domain_create(self):
+        self.assertRequestQueries(6, self.admin_client.post, '/users/domains/', {
+            'domain': 'counted-new.test.com', 'tenant': self.tenant.pk, 'is_primary': False,
+        }, content_type='application/json', status_code=201)
+
+    def test_domain_update(self):
+        domain = Domain.objects.create(domain='counted-old.test.com', tenant=self.tenant, is_primary=False)
+        self.assertRequestQueries(7, self.admin_client.patch, f'/users/domains/{domain.pk}/', {
+            'domain': 'counted-renamed.test.com',
+        }, content_type='application/json')
+
+    def test_domain_destroy(self):
+        domain = Domain.objects.create(domain='counted-gone.test.com', tenant=self.tenant, is_primary=False)
+        self.assertRequestQueries(2, self.admin_client.delete, f'/users/domains/{domain.pk}/', status_code=204)
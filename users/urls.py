@@ -4,8 +4,9 @@ from rest_framework.routers import DefaultRouter
 from .views import UserViewSet, ClientViewSet, DomainViewSet
 
 router = DefaultRouter()
-router.register(r'', UserViewSet, basename='user')  # Register the users app routes
+# clients/ and domains/ go first: the users' {pk}/ route would otherwise match them
 router.register(r'clients', ClientViewSet, basename='client')  # Register clients (tenants) management
 router.register(r'domains', DomainViewSet, basename='domain')  # Register domains management
+router.register(r'', UserViewSet, basename='user')  # Register the users app routes
 
 urlpatterns = router.urls
@@ -1,12 +1,21 @@
 from rest_framework import viewsets, status
 from .models import User, Client, Domain
-from .serializers import UserSerializer, ClientSerializer, DomainSerializer
+from .serializers import UserSerializer, ClientSerializer, DomainSerializer, TokenRevokeSerializer
 from rest_framework.permissions import IsAdminUser, IsAuthenticated, AllowAny
 from rest_framework import generics
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
+from CarRentalService import authentication
+from CarRentalService.values_serializers import ValuesListMixin
+from CarRentalService.tenant_cache import tenant_cache
+from CarRentalService.db_backend.base import pool_stats
+from CarRentalService.query_budget import tenant_query_stats
+from django.db import connection
+from rentals.utils import parse_datetime_param
+from .analytics import fleet_analytics
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ValuesListMixin, viewsets.ModelViewSet):
     queryset = User.objects.all() # Fetch all users
     serializer_class = UserSerializer #for handling serialization and deserialization
      
@@ -36,7 +45,8 @@ class ClientViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         # Admin can see all clients
         if self.request.user.is_superuser or self.request.user.is_staff:
-            return Client.objects.all()
+            # ClientSerializer nests each client's domains
+            return Client.objects.prefetch_related('domains')
         return Client.objects.none()
     
     def perform_create(self, serializer):
@@ -44,6 +54,36 @@ class ClientViewSet(viewsets.ModelViewSet):
         client = serializer.save()
         return client
 
+    @action(detail=False, methods=['get'], url_path='tenant-cache')
+    def tenant_cache(self, request):
+        """Hit/miss counters of this worker's tenant routing cache."""
+        return Response(tenant_cache.stats())
+
+    @action(detail=False, methods=['get'], url_path='analytics')
+    def analytics(self, request):
+        """Fleet utilization and revenue across all tenants: ?start=&end= (ISO 8601, default last 30 days), ?refresh=1 bypasses the cache."""
+        start = request.query_params.get('start')
+        end = request.query_params.get('end')
+        window = {'start': parse_datetime_param(start), 'end': parse_datetime_param(end)}
+        for name, value in (('start', start), ('end', end)):
+            if value and window[name] is None:
+                return Response({'detail': f'Invalid {name} date. Use ISO 8601.'}, status=status.HTTP_400_BAD_REQUEST)
+        if window['start'] and window['end'] and window['start'] >= window['end']:
+            return Response({'detail': 'start must be before end.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        refresh = request.query_params.get('refresh') in ('1', 'true')
+        return Response(fleet_analytics(window['start'], window['end'], refresh=refresh))
+
+    @action(detail=False, methods=['get'], url_path='db-pool')
+    def db_pool(self, request):
+        """Connection pool and search_path metrics of this worker."""
+        return Response(pool_stats(connection))
+
+    @action(detail=False, methods=['get'], url_path='query-stats')
+    def query_stats(self, request):
+        """Queries and database time per request of each tenant, in this worker."""
+        return Response(tenant_query_stats.stats())
+
 
 class DomainViewSet(viewsets.ModelViewSet):
     """
@@ -59,4 +99,22 @@ class DomainViewSet(viewsets.ModelViewSet):
         client_id = self.request.query_params.get('client_id')
         if client_id:
             return Domain.objects.filter(tenant_id=client_id)
-        return Domain.objects.all()
\ No newline at end of file
+        return Domain.objects.all()
+
+
+class TokenRevokeView(APIView):
+    """
+    POST /api/token/revoke/ {"refresh": "..."}: log out by revoking the access token
+    the request is made with, and the refresh token if one is sent.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = TokenRevokeSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        revoked = 0
+        for token in (request.auth, serializer.validated_data.get('refresh')):
+            # request.auth is None for session logins
+            if token is not None and authentication.revoke_token(token):
+                revoked += 1
+        return Response({'revoked': revoked}, status=status.HTTP_200_OK)
@@ -0,0 +1,183 @@
+"""
+In-process availability index used by GET /vehicles/availability/.
+
+Every tenant gets an index of the booked intervals of its vehicles, loaded
+lazily on first use and kept current by the Rental signals in
+rentals/signals.py. Answering "which vehicles are booked in [start, end)"
+is a binary search over interval start times instead of a scan of the
+rentals table.
+
+The signals only run in the worker that saved the rental: the others see
+the change when they reload their index, which get_index() does once it is
+AVAILABILITY_INDEX_TTL seconds old. The other per-worker copies of tenant
+data (vehicles/geo.py, vehicles/search.py) are bounded the same way.
+"""
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+
+# Intervals longer than this are kept in a separate (small) list so they
+# don't widen the binary-search window for the common short rentals.
+LONG_RENTAL = timedelta(days=31).total_seconds()
+
+
+class AvailabilityIndex:
+    """Booked intervals of one tenant, searchable by time window."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # short intervals, sorted by start: parallel lists of start timestamps and rental ids
+        self._starts = []
+        self._rental_ids = []
+        # rental id -> (vehicle_id, start, end) for every indexed interval
+        self._intervals = {}
+        # rental ids of intervals longer than LONG_RENTAL
+        self._long = set()
+        # vehicle id -> rental ids of its indexed intervals
+        self._by_vehicle = {}
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def load(cls, rentals):
+        """Build an index from an iterable of (rental_id, vehicle_id, rental_start, rental_end)."""
+        index = cls()
+        rows = []
+        for rental_id, vehicle_id, rental_start, rental_end in rentals:
+            start, end = rental_start.timestamp(), rental_end.timestamp()
+            index._intervals[rental_id] = (vehicle_id, start, end)
+            index._by_vehicle.setdefault(vehicle_id, set()).add(rental_id)
+            if end - start > LONG_RENTAL:
+                index._long.add(rental_id)
+            else:
+                rows.append((start, rental_id))
+        rows.sort()
+        index._starts = [start for start, _ in rows]
+        index._rental_ids = [rental_id for _, rental_id in rows]
+        return index
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def add(self, rental_id, vehicle_id, rental_start, rental_end):
+        start, end = rental_start.timestamp(), rental_end.timestamp()
+        with self._lock:
+            self._remove(rental_id)
+            self._intervals[rental_id] = (vehicle_id, start, end)
+            self._by_vehicle.setdefault(vehicle_id, set()).add(rental_id)
+            if end - start > LONG_RENTAL:
+                self._long.add(rental_id)
+            else:
+                position = bisect_right(self._starts, start)
+                self._starts.insert(position, start)
+                self._rental_ids.insert(position, rental_id)
+
+    def remove(self, rental_id):
+        with self._lock:
+            self._remove(rental_id)
+
+    def _remove(self, rental_id):
+        interval = self._intervals.pop(rental_id, None)
+        if interval is None:
+            return
+        rental_ids = self._by_vehicle[interval[0]]
+        rental_ids.discard(rental_id)
+        if not rental_ids:
+            del self._by_vehicle[interval[0]]
+        if rental_id in self._long:
+            self._long.discard(rental_id)
+            return
+        start = interval[1]
+        position = bisect_left(self._starts, start)
+        while self._rental_ids[position] != rental_id:
+            position += 1
+        del self._starts[position]
+        del self._rental_ids[position]
+
+    def busy_vehicle_ids(self, rental_start, rental_end):
+        """Return the ids of vehicles with a booking overlapping [rental_start, rental_end)."""
+        start, end = rental_start.timestamp(), rental_end.timestamp()
+        busy = set()
+        with self._lock:
+            intervals = self._intervals
+            # A short interval can only overlap if it starts within LONG_RENTAL before `start`
+            lo = bisect_right(self._starts, start - LONG_RENTAL)
+            hi = bisect_left(self._starts, end)
+            for rental_id in self._rental_ids[lo:hi]:
+                vehicle_id, _, interval_end = intervals[rental_id]
+                if interval_end > start:
+                    busy.add(vehicle_id)
+            for rental_id in self._long:
+                vehicle_id, interval_start, interval_end = intervals[rental_id]
+                if interval_start < end and interval_end > start:
+                    busy.add(vehicle_id)
+        return busy
+
+    def busy_among(self, vehicle_ids, rental_start, rental_end):
+        """Return the ids among vehicle_ids with a booking overlapping [rental_start, rental_end)."""
+        start, end = rental_start.timestamp(), rental_end.timestamp()
+        busy = set()
+        with self._lock:
+            intervals = self._intervals
+            for vehicle_id in vehicle_ids:
+                for rental_id in self._by_vehicle.get(vehicle_id, ()):
+                    _, interval_start, interval_end = intervals[rental_id]
+                    if interval_start < end and interval_end > start:
+                        busy.add(vehicle_id)
+                        break
+        return busy
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _load_index():
+    from rentals.models import Rental
+
+    rentals = (
+        Rental.objects.filter(status__in=Rental.BLOCKING_STATUSES)
+        .values_list('id', 'vehicle_id', 'rental_start', 'rental_end')
+        .iterator(chunk_size=10000)
+    )
+    return AvailabilityIndex.load(rentals)
+
+
+def get_index():
+    """Return the availability index of the current tenant, loading it if needed."""
+    schema_name = connection.schema_name
+    index = _indexes.get(schema_name)
+    if index is None or time.monotonic() - index.loaded_at > settings.AVAILABILITY_INDEX_TTL:
+        index = _load_index()
+        with _indexes_lock:
+            _indexes[schema_name] = index
+    return index
+
+
+def rental_changed(schema_name, rental_id, vehicle_id, rental_start, rental_end, status):
+    """Apply a saved rental to the tenant's index, if that index is loaded."""
+    from rentals.models import Rental
+
+    index = _indexes.get(schema_name)
+    if index is None:
+        return
+    if status in Rental.BLOCKING_STATUSES:
+        index.add(rental_id, vehicle_id, rental_start, rental_end)
+    else:
+        index.remove(rental_id)
+
+
+def rental_deleted(schema_name, rental_id):
+    """Drop a deleted rental from the tenant's index, if that index is loaded."""
+    index = _indexes.get(schema_name)
+    if index is not None:
+        index.remove(rental_id)
+
+
+def reset():
+    """Forget every loaded index (they will be reloaded lazily)."""
+    with _indexes_lock:
+        _indexes.clear()
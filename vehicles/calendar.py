@@ -0,0 +1,135 @@
+"""
+Fleet occupancy calendar used by GET /vehicles/calendar/.
+
+The window is cut into fixed slots (hours or days) and every vehicle gets one
+bit per slot, set when an active or confirmed rental overlaps the slot. The
+whole fleet is computed in one pass over the overlapping rentals with NumPy
+and cached per (tenant, window, granularity). Rental writes bump the tenant's
+calendar version (see rentals/signals.py), which retires every cached window
+of that tenant at once; with a per-process cache, other workers catch up
+after CALENDAR_CACHE_TTL seconds.
+"""
+import base64
+from datetime import datetime, time, timedelta
+from time import time_ns
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+GRANULARITIES = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+ENCODINGS = ('bitset', 'rle')
+
+
+def parse_bound(value):
+    """An ISO 8601 datetime, or a date (meaning its midnight), as an aware datetime. None if malformed."""
+    from rentals.utils import parse_datetime_param
+
+    parsed = parse_datetime_param(value)
+    if parsed is None:
+        try:
+            day = parse_date(value or '')
+        except ValueError:
+            return None
+        if day is not None:
+            parsed = timezone.make_aware(datetime.combine(day, time.min))
+    return parsed
+
+
+def _version_key(schema_name):
+    return f'vehicle_calendar:{schema_name}:version'
+
+
+def _version(schema_name):
+    version = cache.get(_version_key(schema_name))
+    if version is None:
+        # start from the clock, so a version that was evicted never comes back with an old value;
+        # only the first writer wins, so concurrent readers agree on it
+        cache.add(_version_key(schema_name), time_ns(), None)
+        version = cache.get(_version_key(schema_name), 0)
+    return version
+
+
+def invalidate(schema_name):
+    """Retire every cached calendar of a tenant."""
+    try:
+        cache.incr(_version_key(schema_name))
+    except ValueError:
+        # no version yet: nothing has been cached under it
+        pass
+
+
+def slot_count(start, end, granularity):
+    """Number of slots covering [start, end); the last one may run past `end`."""
+    slot = GRANULARITIES[granularity]
+    return -((start - end) // slot)
+
+
+def occupancy(vehicle_ids, rentals, start, slot, slots):
+    """
+    Busy bitsets for `vehicle_ids` (sorted) over `slots` slots of length `slot`
+    from `start`, given (vehicle_id, rental_start, rental_end) rows. Returns a
+    uint8 array with one row of np.packbits'ed bits per vehicle, slot 0 first.
+    """
+    diff = np.zeros((len(vehicle_ids), slots + 1), dtype=np.int32)
+    rows = list(rentals)
+    if rows and len(vehicle_ids):
+        vehicles = np.array([vehicle_id for vehicle_id, _, _ in rows], dtype=np.int64)
+        starts = np.array([(rental_start - start) / slot for _, rental_start, _ in rows])
+        ends = np.array([(rental_end - start) / slot for _, _, rental_end in rows])
+
+        # rows of vehicles outside the fleet list are dropped
+        positions = np.searchsorted(vehicle_ids, vehicles)
+        known = (positions < len(vehicle_ids)) & (vehicle_ids[np.minimum(positions, len(vehicle_ids) - 1)] == vehicles)
+
+        # slots touched by [rental_start, rental_end), clipped to the window
+        first = np.clip(np.floor(starts), 0, slots).astype(np.int64)
+        last = np.clip(np.ceil(ends), 0, slots).astype(np.int64)
+        keep = known & (first < last)
+
+        # +1 where a booking begins and -1 after it ends; a running sum > 0 means busy
+        np.add.at(diff, (positions[keep], first[keep]), 1)
+        np.add.at(diff, (positions[keep], last[keep]), -1)
+    busy = np.cumsum(diff, axis=1)[:, :slots] > 0
+    return np.packbits(busy, axis=1)
+
+
+def fleet_calendar(start, end, granularity):
+    """
+    {vehicle_id: packed busy bits} for every vehicle of the current tenant over
+    [start, end), from the cache when possible.
+    """
+    from django.db import connection
+    from rentals.models import Rental, rental_period
+    from .models import Vehicle
+
+    schema_name = connection.schema_name
+    cache_key = f'vehicle_calendar:{schema_name}:{_version(schema_name)}:{start.isoformat()}:{end.isoformat()}:{granularity}'
+    calendar = cache.get(cache_key)
+    if calendar is not None:
+        return calendar
+
+    slot = GRANULARITIES[granularity]
+    vehicle_ids = np.array(Vehicle.objects.order_by('id').values_list('id', flat=True), dtype=np.int64)
+    # overlap lookup answered from the rental_vehicle_no_overlap GiST index
+    rentals = Rental.objects.annotate(period=rental_period()).filter(
+        status__in=Rental.BLOCKING_STATUSES,
+        period__overlap=DateTimeTZRange(start, end),
+    ).values_list('vehicle_id', 'rental_start', 'rental_end').iterator(chunk_size=10000)
+    bits = occupancy(vehicle_ids, rentals, start, slot, slot_count(start, end, granularity))
+
+    calendar = {vehicle_id: row.tobytes() for vehicle_id, row in zip(vehicle_ids.tolist(), bits)}
+    cache.set(cache_key, calendar, settings.CALENDAR_CACHE_TTL)
+    return calendar
+
+
+def encode(packed, slots, encoding):
+    """Encode one vehicle's packed bits as base64 ('bitset') or as [first_slot, length] busy runs ('rle')."""
+    if encoding == 'bitset':
+        return base64.b64encode(packed).decode('ascii')
+    busy = np.unpackbits(np.frombuffer(packed, dtype=np.uint8), count=slots).astype(np.int8)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], busy, [0]))))
+    return [[int(first), int(last - first)] for first, last in zip(edges[::2], edges[1::2])]
@@ -1,12 +1,17 @@
 import django_filters
 from .models import Vehicle
 from rest_framework import filters
+from django.db.models import Q
 
 class VehicleFilter(django_filters.FilterSet):
     #filter by a range of years
     year_min = django_filters.NumberFilter(field_name='year', lookup_expr='gte')
     year_max = django_filters.NumberFilter(field_name='year', lookup_expr='lte')
 
+    #filter by a range of daily rates
+    rate_min = django_filters.NumberFilter(field_name='rental_rate_per_day', lookup_expr='gte')
+    rate_max = django_filters.NumberFilter(field_name='rental_rate_per_day', lookup_expr='lte')
+
     #filter by case-insensitive partial match on 'make'
     make = django_filters.CharFilter(lookup_expr='icontains')
 
@@ -21,6 +26,7 @@ class OwnerFilter(filters.BaseFilterBackend):
             return queryset
         # Allow authenticated users to see their own vehicles + public vehicles (owner=None)
         if request.user.is_authenticated:
-            return queryset.filter(owner__in=[request.user, None])
+            # (owner__in=[user, None] would drop the None: SQL IN never matches NULL)
+            return queryset.filter(Q(owner_id=request.user.pk) | Q(owner__isnull=True))
         # For anonymous users, only show vehicles with no owner
         return queryset.filter(owner__isnull=True)
\ No newline at end of file
@@ -0,0 +1,194 @@
+"""
+In-process spatial index used by GET /vehicles/nearby/.
+
+Every tenant gets a grid of its vehicles' last reported positions, loaded
+lazily on first use and kept current by the Vehicle signals in
+vehicles/signals.py (update_status moves a vehicle). Positions are bucketed
+into GEO_CELL_DEGREES cells and stored as NumPy arrays sorted by cell, so a
+query reads the few contiguous cell ranges around the search point and
+computes exact distances only for the vehicles in them.
+"""
+import math
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Great-circle distances in km from (lat, lon) to each of the points (lats, lons), in degrees."""
+    lat, lon = math.radians(lat), math.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GeoIndex:
+    """Vehicle positions of one tenant, searchable by distance."""
+
+    def __init__(self, cell_degrees):
+        self.cell_degrees = cell_degrees
+        self.columns = math.ceil(360 / cell_degrees)
+        self._lock = threading.Lock()
+        # vehicle id -> (latitude, longitude, owner id); the source the arrays are built from
+        self._positions = {}
+        self._arrays = None  # rebuilt lazily after writes
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def load(cls, vehicles, cell_degrees):
+        """Build an index from an iterable of (vehicle_id, latitude, longitude, owner_id)."""
+        index = cls(cell_degrees)
+        for vehicle_id, latitude, longitude, owner_id in vehicles:
+            if latitude is not None and longitude is not None:
+                index._positions[vehicle_id] = (float(latitude), float(longitude), owner_id)
+        return index
+
+    def __len__(self):
+        return len(self._positions)
+
+    def move(self, vehicle_id, latitude, longitude, owner_id):
+        with self._lock:
+            if latitude is None or longitude is None:
+                self._positions.pop(vehicle_id, None)
+            else:
+                self._positions[vehicle_id] = (float(latitude), float(longitude), owner_id)
+            self._arrays = None
+
+    def remove(self, vehicle_id):
+        with self._lock:
+            if self._positions.pop(vehicle_id, None) is not None:
+                self._arrays = None
+
+    def _cells(self, lats, lons):
+        rows = np.floor((np.asarray(lats) + 90) / self.cell_degrees).astype(np.int64)
+        columns = np.floor((np.asarray(lons) + 180) / self.cell_degrees).astype(np.int64) % self.columns
+        return rows * self.columns + columns
+
+    def _build(self):
+        count = len(self._positions)
+        ids = np.fromiter(self._positions.keys(), dtype=np.int64, count=count)
+        values = list(self._positions.values())
+        lats = np.fromiter((lat for lat, _, _ in values), dtype=np.float64, count=count)
+        lons = np.fromiter((lon for _, lon, _ in values), dtype=np.float64, count=count)
+        # owner -1 stands for "no owner" (a public vehicle)
+        owners = np.fromiter((-1 if owner is None else owner for _, _, owner in values), dtype=np.int64, count=count)
+        cells = self._cells(lats, lons)
+        order = np.argsort(cells, kind='stable')
+        return cells[order], ids[order], lats[order], lons[order], owners[order]
+
+    def nearest(self, latitude, longitude, radius_km, limit, exclude=None, owner_ids=None):
+        """
+        Up to `limit` (vehicle_id, distance_km) pairs within radius_km of the point, nearest first.
+        exclude, if given, is called with batches of candidate ids (nearest first) and returns
+        the ones to skip. If owner_ids is given, only vehicles whose owner is in it are returned
+        (None in owner_ids matches vehicles without an owner).
+        """
+        with self._lock:
+            if self._arrays is None:
+                self._arrays = self._build()
+            cells, ids, lats, lons, owners = self._arrays
+
+        #A. Cell ranges covering the bounding box of the search circle
+        lat_span = radius_km / KM_PER_DEGREE
+        first_row = max(0, math.floor((latitude - lat_span + 90) / self.cell_degrees))
+        last_row = min(math.floor(180 / self.cell_degrees), math.floor((latitude + lat_span + 90) / self.cell_degrees))
+        # the box is widest on the edge nearest a pole
+        widest = min(89.999, abs(latitude) + lat_span)
+        lon_span = radius_km / (KM_PER_DEGREE * math.cos(math.radians(widest)))
+        if lon_span >= 180:
+            spans = [(0, self.columns - 1)]
+        else:
+            first_column = math.floor((longitude - lon_span + 180) / self.cell_degrees) % self.columns
+            last_column = math.floor((longitude + lon_span + 180) / self.cell_degrees) % self.columns
+            # a box across the antimeridian wraps around to the first columns
+            spans = [(first_column, last_column)] if first_column <= last_column else [(first_column, self.columns - 1), (0, last_column)]
+
+        slices = []
+        for row in range(first_row, last_row + 1):
+            for first_column, last_column in spans:
+                lo = np.searchsorted(cells, row * self.columns + first_column, side='left')
+                hi = np.searchsorted(cells, row * self.columns + last_column, side='right')
+                if lo < hi:
+                    slices.append(np.arange(lo, hi))
+        if not slices:
+            return []
+        candidates = np.concatenate(slices)
+
+        #B. Exact distances for the candidates inside the circle, owner filter
+        distances = haversine_km(latitude, longitude, lats[candidates], lons[candidates])
+        keep = distances <= radius_km
+        if owner_ids is not None:
+            keep &= np.isin(owners[candidates], [-1 if owner is None else owner for owner in owner_ids])
+        candidates, distances = candidates[keep], distances[keep]
+        order = np.argsort(distances, kind='stable')
+        candidate_ids, distances = ids[candidates[order]].tolist(), distances[order].tolist()
+        if exclude is None:
+            return list(zip(candidate_ids[:limit], distances[:limit]))
+
+        #C. Walk outwards in batches until `limit` vehicles survive exclude()
+        nearest = []
+        batch_size = max(2 * limit, 32)
+        for position in range(0, len(candidate_ids), batch_size):
+            batch = candidate_ids[position:position + batch_size]
+            skipped = exclude(batch)
+            nearest.extend(
+                (vehicle_id, distance)
+                for vehicle_id, distance in zip(batch, distances[position:position + batch_size])
+                if vehicle_id not in skipped
+            )
+            if len(nearest) >= limit:
+                break
+        return nearest[:limit]
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def _load_index():
+    from .models import Vehicle
+
+    vehicles = (
+        Vehicle.objects.filter(latitude__isnull=False, longitude__isnull=False)
+        .values_list('id', 'latitude', 'longitude', 'owner_id')
+        .iterator(chunk_size=10000)
+    )
+    return GeoIndex.load(vehicles, settings.GEO_CELL_DEGREES)
+
+
+def get_index():
+    """Return the spatial index of the current tenant, loading it if needed."""
+    schema_name = connection.schema_name
+    index = _indexes.get(schema_name)
+    # reloaded when stale, like the availability index (vehicles/availability.py)
+    if index is None or time.monotonic() - index.loaded_at > settings.GEO_INDEX_TTL:
+        index = _load_index()
+        with _indexes_lock:
+            _indexes[schema_name] = index
+    return index
+
+
+def vehicle_moved(schema_name, vehicle_id, latitude, longitude, owner_id):
+    """Apply a saved vehicle's position to the tenant's index, if that index is loaded."""
+    index = _indexes.get(schema_name)
+    if index is not None:
+        index.move(vehicle_id, latitude, longitude, owner_id)
+
+
+def vehicle_deleted(schema_name, vehicle_id):
+    """Drop a deleted vehicle from the tenant's index, if that index is loaded."""
+    index = _indexes.get(schema_name)
+    if index is not None:
+        index.remove(vehicle_id)
+
+
+def reset():
+    """Forget every loaded index (they will be reloaded lazily)."""
+    with _indexes_lock:
+        _indexes.clear()
@@ -0,0 +1,137 @@
+"""
+Benchmark GET /vehicles/availability/ lookups: the ORM overlap subquery
+versus the in-memory availability index (vehicles/availability.py).
+
+Synthetic vehicles and rentals are inserted into the given tenant schema
+inside a transaction that is rolled back at the end, unless --keep is passed.
+"""
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from django_tenants.utils import schema_context
+
+from rentals.models import Rental
+from users.models import User
+from vehicles.availability import AvailabilityIndex
+from vehicles.models import Vehicle
+
+STATUSES = ['active', 'confirmed', 'completed', 'completed', 'completed', 'cancelled']
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare the ORM availability query with the in-memory availability index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schema', required=True, help='Tenant schema to run the benchmark in')
+        parser.add_argument('--vehicles', type=int, default=10_000)
+        parser.add_argument('--rentals', type=int, default=1_000_000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic rows instead of rolling them back')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with schema_context(options['schema']):
+            try:
+                with transaction.atomic():
+                    self._run(rng, options)
+                    if not options['keep']:
+                        raise Rollback
+            except Rollback:
+                self.stdout.write('Synthetic data rolled back.')
+
+    def _seed(self, rng, options):
+        start = time.perf_counter()
+        user, _ = User.objects.get_or_create(username='bench-availability', defaults={'email': 'bench-availability@example.com'})
+        Vehicle.objects.bulk_create(
+            [
+                Vehicle(
+                    make=rng.choice(['Toyota', 'Honda', 'Ford', 'BMW', 'Kia']),
+                    model=f'Model {i % 50}',
+                    year=rng.randint(2010, 2025),
+                    license_plate=f'BENCH-{i}',
+                    rental_rate_per_day=rng.randint(20, 200),
+                )
+                for i in range(options['vehicles'])
+            ],
+            batch_size=5000,
+        )
+        vehicle_ids = list(Vehicle.objects.filter(license_plate__startswith='BENCH-').values_list('id', flat=True))
+
+        # rentals spread over two years around now, 1 hour to 14 days long
+        origin = timezone.now() - timedelta(days=365)
+        batch = []
+        for _ in range(options['rentals']):
+            rental_start = origin + timedelta(minutes=rng.randint(0, 2 * 365 * 24 * 60))
+            batch.append(Rental(
+                user=user,
+                vehicle_id=rng.choice(vehicle_ids),
+                rental_start=rental_start,
+                rental_end=rental_start + timedelta(hours=rng.randint(1, 14 * 24)),
+                status=rng.choice(STATUSES),
+            ))
+            if len(batch) == 10_000:
+                Rental.objects.bulk_create(batch)
+                batch = []
+        Rental.objects.bulk_create(batch)
+        self.stdout.write(f'Seeded {len(vehicle_ids)} vehicles and {options["rentals"]} rentals in {time.perf_counter() - start:.1f}s')
+        return origin
+
+    def _run(self, rng, options):
+        origin = self._seed(rng, options)
+        windows = []
+        for _ in range(options['queries']):
+            rental_start = origin + timedelta(minutes=rng.randint(0, 2 * 365 * 24 * 60))
+            windows.append((rental_start, rental_start + timedelta(hours=rng.randint(1, 7 * 24))))
+        page_size = options['page_size']
+
+        # A. the previous ORM path: overlap subquery, whole vehicle table returned
+        start = time.perf_counter()
+        orm_results = []
+        for rental_start, rental_end in windows:
+            busy = Rental.objects.filter(
+                status__in=Rental.BLOCKING_STATUSES,
+                rental_start__lt=rental_end,
+                rental_end__gt=rental_start,
+            ).values_list('vehicle_id', flat=True).distinct()
+            orm_results.append(set(Vehicle.objects.exclude(id__in=busy).values_list('id', flat=True)))
+        orm_seconds = time.perf_counter() - start
+
+        # B. the index: load once, then busy-set lookup + one page of vehicles
+        start = time.perf_counter()
+        index = AvailabilityIndex.load(
+            Rental.objects.filter(status__in=Rental.BLOCKING_STATUSES)
+            .values_list('id', 'vehicle_id', 'rental_start', 'rental_end')
+            .iterator(chunk_size=10000)
+        )
+        load_seconds = time.perf_counter() - start
+
+        all_vehicle_ids = set(Vehicle.objects.values_list('id', flat=True))
+        start = time.perf_counter()
+        busy_sets = [index.busy_vehicle_ids(rental_start, rental_end) for rental_start, rental_end in windows]
+        lookup_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for busy in busy_sets:
+            list(Vehicle.objects.exclude(id__in=busy).order_by('id').values_list('id', flat=True)[:page_size])
+        page_seconds = time.perf_counter() - start
+
+        mismatches = sum(1 for busy, expected in zip(busy_sets, orm_results) if all_vehicle_ids - busy != expected)
+        queries = len(windows)
+        self.stdout.write(f'Indexed intervals: {len(index)} (loaded in {load_seconds * 1000:.0f} ms)')
+        self.stdout.write(f'ORM path:          {orm_seconds / queries * 1000:8.2f} ms/query')
+        self.stdout.write(f'Index lookup:      {lookup_seconds / queries * 1000:8.3f} ms/query')
+        self.stdout.write(f'Index + page:      {(lookup_seconds + page_seconds) / queries * 1000:8.2f} ms/query')
+        if mismatches:
+            self.stderr.write(self.style.ERROR(f'{mismatches} windows disagree with the ORM path'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Index results match the ORM path'))
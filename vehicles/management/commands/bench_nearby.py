@@ -0,0 +1,159 @@
+"""
+Benchmark GET /vehicles/nearby/ lookups: the spatial grid index
+(vehicles/geo.py) against a brute-force distance scan of the whole fleet.
+
+Synthetic vehicles and rentals are inserted into the given tenant schema
+inside a transaction that is rolled back at the end, unless --keep is passed.
+"""
+import random
+import time
+from datetime import timedelta
+from functools import partial
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from django_tenants.utils import schema_context
+
+from rentals.models import Rental
+from users.models import User
+from vehicles.availability import AvailabilityIndex
+from vehicles.geo import GeoIndex, haversine_km
+from vehicles.models import Vehicle
+from vehicles.serializers import VehicleSeializer
+
+# vehicles are scattered around these cities, most of them within ~30 km
+CITIES = [(-1.2921, 36.8219), (51.5072, -0.1276), (40.7128, -74.0060), (-33.8688, 151.2093), (64.1466, -21.9426)]
+STATUSES = ['active', 'confirmed', 'completed', 'cancelled']
+TARGET_MS = 20
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure nearest-available-vehicle lookups against the spatial grid index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schema', required=True, help='Tenant schema to run the benchmark in')
+        parser.add_argument('--vehicles', type=int, default=50_000)
+        parser.add_argument('--rentals', type=int, default=100_000)
+        parser.add_argument('--queries', type=int, default=500)
+        parser.add_argument('--radius', type=float, default=25, help='Search radius in km')
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic rows instead of rolling them back')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with schema_context(options['schema']):
+            try:
+                with transaction.atomic():
+                    self._run(rng, options)
+                    if not options['keep']:
+                        raise Rollback
+            except Rollback:
+                self.stdout.write('Synthetic data rolled back.')
+
+    def _point(self, rng):
+        latitude, longitude = rng.choice(CITIES)
+        return latitude + rng.gauss(0, 0.2), longitude + rng.gauss(0, 0.3)
+
+    def _seed(self, rng, options):
+        start = time.perf_counter()
+        user, _ = User.objects.get_or_create(username='bench-nearby', defaults={'email': 'bench-nearby@example.com'})
+        vehicles = []
+        for i in range(options['vehicles']):
+            latitude, longitude = self._point(rng)
+            vehicles.append(Vehicle(
+                make=rng.choice(['Toyota', 'Honda', 'Ford', 'BMW', 'Kia']),
+                model=f'Model {i % 50}',
+                year=rng.randint(2010, 2025),
+                license_plate=f'NEAR-{i}',
+                rental_rate_per_day=rng.randint(20, 200),
+                latitude=round(latitude, 6),
+                longitude=round(longitude, 6),
+            ))
+        Vehicle.objects.bulk_create(vehicles, batch_size=5000)
+        vehicle_ids = list(Vehicle.objects.filter(license_plate__startswith='NEAR-').values_list('id', flat=True))
+
+        # one-day rentals over the next 30 days, at most one per vehicle and day
+        origin = timezone.now()
+        booked = set()
+        rentals = []
+        for _ in range(options['rentals']):
+            vehicle_id, day = rng.choice(vehicle_ids), rng.randrange(30)
+            if (vehicle_id, day) in booked:
+                continue
+            booked.add((vehicle_id, day))
+            rental_start = origin + timedelta(days=day)
+            rentals.append(Rental(user=user, vehicle_id=vehicle_id, rental_start=rental_start, rental_end=rental_start + timedelta(hours=20), status=rng.choice(STATUSES)))
+        Rental.objects.bulk_create(rentals, batch_size=10_000)
+        # fresh planner statistics, so the page query uses the primary key index
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Vehicle._meta.db_table}')
+        self.stdout.write(f'Seeded {len(vehicle_ids)} vehicles and {len(rentals)} rentals in {time.perf_counter() - start:.1f}s')
+        return origin
+
+    def _run(self, rng, options):
+        origin = self._seed(rng, options)
+        radius, limit = options['radius'], options['limit']
+        queries = []
+        for _ in range(options['queries']):
+            rental_start = origin + timedelta(days=rng.randrange(30), hours=2)
+            queries.append((*self._point(rng), rental_start, rental_start + timedelta(hours=6)))
+
+        #A. Load both indexes once
+        start = time.perf_counter()
+        index = GeoIndex.load(Vehicle.objects.values_list('id', 'latitude', 'longitude', 'owner_id').iterator(chunk_size=10000), 0.1)
+        availability = AvailabilityIndex.load(
+            Rental.objects.filter(status__in=Rental.BLOCKING_STATUSES)
+            .values_list('id', 'vehicle_id', 'rental_start', 'rental_end')
+            .iterator(chunk_size=10000)
+        )
+        index.nearest(0, 0, 1, 1)  # builds the sorted arrays
+        load_seconds = time.perf_counter() - start
+
+        #B. Brute force: distance to every vehicle, then the filters
+        rows = list(Vehicle.objects.filter(latitude__isnull=False).values_list('id', 'latitude', 'longitude'))
+        ids = np.array([row[0] for row in rows])
+        lats = np.array([float(row[1]) for row in rows])
+        lons = np.array([float(row[2]) for row in rows])
+        expected = []
+        start = time.perf_counter()
+        for latitude, longitude, rental_start, rental_end in queries:
+            busy = availability.busy_vehicle_ids(rental_start, rental_end)
+            distances = haversine_km(latitude, longitude, lats, lons)
+            keep = (distances <= radius) & ~np.isin(ids, list(busy))
+            order = np.argsort(distances[keep], kind='stable')[:limit]
+            expected.append(ids[keep][order].tolist())
+        brute_seconds = time.perf_counter() - start
+
+        #C. The endpoint's path: grid lookup skipping booked candidates, then load and serialize the k vehicles
+        lookup_times, endpoint_times, mismatches = [], [], 0
+        queryset = Vehicle.objects.select_related('rating_summary')
+        for (latitude, longitude, rental_start, rental_end), want in zip(queries, expected):
+            start = time.perf_counter()
+            exclude = partial(availability.busy_among, rental_start=rental_start, rental_end=rental_end)
+            nearest = index.nearest(latitude, longitude, radius, limit, exclude=exclude)
+            lookup_times.append(time.perf_counter() - start)
+            vehicles = queryset.in_bulk([vehicle_id for vehicle_id, _ in nearest])
+            VehicleSeializer([vehicles[vehicle_id] for vehicle_id, _ in nearest], many=True).data
+            endpoint_times.append(time.perf_counter() - start)
+            if [vehicle_id for vehicle_id, _ in nearest] != want:
+                mismatches += 1
+
+        lookup_ms = np.array(lookup_times) * 1000
+        endpoint_ms = np.array(endpoint_times) * 1000
+        self.stdout.write(f'Indexed vehicles:  {len(index)} (indexes loaded in {load_seconds * 1000:.0f} ms)')
+        self.stdout.write(f'Brute force scan:  {brute_seconds / len(queries) * 1000:8.2f} ms/query')
+        self.stdout.write(f'Grid lookup:       p50 {np.percentile(lookup_ms, 50):6.2f} ms  p95 {np.percentile(lookup_ms, 95):6.2f} ms')
+        self.stdout.write(f'Lookup + page:     p50 {np.percentile(endpoint_ms, 50):6.2f} ms  p95 {np.percentile(endpoint_ms, 95):6.2f} ms')
+        if mismatches:
+            self.stderr.write(self.style.ERROR(f'{mismatches} queries disagree with the brute-force scan'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Grid results match the brute-force scan'))
+        if np.percentile(endpoint_ms, 95) > TARGET_MS:
+            self.stderr.write(self.style.WARNING(f'p95 is above the {TARGET_MS} ms target'))
@@ -0,0 +1,143 @@
+"""
+Benchmark GET /vehicles/search/ (trigram index, vehicles/search.py) against
+the SearchFilter query the vehicle list builds from search_fields
+(make, model and year, each an ILIKE '%term%').
+
+Synthetic vehicles are inserted into the given tenant schema inside a
+transaction that is rolled back at the end, unless --keep is passed.
+"""
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django_tenants.utils import schema_context
+from rest_framework.filters import SearchFilter
+from rest_framework.request import Request
+
+from vehicles.models import Vehicle
+from vehicles.search import search
+from vehicles.views import VehicleListView
+
+MODELS = {
+    'Toyota': ['Corolla', 'Camry', 'Prado', 'Hilux', 'Vitz', 'Harrier', 'RAV4', 'Land Cruiser'],
+    'Honda': ['Civic', 'Accord', 'Fit', 'CR-V', 'Vezel'],
+    'Ford': ['Focus', 'Fiesta', 'Ranger', 'Mustang', 'Explorer'],
+    'BMW': ['X5', 'X3', '320i', '530d'],
+    'Mercedes-Benz': ['C200', 'E300', 'GLE', 'Sprinter'],
+    'Nissan': ['Note', 'X-Trail', 'Navara', 'Leaf', 'Sunny'],
+    'Subaru': ['Forester', 'Outback', 'Impreza', 'Legacy'],
+    'Volkswagen': ['Golf', 'Polo', 'Passat', 'Tiguan', 'Touareg'],
+    'Mazda': ['Demio', 'Axela', 'Atenza', 'CX-5'],
+    'Kia': ['Sportage', 'Sorento', 'Picanto', 'Rio'],
+}
+# what people type: whole words, prefixes while typing, make + model, plate fragments
+PREFIX_QUERIES = [
+    'toyota', 'corolla', 'toy', 'cor', 'hon', 'subaru forester', 'toyota land', 'nissan x-tr',
+    'ford ranger', 'vw', 'mazda cx', 'camry 2018', 'kca 1', 'kdb 42', 'mercedes', 'tig',
+]
+# misspellings, which are corrected against the make/model vocabulary
+TYPO_QUERIES = ['toyta', 'forrester', 'subaro', 'mercedez', 'corola']
+# for the as-you-type (prefix) queries
+TARGET_MS = 20
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure vehicle search against the trigram index and the current SearchFilter'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schema', required=True, help='Tenant schema to run the benchmark in')
+        parser.add_argument('--vehicles', type=int, default=100_000)
+        parser.add_argument('--rounds', type=int, default=10, help='Times every query is repeated')
+        parser.add_argument('--limit', type=int, default=20, help='Results per query (one page)')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic rows instead of rolling them back')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with schema_context(options['schema']):
+            try:
+                with transaction.atomic():
+                    self._run(rng, options)
+                    if not options['keep']:
+                        raise Rollback
+            except Rollback:
+                self.stdout.write('Synthetic data rolled back.')
+
+    def _seed(self, rng, options):
+        start = time.perf_counter()
+        vehicles = []
+        for i in range(options['vehicles']):
+            make = rng.choice(list(MODELS))
+            vehicles.append(Vehicle(
+                make=make,
+                model=rng.choice(MODELS[make]),
+                year=rng.randint(2005, 2025),
+                # plates look like "KCA 123B"; the index suffix keeps them unique
+                license_plate=f'K{rng.choice("ABCD")}{rng.choice("ABCDEFGH")} {rng.randint(100, 999)}{chr(65 + i % 26)}-{i}',
+                rental_rate_per_day=rng.randint(20, 200),
+            ))
+        Vehicle.objects.bulk_create(vehicles, batch_size=5000)
+        # fresh planner statistics, so both queries get realistic plans
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Vehicle._meta.db_table}')
+        self.stdout.write(f'Seeded {len(vehicles)} vehicles in {time.perf_counter() - start:.1f}s')
+
+    def _time(self, run, queries, rounds):
+        times = []
+        for _ in range(rounds):
+            for query in queries:
+                start = time.perf_counter()
+                run(query)
+                times.append(time.perf_counter() - start)
+        return np.array(times) * 1000
+
+    def _run(self, rng, options):
+        self._seed(rng, options)
+        limit, rounds = options['limit'], options['rounds']
+        queryset = Vehicle.objects.all()
+
+        #A. The current list search: SearchFilter over search_fields, first page by id
+        view, backend, factory = VehicleListView(), SearchFilter(), RequestFactory()
+
+        def search_filter(query):
+            request = Request(factory.get('/vehicles/', {'search': query}))
+            return list(backend.filter_queryset(request, queryset, view).order_by('id')[:limit])
+
+        #B. The trigram search behind /vehicles/search/
+        def trigram_search(query):
+            return search(queryset, query, limit)
+
+        filter_ms = self._time(search_filter, PREFIX_QUERIES + TYPO_QUERIES, rounds)
+        search_ms = self._time(trigram_search, PREFIX_QUERIES, rounds)
+        typo_ms = self._time(trigram_search, TYPO_QUERIES, rounds)
+
+        # what each approach finds for a few queries (plates and misspellings only match in the new search)
+        for query in ['toy', 'toyota land', 'kca 1', 'forrester', 'corola']:
+            request = Request(factory.get('/vehicles/', {'search': query}))
+            self.stdout.write(
+                f'  {query!r:15} SearchFilter {backend.filter_queryset(request, queryset, view).count():6} matches  '
+                f'search {len(search(queryset, query, limit)):3} results (limit {limit})'
+            )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'EXPLAIN SELECT id FROM {Vehicle._meta.db_table} WHERE search_document LIKE %s',
+                ['% toyota% land%'],
+            )
+            uses_index = any('vehicle_search_trgm_idx' in row[0] for row in cursor.fetchall())
+
+        self.stdout.write(f'SearchFilter (all queries):    p50 {np.percentile(filter_ms, 50):7.2f} ms  p95 {np.percentile(filter_ms, 95):7.2f} ms')
+        self.stdout.write(f'Search (prefix queries):       p50 {np.percentile(search_ms, 50):7.2f} ms  p95 {np.percentile(search_ms, 95):7.2f} ms')
+        self.stdout.write(f'Search (misspelled queries):   p50 {np.percentile(typo_ms, 50):7.2f} ms  p95 {np.percentile(typo_ms, 95):7.2f} ms')
+        if uses_index:
+            self.stdout.write(self.style.SUCCESS('Search queries use vehicle_search_trgm_idx'))
+        else:
+            self.stderr.write(self.style.ERROR('Search queries do not use vehicle_search_trgm_idx; is migration 0006 applied?'))
+        if np.percentile(search_ms, 95) > TARGET_MS:
+            self.stderr.write(self.style.WARNING(f'p95 is above the {TARGET_MS} ms target'))
@@ -0,0 +1,100 @@
+"""
+Management command to maintain the monthly partitions of the telemetry table.
+Creates the partitions from --months-back months ago to --months-ahead months
+from now in every tenant schema (readings that already landed in the default
+partition for those months are moved into them), and with --retain-months
+drops the partitions that ended more than that many months ago.
+Run it at least monthly (the web container runs it at startup).
+"""
+import re
+from datetime import date, datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django_tenants.utils import get_public_schema_name, get_tenant_model, schema_context
+
+from vehicles.models import TelemetryReading
+
+PARTITION_NAME = re.compile(r'_y(\d{4})m(\d{2})$')
+
+
+def add_months(month, count):
+    """The first day of the month `count` months after `month` (a date on the 1st)."""
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+class Command(BaseCommand):
+    help = 'Create upcoming monthly telemetry partitions (and drop expired ones) for one tenant or all tenants'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--schema', help='Tenant schema to maintain. If omitted, every tenant is maintained.')
+        parser.add_argument('--months-ahead', type=int, default=3, help='Create partitions up to this many months ahead.')
+        parser.add_argument('--months-back', type=int, default=0, help='Also create partitions for this many past months.')
+        parser.add_argument(
+            '--retain-months', type=int, default=0,
+            help='Drop partitions that ended more than this many months ago (0 keeps everything).',
+        )
+
+    def handle(self, *args, **options):
+        schema = options.get('schema')
+        tenants = get_tenant_model().objects.exclude(schema_name=get_public_schema_name())
+        if schema:
+            tenants = tenants.filter(schema_name=schema)
+            if not tenants.exists():
+                raise CommandError(f'Tenant not found: {schema}')
+
+        this_month = timezone.localdate().replace(day=1)
+        months = [add_months(this_month, offset) for offset in range(-options['months_back'], options['months_ahead'] + 1)]
+        for schema_name in tenants.values_list('schema_name', flat=True):
+            with schema_context(schema_name):
+                created = [name for name in (self._create_partition(month) for month in months) if name]
+                dropped = self._drop_partitions(add_months(this_month, -options['retain_months'])) if options['retain_months'] else []
+            self.stdout.write(self.style.SUCCESS(
+                f'{schema_name}: created {len(created)} telemetry partitions, dropped {len(dropped)}'
+            ))
+
+    def _create_partition(self, month):
+        """Create the partition of one month unless it exists. Returns its name if it was created."""
+        table = TelemetryReading._meta.db_table
+        name = f'{table}_y{month.year}m{month.month:02d}'
+        quote = connection.ops.quote_name
+        bounds = [timezone.make_aware(datetime.combine(day, time.min)) for day in (month, add_months(month, 1))]
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('SELECT to_regclass(%s)', [f'{connection.schema_name}.{name}'])
+            if cursor.fetchone()[0] is not None:
+                return None
+            # rows of this month that arrived before the partition existed sit in the default partition
+            cursor.execute(f'LOCK TABLE {quote(table + "_default")} IN SHARE ROW EXCLUSIVE MODE')
+            cursor.execute(f'CREATE TABLE {quote(name)} (LIKE {quote(table)} INCLUDING DEFAULTS)')
+            cursor.execute(
+                f'WITH moved AS (DELETE FROM {quote(table + "_default")} WHERE recorded_at >= %s AND recorded_at < %s RETURNING *) '
+                f'INSERT INTO {quote(name)} SELECT * FROM moved',
+                bounds,
+            )
+            cursor.execute(f'ALTER TABLE {quote(table)} ATTACH PARTITION {quote(name)} FOR VALUES FROM (%s) TO (%s)', bounds)
+        return name
+
+    def _drop_partitions(self, before):
+        """Drop the monthly partitions that end on or before `before`. Returns their names."""
+        table = TelemetryReading._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT child.relname FROM pg_inherits '
+                'JOIN pg_class parent ON parent.oid = pg_inherits.inhparent '
+                'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+                'JOIN pg_namespace ON pg_namespace.oid = parent.relnamespace '
+                'WHERE parent.relname = %s AND pg_namespace.nspname = %s',
+                [table, connection.schema_name],
+            )
+            partitions = [row[0] for row in cursor.fetchall()]
+
+        dropped = []
+        for name in sorted(partitions):
+            match = PARTITION_NAME.search(name)
+            if match and add_months(date(int(match[1]), int(match[2]), 1), 1) <= before:
+                with connection.cursor() as cursor:
+                    cursor.execute(f'DROP TABLE {connection.ops.quote_name(name)}')
+                dropped.append(name)
+        return dropped
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicles', '0004_vehicle_coordinates'),
+    ]
+
+    operations = [
+        # Django sees an ordinary model; the database gets a table range-partitioned by
+        # month on recorded_at, whose primary key has to include the partition key.
+        # Monthly partitions are added by the create_telemetry_partitions command; rows
+        # outside every partition land in the default one.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='TelemetryReading',
+                    fields=[
+                        ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                        ('recorded_at', models.DateTimeField()),
+                        ('current_mileage', models.IntegerField(blank=True, null=True)),
+                        ('fuel_level', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                        ('latitude', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                        ('longitude', models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True)),
+                        ('vehicle', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='telemetry_readings', to='vehicles.vehicle')),
+                    ],
+                    options={
+                        'indexes': [models.Index(fields=['vehicle', 'recorded_at'], name='telemetry_vehicle_time_idx')],
+                    },
+                ),
+            ],
+            database_operations=[
+                migrations.RunSQL(
+                    sql=[
+                        """
+                        CREATE TABLE vehicles_telemetryreading (
+                            id bigint GENERATED BY DEFAULT AS IDENTITY,
+                            vehicle_id integer NOT NULL REFERENCES vehicles_vehicle (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,
+                            recorded_at timestamp with time zone NOT NULL,
+                            current_mileage integer NULL,
+                            fuel_level numeric(5, 2) NULL,
+                            latitude numeric(9, 6) NULL,
+                            longitude numeric(9, 6) NULL,
+                            PRIMARY KEY (id, recorded_at)
+                        ) PARTITION BY RANGE (recorded_at)
+                        """,
+                        'CREATE TABLE vehicles_telemetryreading_default PARTITION OF vehicles_telemetryreading DEFAULT',
+                        'CREATE INDEX telemetry_vehicle_time_idx ON vehicles_telemetryreading (vehicle_id, recorded_at)',
+                    ],
+                    reverse_sql='DROP TABLE vehicles_telemetryreading',
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-18 21:01
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # build the index without blocking writes to large vehicle tables
+    # (adding the stored column still rewrites the table once)
+    atomic = False
+
+    dependencies = [
+        ('vehicles', '0005_telemetry_reading'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # pg_trgm provides gin_trgm_ops. Extensions are database-wide, so install it in the
+        # public schema that every tenant's search_path includes.
+        migrations.RunSQL(
+            'CREATE EXTENSION IF NOT EXISTS pg_trgm SCHEMA public',
+            migrations.RunSQL.noop,
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='search_document',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.text.Concat(models.Value(' '), django.db.models.functions.text.Lower(django.db.models.functions.text.Concat('make', models.Value(' '), 'model', models.Value(' '), 'license_plate', models.Value(' '), django.db.models.functions.comparison.Cast('year', models.CharField()))), output_field=models.CharField()), output_field=models.TextField()),
+        ),
+        AddIndexConcurrently(
+            model_name='vehicle',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass('search_document', name='gin_trgm_ops'), name='vehicle_search_trgm_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vehicles', '0007_table_version'),
+    ]
+
+    operations = [
+        # An identity column is copied onto the default partition when a tenant is cloned
+        # from a template schema (create_tenants --template-schema), and Postgres refuses
+        # to attach a partition with an identity column of its own. A sequence default is
+        # cloned along with the table instead, as serial columns are.
+        migrations.RunSQL(
+            sql=[
+                'ALTER TABLE vehicles_telemetryreading ALTER COLUMN id DROP IDENTITY',
+                'CREATE SEQUENCE vehicles_telemetryreading_id_seq OWNED BY vehicles_telemetryreading.id',
+                "ALTER TABLE vehicles_telemetryreading ALTER COLUMN id SET DEFAULT nextval('vehicles_telemetryreading_id_seq')",
+                "SELECT setval('vehicles_telemetryreading_id_seq', COALESCE(MAX(id), 0) + 1, false) FROM vehicles_telemetryreading",
+            ],
+            reverse_sql=[
+                'ALTER TABLE vehicles_telemetryreading ALTER COLUMN id DROP DEFAULT',
+                'DROP SEQUENCE vehicles_telemetryreading_id_seq',
+                'ALTER TABLE vehicles_telemetryreading ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY',
+                "SELECT setval(pg_get_serial_sequence('vehicles_telemetryreading', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM vehicles_telemetryreading",
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+import django.contrib.postgres.indexes
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+from django.contrib.postgres.operations import AddIndexConcurrently, RemoveIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # as in 0006: rebuild the index without blocking writes to large vehicle tables
+    atomic = False
+
+    dependencies = [
+        ('vehicles', '0008_telemetry_reading_id_sequence'),
+    ]
+
+    operations = [
+        # a generated column can't change its expression: drop it (with its index) and add it back
+        # with hyphens read as spaces, so "mercedes benz" finds a Mercedes-Benz
+        RemoveIndexConcurrently(
+            model_name='vehicle',
+            name='vehicle_search_trgm_idx',
+        ),
+        migrations.RemoveField(
+            model_name='vehicle',
+            name='search_document',
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='search_document',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.text.Concat(models.Value(' '), django.db.models.functions.text.Replace(django.db.models.functions.text.Lower(django.db.models.functions.text.Concat('make', models.Value(' '), 'model', models.Value(' '), 'license_plate', models.Value(' '), django.db.models.functions.comparison.Cast('year', models.CharField()))), models.Value('-'), models.Value(' ')), output_field=models.CharField()), output_field=models.TextField()),
+        ),
+        AddIndexConcurrently(
+            model_name='vehicle',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass('search_document', name='gin_trgm_ops'), name='vehicle_search_trgm_idx'),
+        ),
+    ]
@@ -1,5 +1,9 @@
 from django.db import models
 from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.core.validators import MinValueValidator, MaxValueValidator
+
+from .search import document_expression
 
 class Vehicle(models.Model):
     id = models.AutoField(primary_key=True)
@@ -20,6 +24,50 @@ class Vehicle(models.Model):
     current_mileage = models.IntegerField(null=True, blank=True)
     fuel_level = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
     current_location = models.DecimalField(max_digits=255, decimal_places=6, null=True, blank=True)
+    # last reported position (WGS 84 degrees), indexed by vehicles/geo.py for GET /vehicles/nearby/
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True, validators=[MinValueValidator(-90), MaxValueValidator(90)])
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True, validators=[MinValueValidator(-180), MaxValueValidator(180)])
+
+    # make, model, plate and year as one lower-case string, searched by GET /vehicles/search/ (vehicles/search.py)
+    search_document = models.GeneratedField(expression=document_expression(), output_field=models.TextField(), db_persist=True)
+
+    class Meta:
+        indexes = [
+            GinIndex(OpClass('search_document', name='gin_trgm_ops'), name='vehicle_search_trgm_idx'),
+        ]
 
     def __str__(self):
         return f"{self.make} {self.model} ({self.license_plate})"
+
+
+# Append-only telemetry history, one row per reported reading.
+# The table is range-partitioned by month on recorded_at (see migration 0005 and the
+# create_telemetry_partitions command), so its primary key is (id, recorded_at) in the
+# database; Django only ever inserts rows and reads them by vehicle and time range.
+class TelemetryReading(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    # ON DELETE CASCADE is done by the database: collecting a vehicle's whole history in Python would not scale
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.DO_NOTHING, related_name='telemetry_readings')
+    recorded_at = models.DateTimeField()
+    current_mileage = models.IntegerField(null=True, blank=True)
+    fuel_level = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['vehicle', 'recorded_at'], name='telemetry_vehicle_time_idx'),
+        ]
+
+    def __str__(self):
+        return f'Telemetry for Vehicle {self.vehicle_id} at {self.recorded_at}'
+
+
+# Write counter of a tenant table, bumped on commit by every change to it. Read-only
+# endpoints derive their ETags from these (see CarRentalService/conditional.py).
+class TableVersion(models.Model):
+    table = models.CharField(max_length=100, primary_key=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.table} v{self.version}'
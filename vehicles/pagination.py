@@ -0,0 +1,8 @@
+from rest_framework.pagination import PageNumberPagination
+
+
+class AvailabilityPagination(PageNumberPagination):
+    """Page through the vehicles returned by GET /vehicles/availability/."""
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
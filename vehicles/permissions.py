@@ -6,4 +6,4 @@ class IsOwnerOrAdmin(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.user.is_staff or request.user.is_superuser:
             return True
-        return obj.owner == request.user
\ No newline at end of file
+        return obj.owner_id == request.user.pk
\ No newline at end of file
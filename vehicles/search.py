@@ -0,0 +1,120 @@
+"""
+Vehicle search behind GET /vehicles/search/?q=.
+
+Every vehicle stores a search document, ' ' || lower(make || ' ' || model
+|| ' ' || license_plate || ' ' || year) with hyphens read as spaces (so
+"mercedes benz" finds a Mercedes-Benz), as a generated column that
+Postgres keeps current on every write, covered by a trigram GIN index
+(vehicle_search_trgm_idx, migration 0006). Every query term has to start a
+word of the document (LIKE '% term%', which the index answers), so
+"toy cor" finds a Toyota Corolla while it is being typed. Matches rank by
+where the first term starts (make before model before plate), then by
+document length.
+
+When that leaves the page short, misspelled make/model words are corrected
+against the tenant's vocabulary of make and model words (a few hundred,
+kept in memory for VEHICLE_SEARCH_VOCABULARY_TTL seconds) and the search is
+repeated with the corrections: comparing a term with the vocabulary is much
+cheaper than a trigram similarity scan over every vehicle.
+"""
+import re
+import threading
+import time
+from difflib import get_close_matches
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat, Length, Lower, Replace, StrIndex
+
+# terms beyond this many are ignored; every term is one more index condition
+MAX_TERMS = 5
+# shorter terms are too short to tell a typo from another word
+MIN_FUZZY_LENGTH = 4
+# how close (difflib ratio) a vocabulary word has to be to replace a term
+SIMILARITY_CUTOFF = 0.75
+
+
+def document_expression():
+    """What Vehicle.search_document is generated from. The leading space makes every word start with ' '."""
+    return Concat(
+        Value(' '),
+        Replace(Lower(Concat('make', Value(' '), 'model', Value(' '), 'license_plate', Value(' '), Cast('year', CharField()))), Value('-'), Value(' ')),
+        output_field=CharField(),
+    )
+
+
+def parse_terms(query):
+    """Lower-cased terms of a query, split on whitespace and hyphens as the document is, without LIKE wildcards."""
+    return re.sub(r'[%_\\-]', ' ', query.lower()).split()[:MAX_TERMS]
+
+
+def is_fuzzy(term):
+    """Whether a term may be corrected. Years and plate fragments must match exactly."""
+    return len(term) >= MIN_FUZZY_LENGTH and not any(char.isdigit() for char in term)
+
+
+_vocabularies = {}
+_vocabularies_lock = threading.Lock()
+
+
+def get_vocabulary():
+    """Make and model words of the current tenant, loading them if needed."""
+    from .models import Vehicle
+
+    schema_name = connection.schema_name
+    loaded = _vocabularies.get(schema_name)
+    # reloaded when stale, like the availability index (vehicles/availability.py)
+    if loaded is None or time.monotonic() - loaded[0] > settings.VEHICLE_SEARCH_VOCABULARY_TTL:
+        words = set()
+        for make, model in Vehicle.objects.values_list('make', 'model').distinct().iterator():
+            words.update(re.findall(r'[^\W_]+', f'{make} {model}'.lower()))
+        loaded = (time.monotonic(), sorted(words))
+        with _vocabularies_lock:
+            _vocabularies[schema_name] = loaded
+    return loaded[1]
+
+
+def correct(terms):
+    """The terms, with misspelled make/model words replaced by the closest vocabulary word."""
+    if not any(is_fuzzy(term) for term in terms):
+        return terms
+    vocabulary = get_vocabulary()
+    return [
+        next(iter(get_close_matches(term, vocabulary, n=1, cutoff=SIMILARITY_CUTOFF)), term) if is_fuzzy(term) else term
+        for term in terms
+    ]
+
+
+def _prefix_matches(queryset, terms, limit):
+    for term in terms:
+        queryset = queryset.filter(search_document__contains=f' {term}')
+    return list(
+        queryset.annotate(position=StrIndex('search_document', Value(f' {terms[0]}')))
+        .order_by('position', Length('search_document'), 'id')[:limit]
+    )
+
+
+def search(queryset, query, limit):
+    """Up to `limit` vehicles of `queryset` matching every term of `query`, best match first."""
+    terms = parse_terms(query)
+    if not terms:
+        return []
+
+    #A. Every term starts a word of the document
+    vehicles = _prefix_matches(queryset, terms, limit)
+    if len(vehicles) == limit:
+        return vehicles
+
+    #B. Fill up with the matches of the corrected spelling, if any term was corrected
+    corrected = correct(terms)
+    if corrected == terms:
+        return vehicles
+    queryset = queryset.exclude(id__in=[vehicle.id for vehicle in vehicles])
+    return vehicles + _prefix_matches(queryset, corrected, limit - len(vehicles))
+
+
+def reset():
+    """Forget every loaded vocabulary (they will be reloaded lazily)."""
+    with _vocabularies_lock:
+        _vocabularies.clear()
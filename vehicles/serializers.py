@@ -1,18 +1,23 @@
 from .models import Vehicle
 from rest_framework import serializers
-from rentals.models import Rental, Review
-from django.db.models import Avg
+from rentals.models import VehicleRating
 
 class VehicleSeializer(serializers.ModelSerializer):
     average_rating = serializers.SerializerMethodField()
 
     class Meta:
         model = Vehicle
-        fields = ['id', 'make', 'model', 'year', 'license_plate', 'rental_rate_per_day', 'availability_status', 'current_mileage', 'fuel_level', 'current_location', 'average_rating']
+        fields = ['id', 'make', 'model', 'year', 'license_plate', 'rental_rate_per_day', 'availability_status', 'current_mileage', 'fuel_level', 'current_location', 'latitude', 'longitude', 'average_rating']
+
+    # average_rating of values() rows, for the list endpoints (CarRentalService/values_serializers.py)
+    values_method_fields = {
+        'average_rating': (['rating_summary__review_count', 'rating_summary__rating_sum'], VehicleRating.average),
+    }
 
     def get_average_rating(self, obj):
-        #get all completed rentals for this vehicle
-        rental_ids = Rental.objects.filter(vehicle=obj, status='completed').values_list('pk', flat=True)
-        #calculate average rating from reviews linked to these rentals
-        avg_rating = Review.objects.filter(rental__in=rental_ids).aggregate(Avg('rating'))['rating__avg']
-        return round(avg_rating, 2) if avg_rating is not None else 0.0
\ No newline at end of file
+        # read the denormalized aggregate kept current by rentals/signals.py
+        # (views select_related('rating_summary') so this costs no extra query)
+        try:
+            return obj.rating_summary.average_rating
+        except VehicleRating.DoesNotExist:
+            return 0.0
@@ -0,0 +1,39 @@
+from .models import Vehicle
+from . import geo
+from CarRentalService import conditional
+from django.db import connection, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from functools import partial
+
+
+# --- Spatial index (vehicles/geo.py) ---
+# applied on commit so a rolled back move never shows up in /vehicles/nearby/
+
+@receiver(post_save, sender=Vehicle)
+def update_geo_index_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    transaction.on_commit(partial(
+        geo.vehicle_moved,
+        connection.schema_name,
+        instance.pk,
+        instance.latitude,
+        instance.longitude,
+        instance.owner_id,
+    ))
+
+
+@receiver(post_delete, sender=Vehicle)
+def update_geo_index_on_delete(sender, instance, **kwargs):
+    transaction.on_commit(partial(geo.vehicle_deleted, connection.schema_name, instance.pk))
+
+
+# --- ETags of the vehicle read endpoints (CarRentalService/conditional.py) ---
+
+@receiver(post_save, sender=Vehicle)
+@receiver(post_delete, sender=Vehicle)
+def bump_vehicle_version(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    conditional.bump(Vehicle)
@@ -0,0 +1,320 @@
+"""
+Vehicle telemetry (mileage, fuel level, position) ingested by POST /vehicles/telemetry/.
+
+Readings are validated on the request path and put into an in-process
+buffer that keeps only the latest value of each field per vehicle (and
+every reading, for the append-only TelemetryReading history). A
+background thread flushes the buffer every TELEMETRY_FLUSH_INTERVAL seconds
+(or as soon as TELEMETRY_MAX_PENDING vehicles are waiting): vehicles are
+grouped by the set of columns they changed and written with one UPDATE per
+group (update_columns), so each statement only touches the reported columns. A
+worker that exits writes its buffer first. Telemetry is lossy by nature: a
+worker that dies drops at most one window of readings, and the next report
+supersedes it anyway.
+
+GET /vehicles/{id}/telemetry/ reads the history back through downsample().
+"""
+import atexit
+import logging
+import math
+import threading
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Avg, Count, DateTimeField, F, Func, Max, Min, Value
+from django.utils import timezone
+from django_tenants.utils import schema_context
+
+from CarRentalService import conditional
+
+logger = logging.getLogger(__name__)
+
+# TelemetryReading columns returned by downsample() -> decimal places kept in averages
+HISTORY_FIELDS = {'current_mileage': 1, 'fuel_level': 2, 'latitude': 6, 'longitude': 6}
+
+# buffered field -> the Vehicle columns it writes ('position' keeps latitude and longitude together)
+FIELD_COLUMNS = {
+    'current_mileage': ('current_mileage',),
+    'fuel_level': ('fuel_level',),
+    'position': ('latitude', 'longitude'),
+}
+
+
+def parse_reading(reading):
+    """
+    Validate one reading ({"vehicle_id": 1, "recorded_at": ..., "current_mileage": ...,
+    "fuel_level": ..., "latitude": ..., "longitude": ...}).
+    Returns (vehicle_id, recorded_at, {field: value}); raises ValueError with a message otherwise.
+    """
+    from rentals.utils import parse_datetime_param
+
+    if not isinstance(reading, dict):
+        raise ValueError('A reading must be a JSON object.')
+    vehicle_id = reading.get('vehicle_id')
+    if not isinstance(vehicle_id, int) or isinstance(vehicle_id, bool):
+        raise ValueError('vehicle_id must be an integer.')
+
+    recorded_at = timezone.now()
+    if reading.get('recorded_at') is not None:
+        recorded_at = parse_datetime_param(reading['recorded_at'])
+        if recorded_at is None:
+            raise ValueError('recorded_at must be an ISO 8601 datetime.')
+
+    fields = {}
+    mileage = reading.get('current_mileage')
+    if mileage is not None:
+        if not isinstance(mileage, int) or isinstance(mileage, bool) or mileage < 0:
+            raise ValueError('current_mileage must be a non-negative integer.')
+        fields['current_mileage'] = mileage
+
+    fuel_level = reading.get('fuel_level')
+    if fuel_level is not None:
+        # fits fuel_level's DecimalField(max_digits=5, decimal_places=2)
+        fuel_level = _decimal(fuel_level, '0.01')
+        if fuel_level is None or not 0 <= fuel_level < 1000:
+            raise ValueError('fuel_level must be a number between 0 and 999.99.')
+        fields['fuel_level'] = fuel_level
+
+    position = parse_position(reading.get('latitude'), reading.get('longitude'))
+    if position is not None:
+        fields['position'] = position
+
+    if not fields:
+        raise ValueError('A reading needs current_mileage, fuel_level or latitude/longitude.')
+    return vehicle_id, recorded_at, fields
+
+
+def parse_position(latitude, longitude):
+    """
+    (latitude, longitude) as Decimals rounded to the columns' 6 places, None if
+    neither is given. Raises ValueError with a message otherwise.
+    """
+    if (latitude is None) != (longitude is None):
+        raise ValueError('latitude and longitude must be sent together.')
+    if latitude is None:
+        return None
+    latitude, longitude = _decimal(latitude, '0.000001'), _decimal(longitude, '0.000001')
+    if latitude is None or longitude is None or not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('latitude must be within [-90, 90] and longitude within [-180, 180].')
+    return latitude, longitude
+
+
+def _decimal(value, places):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return None
+    try:
+        value = Decimal(str(value))
+    except InvalidOperation:
+        return None
+    if not value.is_finite():
+        return None
+    return value.quantize(Decimal(places))
+
+
+class TelemetryBuffer:
+    """Latest reported value of each field per (tenant, vehicle), flushed by one daemon thread."""
+
+    def __init__(self):
+        # (schema_name, vehicle_id) -> {field: (recorded_at, value)}
+        self._pending = {}
+        # every reading as received, appended to the history table on flush
+        self._history = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, schema_name, readings):
+        """Coalesce parsed (vehicle_id, recorded_at, fields) readings into the buffer."""
+        self._start_worker()
+        with self._lock:
+            self._history.extend((schema_name, *reading) for reading in readings)
+            for vehicle_id, recorded_at, fields in readings:
+                latest = self._pending.setdefault((schema_name, vehicle_id), {})
+                for field, value in fields.items():
+                    # a late reading never overwrites a newer one
+                    if field not in latest or latest[field][0] <= recorded_at:
+                        latest[field] = (recorded_at, value)
+            if len(self._pending) >= settings.TELEMETRY_MAX_PENDING:
+                self._wake.set()
+
+    def flush(self):
+        """Write everything buffered so far (used by the worker thread, tests and at exit)."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                history, self._history = self._history, []
+            if not pending:
+                return 0
+            close_old_connections()
+            by_schema = {}
+            for (schema_name, vehicle_id), latest in pending.items():
+                by_schema.setdefault(schema_name, {})[vehicle_id] = {field: value for field, (_, value) in latest.items()}
+            history_by_schema = {}
+            for schema_name, *reading in history:
+                history_by_schema.setdefault(schema_name, []).append(reading)
+            written = 0
+            for schema_name, vehicles in by_schema.items():
+                try:
+                    written += write_readings(schema_name, vehicles)
+                    append_history(schema_name, history_by_schema[schema_name])
+                except Exception:
+                    logger.exception('Failed to write telemetry of %s vehicles in schema %s', len(vehicles), schema_name)
+            return written
+
+    def _start_worker(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='vehicle-telemetry', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(settings.TELEMETRY_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Telemetry flush failed')
+
+
+def write_readings(schema_name, vehicles):
+    """
+    Apply {vehicle_id: {field: value}} to one tenant's vehicles with one
+    UPDATE per set of changed columns. Returns the number of vehicles written.
+    """
+    from . import geo
+    from .models import Vehicle
+
+    groups = {}
+    for vehicle_id, fields in vehicles.items():
+        groups.setdefault(frozenset(fields), []).append(vehicle_id)
+
+    with schema_context(schema_name):
+        for fields, vehicle_ids in groups.items():
+            columns = {}
+            for field in sorted(fields):
+                if field == 'position':
+                    columns['latitude'] = [vehicles[vehicle_id]['position'][0] for vehicle_id in vehicle_ids]
+                    columns['longitude'] = [vehicles[vehicle_id]['position'][1] for vehicle_id in vehicle_ids]
+                else:
+                    columns[field] = [vehicles[vehicle_id][field] for vehicle_id in vehicle_ids]
+            batch_size = settings.TELEMETRY_WRITE_BATCH_SIZE
+            for start in range(0, len(vehicle_ids), batch_size):
+                update_columns(
+                    Vehicle,
+                    vehicle_ids[start:start + batch_size],
+                    {column: values[start:start + batch_size] for column, values in columns.items()},
+                )
+
+        # the UPDATE sends no signals: move on the vehicle ETags and cached responses and this worker's spatial index directly
+        conditional.bump(Vehicle)
+        moved = {vehicle_id: fields['position'] for vehicle_id, fields in vehicles.items() if 'position' in fields}
+        if moved:
+            for vehicle_id, owner_id in Vehicle.objects.filter(id__in=moved).values_list('id', 'owner_id'):
+                geo.vehicle_moved(schema_name, vehicle_id, *moved[vehicle_id], owner_id)
+    return len(vehicles)
+
+
+def history_row(vehicle_id, recorded_at, fields):
+    """The TelemetryReading for one parsed reading."""
+    from .models import TelemetryReading
+
+    latitude, longitude = fields.get('position', (None, None))
+    return TelemetryReading(
+        vehicle_id=vehicle_id,
+        recorded_at=recorded_at,
+        current_mileage=fields.get('current_mileage'),
+        fuel_level=fields.get('fuel_level'),
+        latitude=latitude,
+        longitude=longitude,
+    )
+
+
+def append_history(schema_name, readings):
+    """Append parsed readings of existing vehicles to one tenant's telemetry history."""
+    from .models import TelemetryReading, Vehicle
+
+    with schema_context(schema_name):
+        # readings of unknown vehicles are dropped, as the UPDATE in write_readings drops them
+        existing = set(Vehicle.objects.filter(id__in={reading[0] for reading in readings}).values_list('id', flat=True))
+        TelemetryReading.objects.bulk_create(
+            [history_row(*reading) for reading in readings if reading[0] in existing],
+            batch_size=settings.TELEMETRY_WRITE_BATCH_SIZE,
+        )
+
+
+def downsample(vehicle_id, start, end, points):
+    """
+    One vehicle's readings in [start, end) reduced to at most `points` equal time buckets.
+    Postgres buckets the rows with date_bin() and computes min/max/avg per bucket, so only
+    the buckets reach Python, and the recorded_at range limits the scan to the partitions
+    of those months. Returns columnar lists: {'bucket_seconds', 't', 'count',
+    field: {'min', 'max', 'avg'}} with one entry per non-empty bucket.
+    """
+    from .models import TelemetryReading
+
+    bucket_seconds = max(1, math.ceil((end - start).total_seconds() / points))
+    bucket = Func(
+        Value(timedelta(seconds=bucket_seconds)), F('recorded_at'), Value(start),
+        function='date_bin', output_field=DateTimeField(),
+    )
+    aggregates = {'count': Count('id')}
+    for field in HISTORY_FIELDS:
+        aggregates.update({f'{field}__min': Min(field), f'{field}__max': Max(field), f'{field}__avg': Avg(field)})
+    rows = list(
+        TelemetryReading.objects.filter(vehicle_id=vehicle_id, recorded_at__gte=start, recorded_at__lt=end)
+        .annotate(bucket=bucket)
+        .values('bucket')
+        .annotate(**aggregates)
+        .order_by('bucket')
+    )
+
+    series = {'bucket_seconds': bucket_seconds, 't': [row['bucket'] for row in rows], 'count': [row['count'] for row in rows]}
+    for field, places in HISTORY_FIELDS.items():
+        averages = [row[f'{field}__avg'] for row in rows]
+        series[field] = {
+            'min': [row[f'{field}__min'] for row in rows],
+            'max': [row[f'{field}__max'] for row in rows],
+            'avg': [None if average is None else round(float(average), places) for average in averages],
+        }
+    return series
+
+
+def update_columns(model, pks, columns):
+    """
+    Set {column: [value per pk]} on the rows `pks` with a single UPDATE ... FROM unnest(...).
+    Same effect as bulk_update(objs, fields=list(columns)), but the values travel as one
+    array per column instead of a CASE WHEN per row, which Django needs ~1 ms per row to build.
+    """
+    opts = model._meta
+    quote = connection.ops.quote_name
+    fields = [opts.pk, *(opts.get_field(column) for column in columns)]
+    names = [quote(field.column) for field in fields]
+    arrays = ', '.join(f'%s::{field.db_type(connection)}[]' for field in fields)
+    assignments = ', '.join(f'{name} = data.{name}' for name in names[1:])
+    sql = (
+        f'UPDATE {quote(opts.db_table)} SET {assignments} '
+        f'FROM unnest({arrays}) AS data({", ".join(names)}) '
+        f'WHERE {quote(opts.db_table)}.{names[0]} = data.{names[0]}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [list(pks), *columns.values()])
+
+
+_buffer = TelemetryBuffer()
+# the worker is a daemon thread: without this, a restarting web worker drops its last window
+atexit.register(_buffer.flush)
+
+
+def ingest(schema_name, readings):
+    """Buffer parsed readings for the next flush."""
+    _buffer.add(schema_name, readings)
+
+
+def flush():
+    return _buffer.flush()
@@ -1,3 +1,771 @@
-from django.test import TestCase
+import base64
+import math
+import random
+from io import StringIO
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from django_tenants.test.cases import TenantTestCase
+from django_tenants.test.client import TenantClient
+from rest_framework.renderers import JSONRenderer
+
+from CarRentalService import conditional
+from CarRentalService.testing import QueryCountAssertions, TenantAPITestMixin, reset_process_state
+from CarRentalService.values_serializers import compile_serializer
+from rentals import notifications
+from rentals.models import Rental, Review, VehicleRating
+from users.models import User
+from . import availability, calendar, geo, search, telemetry
+from .management.commands.create_telemetry_partitions import add_months
+from .models import TelemetryReading, Vehicle
+from .serializers import VehicleSeializer
+
+
+class VehicleValuesSerializerTests(TenantTestCase):
+    """The compiled VehicleSeializer must render exactly like VehicleSeializer."""
+
+    def setUp(self):
+        self.vehicles = Vehicle.objects.bulk_create([
+            Vehicle(make='Toyota', model='Corolla', year=2018, license_plate='VAL 1', rental_rate_per_day=Decimal('45.5')),
+            Vehicle(make='Subaru', model='Forester', year=2020, license_plate='VAL 2', rental_rate_per_day=Decimal('120'),
+                    availability_status=False, current_mileage=123456, fuel_level=Decimal('37.25'),
+                    current_location=Decimal('12.5'), latitude=Decimal('-1.292066'), longitude=Decimal('36.821946')),
+            Vehicle(make='Škoda', model='Octavia “RS”', year=2015, license_plate='VAL 3', rental_rate_per_day=Decimal('0.99'),
+                    fuel_level=Decimal('0'), latitude=Decimal('0'), longitude=Decimal('-180')),
+            Vehicle(make='Mazda', model='CX-5', year=2022, license_plate='VAL 4', rental_rate_per_day=Decimal('75.00')),
+        ])
+        # no summary row, a summary without reviews, and averages that need rounding
+        VehicleRating.objects.bulk_create([
+            VehicleRating(vehicle=self.vehicles[1], review_count=0, rating_sum=0),
+            VehicleRating(vehicle=self.vehicles[2], review_count=3, rating_sum=11, stars_3=1, stars_4=2),
+            VehicleRating(vehicle=self.vehicles[3], review_count=1, rating_sum=5, stars_5=1),
+        ])
+
+    def test_vehicles_render_identically(self):
+        queryset = Vehicle.objects.select_related('rating_summary').order_by('id')
+        compiled = compile_serializer(VehicleSeializer)
+        self.assertEqual(
+            JSONRenderer().render(compiled.serialize(compiled.values(queryset))),
+            JSONRenderer().render(VehicleSeializer(queryset, many=True).data),
+        )
+
+    def test_values_not_shaped_like_the_columns(self):
+        # decimals with other precisions (and floats) take the fields' own conversion
+        vehicle = Vehicle(
+            id=99, make='Kia', model='Rio', year=2019, license_plate='VAL 99', rental_rate_per_day=Decimal('45.5'),
+            availability_status=True, current_mileage=None, fuel_level=Decimal('37.256'), current_location=1.5,
+            latitude=Decimal('-1.2920665'), longitude=Decimal('36.82'),
+        )
+        compiled = compile_serializer(VehicleSeializer)
+        row = {lookup: getattr(vehicle, lookup, None) for lookup in compiled.lookups}
+        self.assertEqual(
+            JSONRenderer().render(compiled.serialize([row])),
+            JSONRenderer().render(VehicleSeializer([vehicle], many=True).data),
+        )
+
+    def test_availability_endpoint_matches_serializer(self):
+        response = TenantClient(self.tenant).get('/vehicles/availability/', {
+            'rental_start': '2030-01-01T00:00:00Z', 'rental_end': '2030-01-02T00:00:00Z', 'page_size': 3,
+        })
+        # anonymous users see the vehicles without an owner, by id
+        page = Vehicle.objects.select_related('rating_summary').filter(owner__isnull=True).order_by('id')[:3]
+        self.assertEqual(response.content, JSONRenderer().render({
+            'count': 4,
+            'next': 'http://tenant.test.com/vehicles/availability/?page=2&page_size=3&rental_end=2030-01-02T00%3A00%3A00Z&rental_start=2030-01-01T00%3A00%3A00Z',
+            'previous': None,
+            'results': VehicleSeializer(page, many=True).data,
+        }))
+
+
+class VehicleEndpointQueryCountTests(TenantAPITestMixin, QueryCountAssertions, TenantTestCase):
+    """Queries run by each endpoint of vehicles/urls.py (with more rows than QUERY_REPEAT_LIMIT, so N+1 loops fail)."""
+
+    def setUp(self):
+        super().setUp()
+        self.vehicles = Vehicle.objects.bulk_create([
+            Vehicle(make='Toyota', model='Corolla', year=2015 + i, license_plate=f'QC {i}', rental_rate_per_day=Decimal('45.50'),
+                    latitude=Decimal('-1.29') + Decimal(i) / 100, longitude=Decimal('36.82'))
+            for i in range(8)
+        ])
+        VehicleRating.objects.bulk_create([
+            VehicleRating(vehicle=vehicle, review_count=2, rating_sum=7) for vehicle in self.vehicles
+        ])
+        self.start = timezone.now().replace(microsecond=0) + timedelta(days=10)
+        Rental.objects.bulk_create([
+            Rental(user=self.user, vehicle=vehicle, rental_start=self.start, rental_end=self.start + timedelta(days=2), status='confirmed')
+            for vehicle in self.vehicles[:3]
+        ])
+        TelemetryReading.objects.bulk_create([
+            TelemetryReading(vehicle=self.vehicles[0], recorded_at=timezone.now() - timedelta(hours=i), current_mileage=1000 - i)
+            for i in range(8)
+        ])
+        self.vehicle = self.vehicles[0]
+
+    def test_list(self):
+        self.assertRequestQueries(2, self.client.get, '/vehicles/')
+        # then from the response cache, after checking the tables' versions
+        self.assertRequestQueries(1, self.client.get, '/vehicles/')
+
+    def test_retrieve(self):
+        self.assertRequestQueries(2, self.client.get, f'/vehicles/{self.vehicle.pk}/')
+        self.assertRequestQueries(1, self.client.get, f'/vehicles/{self.vehicle.pk}/')
+
+    def test_create(self):
+        self.assertRequestQueries(3, self.admin_client.post, '/vehicles/', {
+            'make': 'Mazda', 'model': 'CX-5', 'year': 2022, 'license_plate': 'QC NEW', 'rental_rate_per_day': '75.00',
+        }, content_type='application/json', status_code=201)
+
+    def test_update(self):
+        self.assertRequestQueries(3, self.admin_client.put, f'/vehicles/{self.vehicle.pk}/', {
+            'make': 'Toyota', 'model': 'Yaris', 'year': 2019, 'license_plate': 'QC 0', 'rental_rate_per_day': '40.00',
+        }, content_type='application/json')
+
+    def test_partial_update(self):
+        self.assertRequestQueries(2, self.admin_client.patch, f'/vehicles/{self.vehicle.pk}/', {
+            'rental_rate_per_day': '40.00',
+        }, content_type='application/json')
+
+    def test_destroy(self):
+        vehicle = Vehicle.objects.create(make='Kia', model='Rio', year=2021, license_plate='QC GONE', rental_rate_per_day=Decimal('30.00'))
+        self.assertRequestQueries(5, self.admin_client.delete, f'/vehicles/{vehicle.pk}/', status_code=204)
+
+    def test_availability(self):
+        self.assertRequestQueries(3, self.client.get, '/vehicles/availability/', {
+            'rental_start': self.iso(self.start), 'rental_end': self.iso(self.start + timedelta(days=1)),
+        })
+
+    def test_calendar(self):
+        self.assertRequestQueries(3, self.client.get, '/vehicles/calendar/')
+
+    def test_nearby(self):
+        self.assertRequestQueries(3, self.client.get, '/vehicles/nearby/', {
+            'lat': '-1.29', 'lon': '36.82', 'radius': '50',
+            'rental_start': self.iso(self.start), 'rental_end': self.iso(self.start + timedelta(days=1)),
+        })
+
+    def test_search(self):
+        self.assertRequestQueries(2, self.client.get, '/vehicles/search/', {'q': 'toyota'})
+
+    def test_update_status(self):
+        self.assertRequestQueries(3, self.admin_client.put, f'/vehicles/{self.vehicle.pk}/update_status/', {
+            'current_mileage': 1200, 'fuel_level': '55.50', 'latitude': -1.3, 'longitude': 36.8,
+        }, content_type='application/json')
+
+    def test_telemetry(self):
+        # readings of vehicles this tenant doesn't have: nothing is buffered for the background writer
+        self.assertRequestQueries(1, self.admin_client.post, '/vehicles/telemetry/', [
+            {'vehicle_id': 10**6 + i, 'current_mileage': 100} for i in range(8)
+        ], content_type='application/json', status_code=202)
+
+    def test_telemetry_history(self):
+        self.assertRequestQueries(2, self.client.get, f'/vehicles/{self.vehicle.pk}/telemetry/')
+
+
+class ResponseCacheTests(TenantAPITestMixin, TenantTestCase):
+    """GET /vehicles/{id}/ through cached_response (CarRentalService/cache.py), retired by conditional.bump on commit."""
+
+    def setUp(self):
+        super().setUp()
+        self.enterContext(mock.patch.object(notifications, 'notify'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vehicle = Vehicle.objects.create(make='Toyota', model='Corolla', year=2020, license_plate='CACHED 1', rental_rate_per_day=Decimal('45.50'))
+        self.url = f'/vehicles/{self.vehicle.pk}/'
+
+    def get(self, client=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = (client or self.client).get(self.url)
+        self.assertEqual(response.status_code, 200)
+        reads = [query['sql'] for query in queries if f'FROM "{Vehicle._meta.db_table}"' in query['sql']]
+        return response.json(), len(reads)
+
+    def test_cached(self):
+        data, reads = self.get()
+        self.assertEqual((data['make'], reads), ('Toyota', 1))
+        self.assertEqual(self.get(), (data, 0))
+        # another user's response is cached apart
+        self.assertEqual(self.get(self.admin_client), (data, 1))
+
+    def test_retired_on_commit(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.vehicle.make = 'Subaru'
+            self.vehicle.save()
+        self.assertEqual(self.get()[0]['make'], 'Subaru')
+        start = timezone.now() - timedelta(days=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            rental = Rental.objects.create(user=self.user, vehicle=self.vehicle, rental_start=start, rental_end=start + timedelta(days=1), status='completed')
+            Review.objects.create(rental=rental, rating=4)
+        self.assertEqual(self.get()[0]['average_rating'], 4.0)
+
+    def test_kept_on_rollback(self):
+        data, _ = self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.vehicle.make = 'Subaru'
+                    self.vehicle.save()
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(self.get(), (data, 0))
+
+    def test_errors_not_cached(self):
+        url = f'/vehicles/{self.vehicle.pk + 1000}/'
+        self.assertEqual(self.client.get(url).status_code, 404)
+        # no write the response cache hears of
+        Vehicle.objects.filter(pk=self.vehicle.pk).update(id=self.vehicle.pk + 1000)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class AvailabilityIndexTests(TenantTestCase):
+    """vehicles/availability.py answers like the overlap query on the rentals table."""
+
+    def setUp(self):
+        super().setUp()
+        reset_process_state()
+        # sent by a thread whose database connection would outlive the test database
+        self.enterContext(mock.patch.object(notifications, 'notify'))
+        self.user = User.objects.create_user(username='tester', email='tester@example.com', password=None)
+        self.vehicles = Vehicle.objects.bulk_create([
+            Vehicle(make='Toyota', model='Corolla', year=2020, license_plate=f'AV {i}', rental_rate_per_day=Decimal('45.50')) for i in range(10)
+        ])
+        self.vehicle_ids = [vehicle.pk for vehicle in self.vehicles]
+        self.start = timezone.now().replace(microsecond=0) + timedelta(days=10)
+
+    def book(self, vehicle, start, end, status='active'):
+        return Rental.objects.create(user=self.user, vehicle=vehicle, rental_start=start, rental_end=end, status=status)
+
+    def busy_in_database(self, start, end, vehicle_ids=None):
+        rentals = Rental.objects.filter(status__in=Rental.BLOCKING_STATUSES, rental_start__lt=end, rental_end__gt=start)
+        if vehicle_ids is not None:
+            rentals = rentals.filter(vehicle_id__in=vehicle_ids)
+        return set(rentals.values_list('vehicle_id', flat=True))
+
+    def assertMatchesDatabase(self, start, end):
+        index = availability.get_index()
+        some = self.vehicle_ids[::3]
+        self.assertEqual(index.busy_vehicle_ids(start, end), self.busy_in_database(start, end), (start, end))
+        self.assertEqual(index.busy_among(some, start, end), self.busy_in_database(start, end, some), (start, end))
+
+    def test_random_rentals(self):
+        rng = random.Random(7)
+        rentals = []
+        for _ in range(300):
+            start = self.start + timedelta(hours=rng.randrange(24 * 365))
+            # a few rentals longer than LONG_RENTAL, kept outside the binary-searched list
+            length = timedelta(days=rng.randrange(32, 120)) if rng.random() < 0.1 else timedelta(hours=rng.randrange(1, 24 * 14))
+            rentals.append(Rental(
+                user=self.user, vehicle=rng.choice(self.vehicles), rental_start=start, rental_end=start + length,
+                status=rng.choice(['active', 'confirmed', 'completed', 'cancelled']),
+            ))
+        for rental in rentals:
+            # bookings the exclusion constraint would refuse are cancelled
+            if rental.status in Rental.BLOCKING_STATUSES and Rental.objects.filter(
+                vehicle=rental.vehicle, status__in=Rental.BLOCKING_STATUSES, rental_start__lt=rental.rental_end, rental_end__gt=rental.rental_start,
+            ).exists():
+                rental.status = 'cancelled'
+            rental.save()
+        self.assertTrue(any(rental.rental_end - rental.rental_start > timedelta(seconds=availability.LONG_RENTAL) for rental in rentals))
+
+        edges = [rental.rental_start for rental in rentals] + [rental.rental_end for rental in rentals]
+        for _ in range(200):
+            start = rng.choice(edges) if rng.random() < 0.5 else self.start + timedelta(minutes=rng.randrange(60 * 24 * 400))
+            self.assertMatchesDatabase(start, start + timedelta(hours=rng.randrange(1, 24 * 60)))
+
+    def test_touching_intervals(self):
+        short = self.book(self.vehicles[0], self.start, self.start + timedelta(days=2))
+        long = self.book(self.vehicles[1], self.start, self.start + timedelta(days=40))
+        index = availability.get_index()
+        for rental in (short, long):
+            vehicle_ids = {rental.vehicle_id}
+            # [start, end): a window ending when the rental starts or starting when it ends is free
+            self.assertFalse(index.busy_vehicle_ids(rental.rental_start - timedelta(days=1), rental.rental_start) & vehicle_ids)
+            self.assertFalse(index.busy_vehicle_ids(rental.rental_end, rental.rental_end + timedelta(days=1)) & vehicle_ids)
+            self.assertFalse(index.busy_among(vehicle_ids, rental.rental_end, rental.rental_end + timedelta(days=1)))
+            self.assertTrue(index.busy_vehicle_ids(rental.rental_end - timedelta(seconds=1), rental.rental_end) & vehicle_ids)
+            self.assertTrue(index.busy_among(vehicle_ids, rental.rental_start, rental.rental_start + timedelta(seconds=1)))
+            for start, end in [
+                (rental.rental_start - timedelta(days=1), rental.rental_start), (rental.rental_end, rental.rental_end + timedelta(days=1)),
+                (rental.rental_start - timedelta(days=1), rental.rental_start + timedelta(seconds=1)),
+                (rental.rental_end - timedelta(seconds=1), rental.rental_end + timedelta(days=1)),
+            ]:
+                self.assertMatchesDatabase(start, end)
+
+    def test_signals(self):
+        availability.get_index()
+        window = (self.start, self.start + timedelta(days=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            rental = self.book(self.vehicles[0], self.start, self.start + timedelta(hours=12))
+        self.assertEqual(availability.get_index().busy_vehicle_ids(*window), {self.vehicles[0].pk})
+
+        # a booking rolled back never shows up
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.book(self.vehicles[1], self.start, self.start + timedelta(hours=12))
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertMatchesDatabase(*window)
+
+        for change in [
+            {'rental_start': self.start + timedelta(days=2), 'rental_end': self.start + timedelta(days=3)},
+            {'rental_start': self.start - timedelta(days=40), 'rental_end': self.start + timedelta(hours=1)},
+            {'status': 'cancelled'},
+            {'status': 'confirmed'},
+        ]:
+            for name, value in change.items():
+                setattr(rental, name, value)
+            with self.captureOnCommitCallbacks(execute=True):
+                rental.save()
+            self.assertMatchesDatabase(*window)
+            self.assertMatchesDatabase(self.start + timedelta(days=2), self.start + timedelta(days=3))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            rental.delete()
+        self.assertEqual(availability.get_index().busy_vehicle_ids(*window), set())
+        self.assertEqual(len(availability.get_index()), 0)
+
+    @override_settings(AVAILABILITY_INDEX_TTL=60)
+    def test_ttl_reload(self):
+        index = availability.get_index()
+        # written by another worker: this one's signals don't see it
+        Rental.objects.bulk_create([
+            Rental(user=self.user, vehicle=self.vehicles[0], rental_start=self.start, rental_end=self.start + timedelta(days=1), status='active'),
+        ])
+        self.assertIs(availability.get_index(), index)
+        self.assertEqual(index.busy_vehicle_ids(self.start, self.start + timedelta(days=1)), set())
+
+        index.loaded_at -= 61
+        self.assertIsNot(availability.get_index(), index)
+        self.assertMatchesDatabase(self.start, self.start + timedelta(days=1))
+
+
+class ParseReadingTests(SimpleTestCase):
+
+    def test_valid(self):
+        vehicle_id, recorded_at, fields = telemetry.parse_reading({
+            'vehicle_id': 7, 'recorded_at': '2026-05-01T10:00:00Z', 'current_mileage': 1200,
+            'fuel_level': 55.555, 'latitude': '-1.2921', 'longitude': 36.8219,
+        })
+        self.assertEqual((vehicle_id, recorded_at), (7, datetime(2026, 5, 1, 10, tzinfo=dt_timezone.utc)))
+        self.assertEqual(fields, {
+            'current_mileage': 1200, 'fuel_level': Decimal('55.56'), 'position': (Decimal('-1.292100'), Decimal('36.821900')),
+        })
+
+    def test_recorded_at_defaults_to_now(self):
+        before = timezone.now()
+        _, recorded_at, fields = telemetry.parse_reading({'vehicle_id': 7, 'fuel_level': 0})
+        self.assertTrue(before <= recorded_at <= timezone.now())
+        self.assertEqual(fields, {'fuel_level': Decimal('0.00')})
+
+    def test_invalid(self):
+        for reading, message in [
+            ([], 'must be a JSON object'),
+            ({'vehicle_id': '7', 'current_mileage': 1}, 'vehicle_id must be an integer'),
+            ({'vehicle_id': True, 'current_mileage': 1}, 'vehicle_id must be an integer'),
+            ({'vehicle_id': 7, 'recorded_at': 'yesterday', 'current_mileage': 1}, 'recorded_at must be'),
+            ({'vehicle_id': 7, 'current_mileage': -1}, 'current_mileage must be'),
+            ({'vehicle_id': 7, 'current_mileage': 1.5}, 'current_mileage must be'),
+            ({'vehicle_id': 7, 'current_mileage': False}, 'current_mileage must be'),
+            ({'vehicle_id': 7, 'fuel_level': 1000}, 'fuel_level must be'),
+            ({'vehicle_id': 7, 'fuel_level': 'NaN'}, 'fuel_level must be'),
+            ({'vehicle_id': 7, 'fuel_level': 'full'}, 'fuel_level must be'),
+            ({'vehicle_id': 7, 'latitude': 1.5}, 'sent together'),
+            ({'vehicle_id': 7, 'latitude': 90.5, 'longitude': 0}, 'latitude must be within'),
+            ({'vehicle_id': 7, 'latitude': 0, 'longitude': 'Infinity'}, 'latitude must be within'),
+            ({'vehicle_id': 7}, 'needs current_mileage'),
+        ]:
+            with self.subTest(reading=reading), self.assertRaisesMessage(ValueError, message):
+                telemetry.parse_reading(reading)
+
+
+class TelemetryWriteTests(TenantTestCase):
+    """The telemetry buffer and its flush into the tenant's vehicles and history."""
+
+    def setUp(self):
+        super().setUp()
+        reset_process_state()
+        self.vehicles = Vehicle.objects.bulk_create([
+            Vehicle(make='Toyota', model='Corolla', year=2020, license_plate=f'TM {i}', rental_rate_per_day=Decimal('45.50'), current_mileage=100)
+            for i in range(3)
+        ])
+        # flushed by the test, not by the background thread, in the test's transaction (which close_old_connections would close)
+        self.enterContext(mock.patch.object(telemetry.TelemetryBuffer, '_start_worker'))
+        self.enterContext(mock.patch.object(telemetry, 'close_old_connections'))
+        self.buffer = telemetry.TelemetryBuffer()
+        self.time = timezone.now().replace(microsecond=0)
+
+    def reading(self, vehicle, minutes, **fields):
+        return telemetry.parse_reading({'vehicle_id': vehicle.pk, 'recorded_at': (self.time + timedelta(minutes=minutes)).isoformat(), **fields})
+
+    def test_late_reading_never_overwrites_a_newer_one(self):
+        vehicle = self.vehicles[0]
+        self.buffer.add(self.tenant.schema_name, [
+            self.reading(vehicle, 10, current_mileage=300, fuel_level=40),
+            # late for the mileage, but the only position
+            self.reading(vehicle, 5, current_mileage=250, latitude=1, longitude=2),
+        ])
+        self.buffer.add(self.tenant.schema_name, [self.reading(vehicle, 1, current_mileage=200, fuel_level=90)])
+        self.assertEqual(self.buffer.flush(), 1)
+
+        vehicle.refresh_from_db()
+        self.assertEqual(
+            (vehicle.current_mileage, vehicle.fuel_level, vehicle.latitude, vehicle.longitude),
+            (300, Decimal('40.00'), Decimal('1.000000'), Decimal('2.000000')),
+        )
+        # the history keeps every reading
+        self.assertEqual(
+            list(TelemetryReading.objects.filter(vehicle=vehicle).order_by('recorded_at').values_list('current_mileage', flat=True)),
+            [200, 250, 300],
+        )
+
+    def test_reading_at_the_same_time_wins(self):
+        vehicle = self.vehicles[0]
+        self.buffer.add(self.tenant.schema_name, [self.reading(vehicle, 0, fuel_level=10), self.reading(vehicle, 0, fuel_level=20)])
+        self.buffer.flush()
+        vehicle.refresh_from_db()
+        self.assertEqual(vehicle.fuel_level, Decimal('20.00'))
+
+    def test_flush(self):
+        first, second, untouched = self.vehicles
+        self.buffer.add(self.tenant.schema_name, [
+            self.reading(first, 0, current_mileage=150),
+            self.reading(second, 0, fuel_level=12.5, latitude=-1.5, longitude=36.5),
+            # unknown to this tenant: dropped
+            telemetry.parse_reading({'vehicle_id': 10**6, 'current_mileage': 1}),
+        ])
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(self.buffer.flush(), 0)
+
+        rows = {vehicle['id']: vehicle for vehicle in Vehicle.objects.values('id', 'current_mileage', 'fuel_level', 'latitude', 'longitude')}
+        self.assertEqual(rows[first.pk], {'id': first.pk, 'current_mileage': 150, 'fuel_level': None, 'latitude': None, 'longitude': None})
+        self.assertEqual(rows[second.pk], {
+            'id': second.pk, 'current_mileage': 100, 'fuel_level': Decimal('12.50'), 'latitude': Decimal('-1.500000'), 'longitude': Decimal('36.500000'),
+        })
+        self.assertEqual(rows[untouched.pk]['current_mileage'], 100)
+        self.assertEqual(TelemetryReading.objects.count(), 2)
+        # the UPDATE sends no signals: the vehicle ETags are bumped by the flush itself
+        self.assertTrue(any(isinstance(callback, conditional._Bump) for callback in callbacks))
+
+    def test_update_columns(self):
+        first, second, untouched = self.vehicles
+        telemetry.update_columns(Vehicle, [second.pk, first.pk, 10**6], {
+            'current_mileage': [20, 10, 30], 'fuel_level': [Decimal('2.00'), None, Decimal('3.00')],
+        })
+        self.assertEqual(
+            list(Vehicle.objects.order_by('id').values_list('current_mileage', 'fuel_level', 'make')),
+            [(10, None, 'Toyota'), (20, Decimal('2.00'), 'Toyota'), (100, None, 'Toyota')],
+        )
+
+
+class TelemetryHistoryTests(TenantTestCase):
+    """The monthly partitions of the telemetry history (create_telemetry_partitions) and downsample()."""
+
+    def setUp(self):
+        super().setUp()
+        self.vehicle, self.other = Vehicle.objects.bulk_create([
+            Vehicle(make='Toyota', model='Corolla', year=2020, license_plate=f'TH {i}', rental_rate_per_day=Decimal('45.50')) for i in range(2)
+        ])
+        self.this_month = timezone.localdate().replace(day=1)
+
+    def month_start(self, offset):
+        return timezone.make_aware(datetime.combine(add_months(self.this_month, offset), datetime.min.time()))
+
+    def record(self, vehicle, recorded_at, **fields):
+        TelemetryReading.objects.create(vehicle=vehicle, recorded_at=recorded_at, **fields)
+
+    def partitions(self):
+        """{partition name: number of rows in it}"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT child.relname, (SELECT COUNT(*) FROM vehicles_telemetryreading WHERE tableoid = child.oid) FROM pg_inherits '
+                'JOIN pg_class child ON child.oid = pg_inherits.inhrelid WHERE inhparent = %s::regclass',
+                [f'{connection.schema_name}.vehicles_telemetryreading'],
+            )
+            return dict(cursor.fetchall())
+
+    def maintain(self, *args):
+        stdout = StringIO()
+        call_command('create_telemetry_partitions', '--schema', self.tenant.schema_name, *args, stdout=stdout)
+        connection.set_tenant(self.tenant)
+        return stdout.getvalue()
+
+    def name(self, offset):
+        month = add_months(self.this_month, offset)
+        return f'vehicles_telemetryreading_y{month.year}m{month.month:02d}'
+
+    def test_create(self):
+        # arrived before their month's partition existed
+        self.record(self.vehicle, self.month_start(0) + timedelta(hours=1), current_mileage=1)
+        self.record(self.vehicle, self.month_start(1) - timedelta(microseconds=1), current_mileage=2)
+        self.record(self.vehicle, self.month_start(-1), current_mileage=3)
+        self.record(self.vehicle, self.month_start(-24), current_mileage=4)
+        self.assertEqual(self.partitions(), {'vehicles_telemetryreading_default': 4})
+
+        self.assertIn('created 3 telemetry partitions, dropped 0', self.maintain('--months-back', '1', '--months-ahead', '1'))
+        self.assertEqual(self.partitions(), {
+            'vehicles_telemetryreading_default': 1, self.name(-1): 1, self.name(0): 2, self.name(1): 0,
+        })
+        self.assertEqual(TelemetryReading.objects.count(), 4)
+        # new readings of those months go straight to their partition
+        self.record(self.other, self.month_start(1), current_mileage=5)
+        self.assertEqual(self.partitions()[self.name(1)], 1)
+
+        self.assertIn('created 0 telemetry partitions, dropped 0', self.maintain('--months-back', '1', '--months-ahead', '1'))
+
+    def test_retain_months(self):
+        for offset in range(-4, 1):
+            self.record(self.vehicle, self.month_start(offset) + timedelta(days=1), current_mileage=offset)
+        self.maintain('--months-back', '4', '--months-ahead', '0')
+        self.assertEqual(len(self.partitions()), 6)
+
+        # the partitions of months that ended more than two months ago
+        self.assertIn('created 0 telemetry partitions, dropped 2', self.maintain('--months-ahead', '0', '--retain-months', '2'))
+        self.assertEqual(set(self.partitions()), {'vehicles_telemetryreading_default', self.name(-2), self.name(-1), self.name(0)})
+        self.assertEqual(sorted(TelemetryReading.objects.values_list('current_mileage', flat=True)), [-2, -1, 0])
+
+    def test_downsample(self):
+        start = self.month_start(0) + timedelta(days=2)
+        for minutes, mileage, fuel_level in [(1, 10, None), (5, 20, '50.00'), (20, 30, '40.00'), (59, 45, None), (60, 99, None), (-1, 99, None)]:
+            self.record(self.vehicle, start + timedelta(minutes=minutes), current_mileage=mileage, fuel_level=fuel_level and Decimal(fuel_level))
+        self.record(self.other, start + timedelta(minutes=2), current_mileage=99)
+
+        series = telemetry.downsample(self.vehicle.pk, start, start + timedelta(hours=1), 4)
+        self.assertEqual(series['bucket_seconds'], 900)
+        self.assertEqual(series['t'], [start, start + timedelta(minutes=15), start + timedelta(minutes=45)])
+        self.assertEqual(series['count'], [2, 1, 1])
+        self.assertEqual(series['current_mileage'], {'min': [10, 30, 45], 'max': [20, 30, 45], 'avg': [15.0, 30.0, 45.0]})
+        self.assertEqual(series['fuel_level'], {'min': [Decimal('50.00'), Decimal('40.00'), None], 'max': [Decimal('50.00'), Decimal('40.00'), None], 'avg': [50.0, 40.0, None]})
+        self.assertEqual(series['latitude']['avg'], [None, None, None])
+
+        # buckets are rounded up to whole seconds, so there are never more than `points`
+        series = telemetry.downsample(self.vehicle.pk, start, start + timedelta(seconds=1000), 3)
+        self.assertEqual(series['bucket_seconds'], 334)
+        self.assertEqual(series['count'], [2])
+
+
+class OccupancyCalendarTests(SimpleTestCase):
+    """The busy bits of GET /vehicles/calendar/ (vehicles/calendar.py)."""
+
+    start = datetime(2030, 1, 1, tzinfo=dt_timezone.utc)
+
+    def at(self, hours):
+        return self.start + timedelta(hours=hours)
+
+    def busy(self, rentals, vehicle_ids=(1, 2, 3, 5), slots=10):
+        bits = calendar.occupancy(np.array(vehicle_ids, dtype=np.int64), rentals, self.start, timedelta(hours=1), slots)
+        return {vehicle_id: row.tobytes() for vehicle_id, row in zip(vehicle_ids, bits)}
+
+    def test_occupancy(self):
+        busy = self.busy([
+            (1, self.at(-5), self.at(2)),  # clipped at the start of the window
+            (2, self.at(3.5), self.at(4.25)),  # partial slots count as busy
+            (2, self.at(4), self.at(6)),
+            (3, self.at(8), self.at(20)),  # clipped at its end
+            (5, self.at(-3), self.at(0)),  # ends where the window starts
+            (5, self.at(10), self.at(12)),  # starts where it ends
+            (4, self.at(0), self.at(10)),  # not in the fleet list
+        ])
+        self.assertEqual({vehicle_id: calendar.encode(bits, 10, 'rle') for vehicle_id, bits in busy.items()}, {
+            1: [[0, 2]], 2: [[3, 3]], 3: [[8, 2]], 5: [],
+        })
+        self.assertEqual({vehicle_id: calendar.encode(bits, 10, 'bitset') for vehicle_id, bits in busy.items()}, {
+            1: base64.b64encode(bytes([0b11000000, 0])).decode(),
+            2: base64.b64encode(bytes([0b00011100, 0])).decode(),
+            3: base64.b64encode(bytes([0, 0b11000000])).decode(),
+            5: base64.b64encode(bytes(2)).decode(),
+        })
+
+    def test_runs_to_the_last_slot(self):
+        busy = self.busy([(1, self.at(0), self.at(1)), (1, self.at(2), self.at(3)), (1, self.at(7), self.at(9))], vehicle_ids=(1,), slots=9)
+        self.assertEqual(calendar.encode(busy[1], 9, 'rle'), [[0, 1], [2, 1], [7, 2]])
+
+    def test_no_rentals(self):
+        self.assertEqual(self.busy([]), dict.fromkeys((1, 2, 3, 5), bytes(2)))
+        self.assertEqual(self.busy([(1, self.at(0), self.at(1))], vehicle_ids=()), {})
+
+    def test_slot_count(self):
+        self.assertEqual(calendar.slot_count(self.start, self.at(10), 'hour'), 10)
+        # the last slot runs past the end of the window
+        self.assertEqual(calendar.slot_count(self.start, self.at(10.5), 'hour'), 11)
+        self.assertEqual(calendar.slot_count(self.start, self.at(49), 'day'), 3)
+
+    def test_version_after_eviction(self):
+        version = calendar._version('calendar-tests')
+        calendar.invalidate('calendar-tests')
+        self.assertEqual(calendar._version('calendar-tests'), version + 1)
+        # calendars cached under the versions before the eviction are never served again
+        cache.delete(calendar._version_key('calendar-tests'))
+        self.assertGreater(calendar._version('calendar-tests'), version + 1)
+
+
+class GeoIndexTests(SimpleTestCase):
+    """GeoIndex.nearest (vehicles/geo.py) against a scan of every position."""
+
+    def scan(self, positions, latitude, longitude, radius_km, limit):
+        ids = list(positions)
+        distances = geo.haversine_km(
+            latitude, longitude, np.array([positions[i][0] for i in ids]), np.array([positions[i][1] for i in ids]),
+        )
+        found = sorted((distance, vehicle_id) for vehicle_id, distance in zip(ids, distances.tolist()) if distance <= radius_km)
+        return [vehicle_id for _, vehicle_id in found[:limit]]
+
+    def nearest_ids(self, index, *args, **kwargs):
+        return [vehicle_id for vehicle_id, _ in index.nearest(*args, **kwargs)]
+
+    def test_matches_scan(self):
+        rng = random.Random(3)
+        # clustered near the antimeridian, the poles and elsewhere
+        centers = [(0, 179.9), (0, -179.9), (89.5, 0), (-89.7, 120), (-1.29, 36.82), (64.1, -21.9)]
+        positions = {}
+        for vehicle_id in range(1, 3001):
+            latitude, longitude = rng.choice(centers)
+            # reflected over the poles rather than clamped, which would tie their distances
+            latitude = latitude + rng.gauss(0, 0.3)
+            latitude = math.copysign(180, latitude) - latitude if abs(latitude) > 90 else latitude
+            longitude = (longitude + rng.gauss(0, 0.5) + 180) % 360 - 180
+            positions[vehicle_id] = (latitude, longitude)
+        index = geo.GeoIndex.load(((vehicle_id, lat, lon, None) for vehicle_id, (lat, lon) in positions.items()), 0.5)
+        for _ in range(200):
+            latitude, longitude = rng.choice(centers)
+            latitude, longitude = max(-90, min(90, latitude + rng.gauss(0, 0.3))), longitude + rng.gauss(0, 0.3)
+            longitude = (longitude + 180) % 360 - 180
+            radius, limit = rng.choice([1, 10, 50, 200]), rng.choice([1, 10, 100])
+            with self.subTest(latitude=latitude, longitude=longitude, radius=radius):
+                self.assertEqual(self.nearest_ids(index, latitude, longitude, radius, limit), self.scan(positions, latitude, longitude, radius, limit))
+
+    def test_across_the_antimeridian(self):
+        index = geo.GeoIndex.load([(1, 0, 179.95, None), (2, 0, -179.9, None), (3, 0, 170, None)], 0.1)
+        self.assertEqual(self.nearest_ids(index, 0, -179.98, 25, 10), [1, 2])
+        self.assertEqual(self.nearest_ids(index, 0, 179.99, 25, 10), [1, 2])
+
+    def test_near_a_pole(self):
+        # within 50 km of the north pole every longitude is close
+        index = geo.GeoIndex.load([(1, 89.9, 0, None), (2, 89.8, 180, None), (3, 89.7, -90, None), (4, 88, 0, None)], 0.5)
+        self.assertEqual(self.nearest_ids(index, 90, 0, 50, 10), [1, 2, 3])
+        self.assertEqual(self.nearest_ids(index, 89.95, 45, 50, 10), [1, 2, 3])
+
+    def test_owner_filter(self):
+        index = geo.GeoIndex.load([(1, 0, 0, 7), (2, 0, 0.01, None), (3, 0, 0.02, 8)], 0.1)
+        self.assertEqual(self.nearest_ids(index, 0, 0, 10, 10, owner_ids=[7]), [1])
+        self.assertEqual(self.nearest_ids(index, 0, 0, 10, 10, owner_ids=[None, 8]), [2, 3])
+        self.assertEqual(self.nearest_ids(index, 0, 0, 10, 10, owner_ids=[]), [])
+
+    def test_exclude_batches(self):
+        # a vehicle every ~1.1 km to the east, ids in order of distance
+        index = geo.GeoIndex.load([(vehicle_id, 0, vehicle_id / 100, None) for vehicle_id in range(1, 101)], 0.1)
+        batches = []
+
+        def exclude(ids):
+            batches.append(ids)
+            return {vehicle_id for vehicle_id in ids if vehicle_id <= 40 or vehicle_id % 2}
+
+        self.assertEqual(self.nearest_ids(index, 0, 0, 200, 5, exclude=exclude), [42, 44, 46, 48, 50])
+        # batches of max(2 * limit, 32), nearest first, until `limit` vehicles survive
+        self.assertEqual(batches, [list(range(1, 33)), list(range(33, 65))])
+        self.assertEqual(self.nearest_ids(index, 0, 0, 200, 5, exclude=lambda ids: set(ids)), [])
+
+    def test_move_and_remove(self):
+        index = geo.GeoIndex.load([(1, 0, 0, None), (2, 10, 10, None)], 0.1)
+        index.move(2, 0, 0.01, None)
+        index.move(1, None, None, None)
+        self.assertEqual(self.nearest_ids(index, 0, 0, 10, 10), [2])
+        index.remove(2)
+        self.assertEqual((self.nearest_ids(index, 0, 0, 10, 10), len(index)), ([], 0))
+
+
+class UpdateStatusTests(TenantAPITestMixin, TenantTestCase):
+    """PUT /vehicles/{id}/update_status/."""
+
+    def setUp(self):
+        super().setUp()
+        self.vehicle = Vehicle.objects.create(make='Toyota', model='Corolla', year=2020, license_plate='STATUS 1', rental_rate_per_day=Decimal('45.50'))
+
+    def update(self, data):
+        return self.admin_client.put(f'/vehicles/{self.vehicle.pk}/update_status/', data, content_type='application/json')
+
+    def test_position(self):
+        response = self.update({'latitude': '-1.2920659', 'longitude': 36.8219462})
+        self.assertEqual(response.status_code, 200)
+        self.vehicle.refresh_from_db()
+        self.assertEqual((self.vehicle.latitude, self.vehicle.longitude), (Decimal('-1.292066'), Decimal('36.821946')))
+
+    def test_invalid_position(self):
+        for data in [
+            {'latitude': True, 'longitude': True}, {'latitude': 1}, {'latitude': 91, 'longitude': 0},
+            {'latitude': 0, 'longitude': 'east'}, {'latitude': 'NaN', 'longitude': 0}, {'latitude': [1], 'longitude': 0},
+        ]:
+            with self.subTest(data=data):
+                self.assertEqual(self.update(data).status_code, 400)
+        self.vehicle.refresh_from_db()
+        self.assertIsNone(self.vehicle.latitude)
+
+
+class VehicleSearchTests(TenantTestCase):
+    """vehicles/search.py: word-prefix matching, ranking and the typo fallback."""
+
+    def setUp(self):
+        reset_process_state()
+        rows = [
+            ('corolla', 'Toyota', 'Corolla', 'KDA 123A', 2018),
+            ('camry', 'Toyota', 'Camry', 'KDB 456B', 2021),
+            ('toyland', 'Kia', 'Toyland', 'KCC 789C', 2018),
+            ('benz', 'Mercedes-Benz', 'C-Class', 'KBZ-100', 2020),
+            ('corolacar', 'Ford', 'Corolacar', 'KFD 111F', 2019),
+            ('both', 'Toyota', 'Corolacar Corolla', 'KTT 222T', 2019),
+        ]
+        self.vehicles = {
+            name: Vehicle.objects.create(make=make, model=model, license_plate=plate, year=year, rental_rate_per_day=Decimal('50.00'))
+            for name, make, model, plate, year in rows
+        }
+
+    def search(self, query, limit=10):
+        names = {vehicle.pk: name for name, vehicle in self.vehicles.items()}
+        return [names[vehicle.pk] for vehicle in search.search(Vehicle.objects.all(), query, limit)]
+
+    def test_prefixes_of_words(self):
+        self.assertEqual(self.search('toy cor'), ['corolla', 'both'])
+        self.assertEqual(self.search('cor toy'), ['corolla', 'both'])
+        self.assertEqual(self.search('kda 12'), ['corolla'])
+        self.assertEqual(self.search('2018'), ['toyland', 'corolla'])
+        # terms only match where a word starts
+        self.assertEqual(self.search('oyo'), [])
+
+    def test_hyphenated_words(self):
+        for query in ['mercedes benz', 'benz', 'Mercedes-Benz', 'c-class', 'class kbz', 'kbz-100']:
+            with self.subTest(query=query):
+                self.assertEqual(self.search(query), ['benz'])
+
+    def test_wildcards_are_stripped(self):
+        self.assertEqual(search.parse_terms('To%y_C\\or'), ['to', 'y', 'c', 'or'])
+        for query in ['%', '_', '\\', '%%_\\']:
+            with self.subTest(query=query):
+                self.assertEqual(self.search(query), [])
+        self.assertEqual(self.search('cam%'), ['camry'])
+
+    def test_ranking(self):
+        # where the first term starts (make, then model), then the shorter document
+        self.assertEqual(self.search('toy'), ['camry', 'corolla', 'both', 'toyland'])
+        self.assertEqual(self.search('toy', limit=2), ['camry', 'corolla'])
+
+    def test_typo_fills_a_short_page(self):
+        # "corola" starts a word of two vehicles; its correction "corolla" adds the other Corolla once
+        self.assertEqual(search.correct(['corola', 'toy', '2018']), ['corolla', 'toy', '2018'])
+        self.assertEqual(self.search('corola'), ['corolacar', 'both', 'corolla'])
+        # a full page is not corrected
+        self.assertEqual(self.search('corola', limit=2), ['corolacar', 'both'])
+        self.assertEqual(self.search('toyotta camr'), ['camry'])
+        # years, plates and short terms are never corrected
+        self.assertEqual(self.search('2017'), [])
+        self.assertEqual(self.search('cmr'), [])
@@ -1,17 +1,49 @@
 from rest_framework import viewsets, status, permissions
-from .models import Vehicle
+from .models import TelemetryReading, Vehicle
 from .serializers import VehicleSeializer
 from .filters import VehicleFilter, OwnerFilter
 from .permissions import IsOwnerOrAdmin
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAdminUser
-from rentals.models import Rental
+from .pagination import AvailabilityPagination
+from . import availability as availability_index
+from . import calendar as occupancy_calendar
+from . import geo
+from . import search as vehicle_search
+from . import telemetry
+from .parsers import NDJSONParser
+from rentals.models import VehicleRating
+from rentals.utils import parse_datetime_param
+from CarRentalService.cache import cached_response
+from CarRentalService.fastjson import JSONParser
+from CarRentalService.conditional import ConditionalGetMixin
+from CarRentalService.values_serializers import ValuesListMixin
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db import connection
+from django.conf import settings
+from datetime import timedelta
+from functools import partial
+from django.utils import timezone
 
 
-class VehicleListView(viewsets.ModelViewSet):
-    queryset = Vehicle.objects.all()
+class VehicleListView(ConditionalGetMixin, ValuesListMixin, viewsets.ModelViewSet):
+    queryset = Vehicle.objects.select_related('rating_summary')
     serializer_class = VehicleSeializer
+    # polled endpoints answer If-None-Match with 304 until one of these tables changes
+    conditional_actions = {
+        'list': [Vehicle, VehicleRating],
+        'retrieve': [Vehicle, VehicleRating],
+    }
+    # most queries an action may run (CarRentalService/query_budget.py), as pinned in tests.py
+    query_budget = {
+        'list': 2,
+        'retrieve': 2,
+        'availability': 3,
+        'calendar': 3,
+        'nearby': 3,
+        'search': 2,
+        'telemetry_history': 2,
+    }
 
     # 1. filtering, searching, and ordering
     filter_backends = [OwnerFilter]
@@ -20,39 +52,153 @@ class VehicleListView(viewsets.ModelViewSet):
     ordering_fields = ['year', 'make', 'model', 'rental_rate_per_day']
 
     #  2. Set permissions
+    # (actions declaring their own permission_classes, e.g. update_status and telemetry, keep them)
+    permission_classes = [IsAuthenticatedOrReadOnly]
+
     def get_permissions(self):
         if self.action in ['create', 'update', 'partial_update', 'destroy']:
-            permission_classes = [IsAdminUser]
-        else:
-            permission_classes = [IsAuthenticatedOrReadOnly]
-        return [permission() for permission in permission_classes]
+            return [IsAdminUser()]
+        return super().get_permissions()
+
+    # list and detail responses are cached until a vehicle or a rating changes (CarRentalService/cache.py)
+    @cached_response(Vehicle, VehicleRating)
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_response(Vehicle, VehicleRating)
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
     
     # 3. Vehicle Availability Endpoint: GET /vehicles/availability/?rental_start=&rental_end/ [cite: 33]
+    # Optional filters: make, year_min, year_max, rate_min, rate_max. Results are paginated.
     @action(detail=False, methods=['get'])
     def availability(self, request):
-        rental_start = request.query_params.get('rental_start')
-        rental_end = request.query_params.get('rental_end')
+        rental_start = parse_datetime_param(request.query_params.get('rental_start'))
+        rental_end = parse_datetime_param(request.query_params.get('rental_end'))
 
         if not rental_start or not rental_end:
-            return Response({'detail': 'Both rental_start and rental_end query parameters are required.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        # 1. Find the IDs of vehicles that are NOT available (i.e., have overlapping active rentals)
-        unavailable_vehicle_ids = Rental.objects.filter(
-            status='active',
-            rental_start__lt=rental_end,
-            rental_end__gt=rental_start
-        ).values_list('vehicle_id', flat=True).distinct()
-
-        # 2. Filter the entire vehicle list to exclude unavailable IDs
-        available_vehicles = Vehicle.objects.exclude(id__in=unavailable_vehicle_ids)
-        
-        # Note: If you have a vehicle field 'availability_status', you can filter by that too:
-        # available_vehicles = available_vehicles.filter(availability_status=True)
-
-        serializer = self.get_serializer(available_vehicles, many=True)
-        return Response(serializer.data)
+            return Response({'detail': 'Both rental_start and rental_end query parameters are required (ISO 8601).'}, status=status.HTTP_400_BAD_REQUEST)
+        if rental_start >= rental_end:
+            return Response({'detail': 'rental_end must be after rental_start.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # 1. Ask the tenant's in-memory interval index which vehicles are booked (active or confirmed) in the window
+        unavailable_vehicle_ids = availability_index.get_index().busy_vehicle_ids(rental_start, rental_end)
+
+        # 2. Exclude them from the vehicles this user may see and apply the optional filters
+        available_vehicles = self.filter_queryset(self.get_queryset()).exclude(id__in=unavailable_vehicle_ids)
+        filterset = VehicleFilter(request.query_params, queryset=available_vehicles)
+        if not filterset.is_valid():
+            return Response(filterset.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # 3. Only serialize the requested page (from values() rows)
+        return self.values_response(filterset.qs.order_by('id'), paginator=AvailabilityPagination())
     
-    # 4. Vehicle Status Update Endpoint
+    # 4. Fleet Occupancy Calendar: GET /vehicles/calendar/?from=&to=&granularity=hour|day&encoding=bitset|rle
+    # One entry per vehicle: base64 of one bit per slot (most significant bit first, 1 = booked),
+    # or [first_slot, length] runs of booked slots. Defaults to the next 90 days by day.
+    @action(detail=False, methods=['get'])
+    def calendar(self, request):
+        granularity = request.query_params.get('granularity', 'day')
+        encoding = request.query_params.get('encoding', 'bitset')
+        if granularity not in occupancy_calendar.GRANULARITIES:
+            return Response({'detail': 'granularity must be "hour" or "day".'}, status=status.HTTP_400_BAD_REQUEST)
+        if encoding not in occupancy_calendar.ENCODINGS:
+            return Response({'detail': 'encoding must be "bitset" or "rle".'}, status=status.HTTP_400_BAD_REQUEST)
+
+        #A. Window: from midnight today for 90 days unless given
+        window_from = occupancy_calendar.parse_bound(request.query_params.get('from') or timezone.localdate().isoformat())
+        window_to = window_from and occupancy_calendar.parse_bound(request.query_params.get('to') or (window_from + timedelta(days=90)).isoformat())
+        if not window_from or not window_to:
+            return Response({'detail': 'from and to must be ISO 8601 dates or datetimes.'}, status=status.HTTP_400_BAD_REQUEST)
+        if window_from >= window_to:
+            return Response({'detail': 'to must be after from.'}, status=status.HTTP_400_BAD_REQUEST)
+        if window_to - window_from > timedelta(days=settings.CALENDAR_MAX_DAYS):
+            return Response({'detail': f'The window can span at most {settings.CALENDAR_MAX_DAYS} days.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        #B. Occupancy of the whole fleet (cached), reduced to the vehicles this user may see
+        calendar = occupancy_calendar.fleet_calendar(window_from, window_to, granularity)
+        slots = occupancy_calendar.slot_count(window_from, window_to, granularity)
+        vehicle_ids = self.filter_queryset(Vehicle.objects.order_by('id')).values_list('id', flat=True)
+        free = bytes(-(-slots // 8))  # vehicles added since the calendar was cached have no bookings in it
+        return Response({
+            'from': window_from,
+            'to': window_to,
+            'granularity': granularity,
+            'slots': slots,
+            'encoding': encoding,
+            'vehicles': [
+                {'vehicle_id': vehicle_id, 'busy': occupancy_calendar.encode(calendar.get(vehicle_id, free), slots, encoding)}
+                for vehicle_id in vehicle_ids
+            ],
+        }, status=status.HTTP_200_OK)
+
+    # 5. Nearest Available Vehicles: GET /vehicles/nearby/?lat=&lon=&radius=&limit=&rental_start=&rental_end=
+    # radius in km (default 10). With a rental window, vehicles booked (active or confirmed) in it are skipped.
+    @action(detail=False, methods=['get'])
+    def nearby(self, request):
+        try:
+            latitude = float(request.query_params['lat'])
+            longitude = float(request.query_params['lon'])
+            radius = float(request.query_params.get('radius', 10))
+            limit = int(request.query_params.get('limit', 10))
+        except (KeyError, ValueError):
+            return Response({'detail': 'lat and lon are required; lat, lon and radius must be numbers and limit an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return Response({'detail': 'lat must be within [-90, 90] and lon within [-180, 180].'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 0 < radius <= settings.GEO_MAX_RADIUS_KM:
+            return Response({'detail': f'radius must be greater than 0 and at most {settings.GEO_MAX_RADIUS_KM:g} km.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= limit <= 100:
+            return Response({'detail': 'limit must be between 1 and 100.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        #A. With a rental window, skip vehicles the availability index has booked in it
+        exclude = None
+        if 'rental_start' in request.query_params or 'rental_end' in request.query_params:
+            rental_start = parse_datetime_param(request.query_params.get('rental_start'))
+            rental_end = parse_datetime_param(request.query_params.get('rental_end'))
+            if not rental_start or not rental_end:
+                return Response({'detail': 'Both rental_start and rental_end are required for a rental window (ISO 8601).'}, status=status.HTTP_400_BAD_REQUEST)
+            if rental_start >= rental_end:
+                return Response({'detail': 'rental_end must be after rental_start.'}, status=status.HTTP_400_BAD_REQUEST)
+            # only the candidates nearest the point are checked, not the whole fleet
+            bookings = availability_index.get_index()
+            exclude = partial(bookings.busy_among, rental_start=rental_start, rental_end=rental_end)
+
+        #B. Nearest free vehicles from the spatial index; visibility mirrors OwnerFilter
+        if request.user.is_staff or request.user.is_superuser:
+            owner_ids = None
+        elif request.user.is_authenticated:
+            owner_ids = [request.user.pk, None]
+        else:
+            owner_ids = [None]
+        nearest = geo.get_index().nearest(latitude, longitude, radius, limit, exclude=exclude, owner_ids=owner_ids)
+
+        #C. Load and serialize only those vehicles, nearest first
+        vehicles = self.get_queryset().in_bulk([vehicle_id for vehicle_id, _ in nearest])
+        nearest = [(vehicle_id, distance) for vehicle_id, distance in nearest if vehicle_id in vehicles]
+        serializer = self.get_serializer([vehicles[vehicle_id] for vehicle_id, _ in nearest], many=True)
+        results = [{**data, 'distance_km': round(distance, 3)} for data, (_, distance) in zip(serializer.data, nearest)]
+        return Response({'count': len(results), 'results': results}, status=status.HTTP_200_OK)
+
+    # 6. Vehicle Search: GET /vehicles/search/?q=&limit=
+    # Matches make, model, license plate and year by substring, word prefix or close spelling
+    # (trigram index, vehicles/search.py), best match first. Suited to as-you-type autocomplete.
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'detail': 'The q query parameter is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= settings.VEHICLE_SEARCH_MAX_RESULTS:
+            return Response({'detail': f'limit must be an integer between 1 and {settings.VEHICLE_SEARCH_MAX_RESULTS}.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        vehicles = vehicle_search.search(self.filter_queryset(self.get_queryset()), query, limit)
+        serializer = self.get_serializer(vehicles, many=True)
+        return Response({'count': len(vehicles), 'results': serializer.data}, status=status.HTTP_200_OK)
+
+    # 7. Vehicle Status Update Endpoint
     # PUT /vehicles/{id}/update_status/
     @action(detail=True, methods=['put'], permission_classes=[permissions.IsAdminUser])
     def update_status(self, request, pk=None):
@@ -62,6 +208,16 @@ class VehicleListView(viewsets.ModelViewSet):
         mileage = request.data.get('current_mileage')
         fuel_level = request.data.get('fuel_level')
         location = request.data.get('current_location')
+        latitude = request.data.get('latitude')
+        longitude = request.data.get('longitude')
+
+        # a position is reported as a pair and feeds the spatial index behind /vehicles/nearby/
+        try:
+            position = telemetry.parse_position(latitude, longitude)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if position is not None:
+            vehicle.latitude, vehicle.longitude = position
 
         if mileage is not None:
             vehicle.current_mileage = mileage
@@ -72,6 +228,73 @@ class VehicleListView(viewsets.ModelViewSet):
 
         vehicle.save()
 
+        # reported readings also go to the telemetry history behind GET /vehicles/{id}/telemetry/
+        if mileage is not None or fuel_level is not None or latitude is not None:
+            TelemetryReading.objects.create(
+                vehicle=vehicle,
+                recorded_at=timezone.now(),
+                current_mileage=vehicle.current_mileage if mileage is not None else None,
+                fuel_level=vehicle.fuel_level if fuel_level is not None else None,
+                latitude=vehicle.latitude if latitude is not None else None,
+                longitude=vehicle.longitude if latitude is not None else None,
+            )
+
         #return standard serrializer data for verification
         serializer = self.get_serializer(vehicle)
-        return Response(serializer.data, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    # 8. Telemetry Ingest Endpoint: POST /vehicles/telemetry/
+    # A JSON array or NDJSON (application/x-ndjson) of readings:
+    # {"vehicle_id": 1, "recorded_at": "...", "current_mileage": 1200, "fuel_level": 55.5, "latitude": -1.29, "longitude": 36.82}
+    # Readings are buffered and written in the background (vehicles/telemetry.py), so nothing is re-serialized here.
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAdminUser], parser_classes=[JSONParser, NDJSONParser])
+    def telemetry(self, request):
+        readings = request.data
+        if not isinstance(readings, list):
+            return Response({'detail': 'Expected a JSON array or NDJSON of readings.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(readings) > settings.TELEMETRY_MAX_READINGS:
+            return Response({'detail': f'At most {settings.TELEMETRY_MAX_READINGS} readings per request.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        #A. Validate every reading on its own
+        parsed, rejected = [], []
+        for position, reading in enumerate(readings):
+            try:
+                parsed.append((position, telemetry.parse_reading(reading)))
+            except ValueError as e:
+                rejected.append({'index': position, 'detail': str(e)})
+
+        #B. Drop readings for vehicles this tenant doesn't have, with one query
+        known = set(Vehicle.objects.filter(id__in={reading[0] for _, reading in parsed}).values_list('id', flat=True))
+        accepted = []
+        for position, reading in parsed:
+            if reading[0] in known:
+                accepted.append(reading)
+            else:
+                rejected.append({'index': position, 'detail': 'Vehicle not found.'})
+
+        telemetry.ingest(connection.schema_name, accepted)
+        rejected.sort(key=lambda rejection: rejection['index'])
+        return Response({'accepted': len(accepted), 'rejected': rejected}, status=status.HTTP_202_ACCEPTED)
+
+    # 9. Telemetry History Endpoint: GET /vehicles/{id}/telemetry/?start=&end=&points=
+    # The vehicle's readings in [start, end) (default: the last 7 days) downsampled to at most `points`
+    # (default 500) time buckets, as columns: t, count and {min, max, avg} per field.
+    @action(detail=True, methods=['get'], url_path='telemetry', permission_classes=[permissions.IsAuthenticated])
+    def telemetry_history(self, request, pk=None):
+        vehicle = self.get_object()
+
+        end = parse_datetime_param(request.query_params.get('end')) if 'end' in request.query_params else timezone.now()
+        start = parse_datetime_param(request.query_params.get('start')) if 'start' in request.query_params else end and end - timedelta(days=7)
+        if not start or not end:
+            return Response({'detail': 'start and end must be ISO 8601 datetimes.'}, status=status.HTTP_400_BAD_REQUEST)
+        if start >= end:
+            return Response({'detail': 'end must be after start.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            points = int(request.query_params.get('points', 500))
+        except ValueError:
+            points = 0
+        if not 1 <= points <= settings.TELEMETRY_MAX_POINTS:
+            return Response({'detail': f'points must be an integer between 1 and {settings.TELEMETRY_MAX_POINTS}.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        series = telemetry.downsample(vehicle.pk, start, end, points)
+        return Response({'vehicle_id': vehicle.pk, 'start': start, 'end': end, **series}, status=status.HTTP_200_OK)